@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import os
 from typing import Optional
@@ -12,6 +11,11 @@ from ssh.runner import Node
 
 REMOTE_TEMP_DIR = '/opt/dcos_install_tmp'
 
+# Copies of packages and the bootstrap tarball get as long as they take at this rate, rather than the
+# process_timeout meant for commands.
+MIN_COPY_BYTES_PER_SEC = 256 * 1024
+MIN_COPY_TIMEOUT = 600
+
 log = logging.getLogger(__name__)
 
 
@@ -23,6 +27,9 @@ def get_async_runner(config, hosts, async_delegate=None):
 
     # if ssh_parallelism is not set, use 20 concurrent ssh sessions by default.
     parallelism = config.hacky_default_get('ssh_parallelism', 20)
+    # The number of concurrent ssh sessions grows from there up to ssh_max_parallelism while hosts keep responding
+    # as fast, and the local machine has the resources for it.
+    max_parallelism = config.hacky_default_get('ssh_max_parallelism', 100)
 
     return ssh.runner.MultiRunner(
         hosts,
@@ -32,7 +39,11 @@ def get_async_runner(config, hosts, async_delegate=None):
         extra_opts=extra_ssh_options,
         async_delegate=async_delegate,
         parallelism=parallelism,
-        default_port=int(config.hacky_default_get('ssh_port', 22)))
+        max_parallelism=int(max_parallelism),
+        default_port=int(config.hacky_default_get('ssh_port', 22)),
+        connection_reuse=True,
+        batch_commands=True,
+        stream_output=True)
 
 
 def add_pre_action(chain, ssh_user):
@@ -130,7 +141,13 @@ def _add_copy_dcos_install(chain, local_install_path=SERVE_DIR):
     chain.add_copy(local_install_path, remote_install_path, stage='Copying dcos_install.sh')
 
 
-def _add_copy_packages(chain, local_pkg_base_path=SERVE_DIR):
+def _get_copy_timeout(local_path):
+    if not os.path.exists(local_path):
+        return None
+    return max(MIN_COPY_TIMEOUT, os.path.getsize(local_path) // MIN_COPY_BYTES_PER_SEC)
+
+
+def _add_copy_packages(chain, local_pkg_base_path=SERVE_DIR, peer_distribution=False):
     if not os.path.isfile(CLUSTER_PACKAGES_PATH):
         err_msg = '{} not found'.format(CLUSTER_PACKAGES_PATH)
         log.error(err_msg)
@@ -142,15 +159,22 @@ def _add_copy_packages(chain, local_pkg_base_path=SERVE_DIR):
         local_pkg_path = os.path.join(local_pkg_base_path, params['filename'])
 
         chain.add_execute(['mkdir', '-p', destination_package_dir], stage='Creating package directory')
-        chain.add_copy(local_pkg_path, destination_package_dir,
-                       stage='Copying packages')
+        _add_copy_file(chain, local_pkg_path, destination_package_dir, 'Copying packages', peer_distribution)
 
 
-def _add_copy_bootstap(chain, local_bs_path):
+def _add_copy_bootstap(chain, local_bs_path, peer_distribution=False):
     remote_bs_path = REMOTE_TEMP_DIR + '/bootstrap'
     chain.add_execute(['mkdir', '-p', remote_bs_path], stage='Creating directory')
-    chain.add_copy(local_bs_path, remote_bs_path,
-                   stage='Copying bootstrap')
+    _add_copy_file(chain, local_bs_path, remote_bs_path, 'Copying bootstrap', peer_distribution)
+
+
+def _add_copy_file(chain, local_path, remote_dir, stage, peer_distribution):
+    # With peer_distribution hosts which have the file serve it to the others, which forwards the
+    # ssh agent holding the cluster-wide key to them, see CommandChain.add_distribute.
+    if peer_distribution:
+        chain.add_distribute(local_path, remote_dir, stage=stage, timeout=_get_copy_timeout(local_path))
+    else:
+        chain.add_copy(local_path, remote_dir, stage=stage, timeout=_get_copy_timeout(local_path))
 
 
 def _get_bootstrap_tarball(tarball_base_dir=BOOTSTRAP_DIR):
@@ -174,11 +198,7 @@ def _get_bootstrap_tarball(tarball_base_dir=BOOTSTRAP_DIR):
 
 
 def _read_state_file(state_file):
-    if not os.path.isfile(state_file):
-        return {}
-
-    with open(state_file) as fh:
-        return json.load(fh)
+    return ssh.utils.json_state_store.get(state_file) or {}
 
 
 def _remove_host(state_file, host):
@@ -194,8 +214,7 @@ def _remove_host(state_file, host):
     except KeyError:
         return False
 
-    with open(state_file, 'w') as fh:
-        json.dump(json_state, fh)
+    ssh.utils.json_state_store.set(state_file, json_state, flush=True)
 
     return True
 
@@ -257,8 +276,10 @@ def install_dcos(
 
     add_pre_action(chain, runner.user)
     _add_copy_dcos_install(chain)
-    _add_copy_packages(chain)
-    _add_copy_bootstap(chain, bootstrap_tarball)
+    # Opt in, as it forwards the ssh agent to the hosts.
+    peer_distribution = str(config.hacky_default_get('ssh_peer_distribution', 'false')).lower() == 'true'
+    _add_copy_packages(chain, peer_distribution=peer_distribution)
+    _add_copy_bootstap(chain, bootstrap_tarball, peer_distribution=peer_distribution)
 
     chain.add_execute(
         lambda node: (
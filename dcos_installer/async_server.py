@@ -4,17 +4,20 @@ import importlib
 import json
 import logging
 import os
+import time
 
 import pkg_resources
 from aiohttp import web
 
 import dcos_installer.action_lib
+import dcos_installer.jobs
 import gen.calc
 import pkgpanda.util
 from dcos_installer import backend
 from dcos_installer.config import Config, make_default_config_if_needed
 from dcos_installer.constants import CONFIG_PATH, IP_DETECT_PATH, SSH_KEY_PATH, STATE_DIR
 from ssh.runner import Node
+from ssh.utils import json_state_store
 
 
 log = logging.getLogger()
@@ -39,6 +42,12 @@ remove_on_done = ['preflight', 'postflight']
 # TODO(cmaloney): Kill this. Should store somewhere proper
 current_action = ""
 
+# How often an idle event stream sends a comment to check the client is still there.
+EVENT_KEEPALIVE_SECONDS = 15
+
+# Size of the reads the logs are streamed in.
+LOG_CHUNK_SIZE = 2**16
+
 
 def root(request):
     """Return the root endpoint, serve the index.html.
@@ -109,7 +118,8 @@ def configure(request):
         new_config = extract_external(new_config, 'ip_detect_script', 'ip_detect_path', IP_DETECT_PATH, 0o644)
 
         log.info('POST to configure: {}'.format(new_config))
-        messages = backend.create_config_from_post(new_config, CONFIG_PATH)
+        messages = yield from dcos_installer.jobs.run_in_executor(
+            backend.create_config_from_post, new_config, CONFIG_PATH)
 
         # Map  back to DC/OS UI configuration parameters.
         # TODO(cmaloney): Remove need to remap validation keys. The remapping is making things show up
@@ -131,7 +141,7 @@ def configure(request):
         return resp
 
     elif request.method == 'GET':
-        config = Config(CONFIG_PATH).config
+        config = (yield from dcos_installer.jobs.run_in_executor(Config, CONFIG_PATH)).config
         # TODO(cmaloney): should exclude the value entirely if the file doesn't exist.
         config['ssh_key'] = try_read_file(SSH_KEY_PATH)
         config['ip_detect_script'] = try_read_file(IP_DETECT_PATH)
@@ -149,7 +159,8 @@ def configure_status(request):
     """
     log.info("Request for configuration validation made.")
     code = 200
-    messages = Config(CONFIG_PATH).do_validate(include_ssh=True)
+    messages = yield from dcos_installer.jobs.run_in_executor(
+        lambda: Config(CONFIG_PATH).do_validate(include_ssh=True))
     if messages:
         code = 400
     resp = web.json_response(messages, status=code)
@@ -163,7 +174,8 @@ def configure_type(request):
     :type request: request | None
     """
     log.info("Request for configuration type made.")
-    return web.json_response(backend.determine_config_type())
+    config_type = yield from dcos_installer.jobs.run_in_executor(backend.determine_config_type)
+    return web.json_response(config_type)
 
 
 def success(request):
@@ -173,12 +185,46 @@ def success(request):
     :type request: request | None
     """
     log.info("Request for success made.")
-    msgs, code = backend.success(Config(CONFIG_PATH))
+    msgs, code = yield from dcos_installer.jobs.run_in_executor(lambda: backend.success(Config(CONFIG_PATH)))
     return web.json_response(msgs, status=code)
 
 
+def generate_configuration():
+    """Run backend.do_configure, failing the job with the validation messages if the configuration is invalid."""
+    if backend.do_configure() != 0:
+        messages = Config(CONFIG_PATH).do_validate(include_ssh=False)
+        raise dcos_installer.jobs.JobError('\n'.join(
+            '{}: {}'.format(key, error) for key, error in sorted(messages.items())) or
+            'Configuration generation failed')
+    return 0
+
+
+def configure_generate(request):
+    """Return /configure/generate, which starts generating the configuration as a job.
+
+    :param request: a web requeest object.
+    :type request: request | None
+    """
+    log.info("Request for configuration generation made.")
+    job = dcos_installer.jobs.submit('configure', generate_configuration)
+    return web.json_response(job.as_dict(), status=202)
+
+
+def job_status(request):
+    """Return /jobs/<job_id>, the status of a job.
+
+    :param request: a web requeest object.
+    :type request: request | None
+    """
+    job = dcos_installer.jobs.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'error': 'job not found'}, status=404)
+    return web.json_response(job.as_dict())
+
+
 def unlink_state_file(action_name):
     json_status_file = STATE_DIR + '/{}.json'.format(action_name)
+    json_state_store.forget(json_status_file)
     if os.path.isfile(json_status_file):
         log.debug('removing {}'.format(json_status_file))
         os.unlink(json_status_file)
@@ -188,12 +234,11 @@ def unlink_state_file(action_name):
 
 
 def read_json_state(action_name):
-    json_status_file = STATE_DIR + '/{}.json'.format(action_name)
-    if not os.path.isfile(json_status_file):
+    # Running actions keep their state in memory, and only write it to the file every so often.
+    json_state = json_state_store.get(STATE_DIR + '/{}.json'.format(action_name))
+    if json_state is None:
         return False
-
-    with open(json_status_file) as fh:
-        return json.load(fh)
+    return json_state
 
 
 def action_action_name(request):
@@ -223,16 +268,18 @@ def action_action_name(request):
         # generation. If genconf fails, present the UI with a usable error
         # for the end-user
         if action_name == 'preflight':
-            try:
-                log.warning("GENERATING CONFIGURATION")
-                backend.do_configure()
-            except:
+            log.warning("GENERATING CONFIGURATION")
+            job = dcos_installer.jobs.submit('configure', generate_configuration)
+            yield from asyncio.wait([job.future])
+            if job.error:
                 genconf_failure = {
-                    "errors": "Configuration generation failed, please see command line for details"
+                    "errors": "Configuration generation failed, please see command line for details",
+                    "job": job.id
                 }
                 return web.json_response(genconf_failure, status=400)
 
         params = yield from request.post()
+        config = yield from dcos_installer.jobs.run_in_executor(Config, CONFIG_PATH)
 
         if json_state:
             if action_name == 'deploy' and 'retry' in params:
@@ -242,12 +289,12 @@ def action_action_name(request):
                         if deploy_params['host_status'] != 'success':
                             failed_hosts.append(Node(
                                 deploy_host, tags=deploy_params['tags'],
-                                default_port=int(Config(CONFIG_PATH).hacky_default_get('ssh_port', 22))))
+                                default_port=int(config.hacky_default_get('ssh_port', 22))))
                     log.debug('failed hosts: {}'.format(failed_hosts))
                     if failed_hosts:
                         yield from asyncio.async(
                             action(
-                                Config(CONFIG_PATH),
+                                config,
                                 state_json_dir=STATE_DIR,
                                 hosts=failed_hosts,
                                 try_remove_stale_dcos=True,
@@ -271,10 +318,57 @@ def action_action_name(request):
             else:
                 unlink_state_file(action_name)
 
-        yield from asyncio.async(action(Config(CONFIG_PATH), state_json_dir=STATE_DIR, options=options, **params))
+        yield from asyncio.async(action(config, state_json_dir=STATE_DIR, options=options, **params))
         return web.json_response({'status': '{} started'.format(action_name)})
 
 
+def format_event(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data)).encode('utf-8')
+
+
+def action_events(request):
+    """Return /action/<action_name>/events, a text/event-stream of the progress of an action.
+
+    The stream starts with a "state" event holding what GET /action/<action_name> returns, followed by
+    "command" and "host_status" events for each host as they happen, and a "done" event once the action
+    is done on all hosts which ends the stream.
+
+    :param request: a web requeest object.
+    :type request: request | None
+    """
+    action_name = request.match_info['action_name']
+    state_path = STATE_DIR + '/{}.json'.format(action_name)
+    queue = json_state_store.subscribe(state_path)
+    try:
+        resp = web.StreamResponse()
+        resp.content_type = 'text/event-stream'
+        yield from resp.prepare(request)
+
+        json_state = read_json_state(action_name) or {}
+        resp.write(format_event('state', json_state))
+        hosts = json_state.get('hosts')
+        if hosts and all(host['host_status'] not in ('unstarted', 'running') for host in hosts.values()):
+            resp.write(format_event('done', {}))
+            yield from resp.write_eof()
+            return resp
+
+        while not request.transport.is_closing():
+            try:
+                event, data = yield from asyncio.wait_for(queue.get(), EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from timing out the connection, and notices the client going away.
+                resp.write(b':\n\n')
+                continue
+            resp.write(format_event(event, data))
+            yield from resp.drain()
+            if event == 'done':
+                break
+        yield from resp.write_eof()
+        return resp
+    finally:
+        json_state_store.unsubscribe(state_path, queue)
+
+
 def action_current(request):
     """Return the current action /action/current endpoint.
 
@@ -285,24 +379,57 @@ def action_current(request):
 
 
 def logs_handler(request):
-    """Return the log file on disk.
+    """Return /logs, the state of all actions as a JSON list, streamed as complete.log.
+
+    Each state file is copied into the response a chunk at a time. With ?since=<timestamp> only the
+    states which changed after it are included. The X-Log-Timestamp header of the response is the
+    timestamp to pass as since to only get what changed afterwards. The response is gzip compressed
+    for clients which accept it.
 
     :param request: a web requeest object.
     :type request: request | None
     """
     log.info("Request for logs endpoint made.")
-    complete_log_path = STATE_DIR + '/complete.log'
-    json_files = glob.glob(STATE_DIR + '/*.json')
-    complete_log = []
-    for f in json_files:
-        log.debug('Adding {} to complete log file.'.format(f))
-        with open(f) as blob:
-            complete_log.append(json.loads(blob.read()))
-
-    with open(complete_log_path, 'w') as f:
-        f.write(json.dumps(complete_log, indent=4, sort_keys=True))
+    try:
+        since = float(request.GET.get('since', 0))
+    except ValueError:
+        return web.json_response({'since': 'Must be a timestamp'}, status=400)
+
+    json_state_store.flush()
+    timestamp = time.time()
+    json_files = []
+    for json_file in sorted(glob.glob(STATE_DIR + '/*.json')):
+        try:
+            if os.path.getmtime(json_file) > since:
+                json_files.append(json_file)
+        except FileNotFoundError:
+            # Removed since the glob.
+            pass
+
+    resp = web.StreamResponse()
+    resp.content_type = 'application/json'
+    resp.headers['Content-Disposition'] = 'attachment; filename=complete.log'
+    resp.headers['X-Log-Timestamp'] = str(timestamp)
+    if 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+        resp.enable_compression(web.ContentCoding.gzip)
+    yield from resp.prepare(request)
 
-    return web.HTTPFound('/download/log/complete.log'.format(VERSION))
+    loop = asyncio.get_event_loop()
+    resp.write(b'[\n')
+    for index, json_file in enumerate(json_files):
+        log.debug('Adding {} to complete log file.'.format(json_file))
+        if index:
+            resp.write(b',\n')
+        with open(json_file, 'rb') as fh:
+            while True:
+                chunk = yield from loop.run_in_executor(None, fh.read, LOG_CHUNK_SIZE)
+                if not chunk:
+                    break
+                resp.write(chunk)
+                yield from resp.drain()
+    resp.write(b'\n]\n')
+    yield from resp.write_eof()
+    return resp
 
 
 def build_app(loop):
@@ -331,10 +458,14 @@ def build_app(loop):
     app.router.add_route('GET', '/api/v{}/configure/status'.format(VERSION), configure_status)
     app.router.add_route('GET', '/api/v{}/configure/type'.format(VERSION), configure_type)
     app.router.add_route('GET', '/api/v{}/success'.format(VERSION), success)
+    app.router.add_route('POST', '/api/v{}/configure/generate'.format(VERSION), configure_generate)
+    app.router.add_route('GET', '/api/v1/jobs/{job_id}', job_status)
     # TODO(malnick) The regex handling in the variable routes blows up if we insert another variable to be
     # filled in by .format. Had to hardcode the VERSION into the URL for now. Fix suggestions please!
     app.router.add_route('GET', '/api/v1/action/{action_name:preflight|postflight|deploy}', action_action_name)
     app.router.add_route('POST', '/api/v1/action/{action_name:preflight|postflight|deploy}', action_action_name)
+    app.router.add_route(
+        'GET', '/api/v1/action/{action_name:preflight|postflight|deploy}/events', action_events)
     app.router.add_route('GET', '/api/v{}/action/current'.format(VERSION), action_current)
     app.router.add_route('GET', '/api/v{}/logs'.format(VERSION), logs_handler)
 
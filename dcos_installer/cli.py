@@ -56,6 +56,10 @@ class CliDelegate(AbstractSSHLibDelegate):
     def prepare_status(self, name, nodes):
         pass
 
+    def on_output(self, name, host, stage, stream_name, lines):
+        for line in lines:
+            log.debug('{}:{} {}'.format(host.ip, host.port, line.rstrip('\r')))
+
 
 def run_loop(action, options):
     assert callable(action)
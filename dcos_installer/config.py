@@ -1,6 +1,6 @@
 import copy
 import logging
-import os.path
+import os
 
 import yaml
 
@@ -50,6 +50,30 @@ def make_default_config_if_needed(config_path):
         return
 
     write_string(config_path, config_sample)
+    invalidate_config_cache(config_path)
+
+
+# Parsed config files by absolute path, as ((mtime, size, inode), config). The parsed configs are shared
+# by all the Configs loaded from the same file contents, so must never be changed.
+_config_cache = {}
+
+
+def load_config_cached(config_path):
+    """Return the parsed contents of config_path, only parsing it again if the file changed."""
+    path = os.path.abspath(config_path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    config = load_yaml(path)
+    _config_cache[path] = (key, config)
+    return config
+
+
+def invalidate_config_cache(config_path):
+    _config_cache.pop(os.path.abspath(config_path), None)
 
 
 class NoConfigError(Exception):
@@ -63,7 +87,9 @@ class Config():
 
         # Create the config file iff allowed and there isn't one provided by the user.
 
+        # The loaded config is shared with other Configs of the same file, and copied before it's updated.
         self._config = self._load_config()
+        self._shared = self.config_path is not None
         if not isinstance(self._config, dict):
             # FIXME
             raise NotImplementedError()
@@ -73,7 +99,7 @@ class Config():
             return {}
 
         try:
-            return load_yaml(self.config_path)
+            return load_config_cached(self.config_path)
         except FileNotFoundError as ex:
             raise NoConfigError(
                 "No config file found at {}. See the DC/OS documentation for the "
@@ -93,6 +119,9 @@ class Config():
         # TODO(cmaloney): check that the updates are all for valid keys, keep
         # any ones for valid keys and throw out any for invalid keys, returning
         # errors for the invalid keys.
+        if self._shared:
+            self._config = copy.deepcopy(self._config)
+            self._shared = False
         self._config.update(updates)
 
     # TODO(cmaloney): Figure out a way for the installer being generated (Advanced AWS CF templates vs.
@@ -125,6 +154,7 @@ class Config():
         assert self.config_path is not None
 
         write_string(self.config_path, self.get_yaml_str())
+        invalidate_config_cache(self.config_path)
 
     def __getitem__(self, key: str):
         return self._config[key]
@@ -139,7 +169,7 @@ class Config():
 
     @property
     def config(self):
-        return copy.copy(self._config)
+        return copy.deepcopy(self._config)
 
 
 def to_config(config_dict: dict):
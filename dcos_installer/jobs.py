@@ -0,0 +1,85 @@
+"""Run the installer's blocking work, like generating the configuration, off of the event loop.
+
+Work which the web UI needs to track is submitted as a Job, which keeps its status around to be
+polled by id. Everything runs on a single worker thread, since it all shares the files under genconf/.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import time
+import traceback
+import uuid
+
+log = logging.getLogger(__name__)
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# The most recently submitted jobs by id, oldest first.
+jobs = collections.OrderedDict()
+MAX_JOBS = 100
+
+
+class JobError(Exception):
+    """Raised by a job's function to fail it with the message as its error, rather than the exception."""
+
+
+def run_in_executor(fn, *args):
+    """Return a future of the result of calling fn(*args) on the worker thread."""
+    return asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+
+
+class Job():
+    def __init__(self, name, future):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.future = future
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self.finished = time.time()
+        if future.cancelled():
+            self.error = 'cancelled'
+        elif isinstance(future.exception(), JobError):
+            self.error = str(future.exception())
+            log.error('Job {} {} failed: {}'.format(self.name, self.id, self.error))
+        elif future.exception() is not None:
+            exception = future.exception()
+            self.error = ''.join(traceback.format_exception_only(type(exception), exception)).strip()
+            log.error('Job {} {} failed'.format(self.name, self.id), exc_info=exception)
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'running'
+        return 'failed' if self.error else 'success'
+
+    def as_dict(self):
+        job = {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.error:
+            job['error'] = self.error
+        elif self.status == 'success':
+            job['result'] = self.future.result()
+        return job
+
+
+def submit(name, fn, *args):
+    """Run fn(*args) as a job named name, returning the Job."""
+    job = Job(name, run_in_executor(fn, *args))
+    jobs[job.id] = job
+    while len(jobs) > MAX_JOBS:
+        jobs.popitem(last=False)
+    return job
+
+
+def get(job_id):
+    return jobs.get(job_id)
@@ -1,4 +1,6 @@
 import asyncio
+import gzip
+import json
 import os
 
 import aiohttp
@@ -8,10 +10,12 @@ import webtest_aiohttp
 import dcos_installer
 import dcos_installer.backend
 import dcos_installer.config_util
+import dcos_installer.jobs
 import gen.calc
 from dcos_installer.async_server import build_app
 from dcos_installer.config import Config, make_default_config_if_needed
 from pkgpanda.util import write_string
+from ssh.utils import json_state_store
 
 
 @pytest.fixture(autouse=True)
@@ -285,7 +289,7 @@ def test_action_deploy_post(client, monkeypatch):
 
     write_string('genconf/config.yaml', ssh_config_yaml)
     monkeypatch.setattr(dcos_installer.action_lib, '_get_bootstrap_tarball', lambda: '123')
-    monkeypatch.setattr(dcos_installer.action_lib, '_add_copy_packages', lambda _: None)
+    monkeypatch.setattr(dcos_installer.action_lib, '_add_copy_packages', lambda _, **kwargs: None)
 
     # Deploy should be already executed for action 'deploy'
     def mocked_json_state(arg):
@@ -314,7 +318,7 @@ def test_action_deploy_retry(client, monkeypatch):
 
     write_string('genconf/config.yaml', ssh_config_yaml)
     monkeypatch.setattr(dcos_installer.action_lib, '_get_bootstrap_tarball', lambda: '123')
-    monkeypatch.setattr(dcos_installer.action_lib, '_add_copy_packages', lambda _: None)
+    monkeypatch.setattr(dcos_installer.action_lib, '_add_copy_packages', lambda _, **kwargs: None)
     monkeypatch.setattr(dcos_installer.action_lib, '_read_state_file', lambda state_file: {'total_hosts': 2})
 
     removed_hosts = list()
@@ -358,3 +362,122 @@ def test_unlink_state_file(monkeypatch):
 
     monkeypatch.setattr(os, 'unlink', mocked_unlink)
     dcos_installer.async_server.unlink_state_file('preflight')
+
+
+def test_configure_generate(client, monkeypatch):
+    def do_configure():
+        raise Exception('no bootstrap_url')
+
+    for do_configure, status, result in [(lambda: 0, 'success', {'result': 0}),
+                                         (do_configure, 'failed', {'error': 'Exception: no bootstrap_url'})]:
+        monkeypatch.setattr(dcos_installer.backend, 'do_configure', do_configure)
+        res = client.post('/api/v1/configure/generate')
+        assert res.status_code == 202
+        job_id = res.json['id']
+
+        asyncio.get_event_loop().run_until_complete(asyncio.wait([dcos_installer.jobs.get(job_id).future]))
+        res = client.get('/api/v1/jobs/{}'.format(job_id))
+        assert res.json['name'] == 'configure'
+        assert res.json['status'] == status
+        assert {key: res.json[key] for key in result} == result
+
+    assert client.get('/api/v1/jobs/missing', expect_errors=True).status_code == 404
+
+
+def test_configure_generate_invalid(client):
+    # The default configuration doesn't pass validation, which do_configure reports by returning 1.
+    res = client.post('/api/v1/configure/generate')
+    job_id = res.json['id']
+
+    asyncio.get_event_loop().run_until_complete(asyncio.wait([dcos_installer.jobs.get(job_id).future]))
+    res = client.get('/api/v1/jobs/{}'.format(job_id))
+    assert res.json['status'] == 'failed'
+    messages = Config('genconf/config.yaml').do_validate(include_ssh=False)
+    assert messages
+    assert res.json['error'] == '\n'.join('{}: {}'.format(key, error) for key, error in sorted(messages.items()))
+    assert 'result' not in res.json
+
+
+@pytest.yield_fixture
+def server(tmpdir):
+    """A running installer server, for responses which are streamed, returning its port."""
+    # A loop of its own, so actions other tests started don't run alongside.
+    default_loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Nor do the states they left in memory, which are keyed by the same relative paths.
+    for path in list(json_state_store.states):
+        json_state_store.forget(path)
+    with tmpdir.as_cwd():
+        app = build_app(loop)
+        handler = app.make_handler()
+        server = loop.run_until_complete(loop.create_server(handler, '127.0.0.1', 0))
+        yield server.sockets[0].getsockname()[1]
+        server.close()
+        loop.run_until_complete(handler.finish_connections(1.0))
+    loop.close()
+    asyncio.set_event_loop(default_loop)
+
+
+def get_streamed(port, route, headers={}):
+    """GET route, returning the status, the headers and the body of the response."""
+    @asyncio.coroutine
+    def get():
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port)
+        request = ['GET {} HTTP/1.0'.format(route), 'Connection: close']
+        request += ['{}: {}'.format(name, value) for name, value in headers.items()]
+        writer.write('\r\n'.join(request + ['', '']).encode())
+        response = yield from reader.read()
+        writer.close()
+        return response
+    head, body = asyncio.get_event_loop().run_until_complete(get()).split(b'\r\n\r\n', 1)
+    status_line, *header_lines = head.decode().split('\r\n')
+    headers = {name.lower(): value for name, value in (line.split(': ', 1) for line in header_lines)}
+    return int(status_line.split(' ')[1]), headers, body
+
+
+def test_action_events(server):
+    state_path = 'genconf/state/deploy.json'
+    json_state_store.states[state_path] = {
+        'hosts': {'127.0.0.1:22': {'commands': [], 'host_status': 'running'}}}
+    route = '/api/v1/action/deploy/events'
+
+    try:
+        # Updates are pushed as they happen, until the action is done.
+        loop = asyncio.get_event_loop()
+        loop.call_later(0.1, json_state_store.publish, state_path, 'host_status',
+                        {'host': '127.0.0.1:22', 'host_status': 'success'})
+        loop.call_later(0.1, json_state_store.publish, state_path, 'done', {})
+        status, headers, body = get_streamed(server, route)
+        assert headers['content-type'] == 'text/event-stream'
+        assert body.decode() == (
+            'event: state\ndata: {"hosts": {"127.0.0.1:22": {"commands": [], "host_status": "running"}}}\n\n'
+            'event: host_status\ndata: {"host": "127.0.0.1:22", "host_status": "success"}\n\n'
+            'event: done\ndata: {}\n\n')
+
+        # A stream of an action which is done ends right away.
+        json_state_store.states[state_path]['hosts']['127.0.0.1:22']['host_status'] = 'success'
+        assert get_streamed(server, route)[2].endswith(b'event: done\ndata: {}\n\n')
+        assert json_state_store.subscribers == {}
+    finally:
+        json_state_store.forget(state_path)
+
+
+def test_logs(server):
+    os.makedirs('genconf/state')
+    write_string('genconf/state/deploy.json', '{"chain_name": "deploy"}')
+    write_string('genconf/state/preflight.json', '{"chain_name": "preflight"}')
+    os.utime('genconf/state/preflight.json', (1000, 1000))
+
+    status, headers, body = get_streamed(server, '/api/v1/logs', headers={'Accept-Encoding': 'gzip'})
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['content-disposition'] == 'attachment; filename=complete.log'
+    assert json.loads(gzip.decompress(body).decode()) == [{'chain_name': 'deploy'}, {'chain_name': 'preflight'}]
+
+    # Only what changed since the given time.
+    status, headers, body = get_streamed(server, '/api/v1/logs?since=1000')
+    assert json.loads(body.decode()) == [{'chain_name': 'deploy'}]
+    status, headers, body = get_streamed(server, '/api/v1/logs?since={}'.format(headers['x-log-timestamp']))
+    assert json.loads(body.decode()) == []
+
+    assert get_streamed(server, '/api/v1/logs?since=yesterday')[0] == 400
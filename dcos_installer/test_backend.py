@@ -6,11 +6,13 @@ import uuid
 import passlib.hash
 import pytest
 
+import dcos_installer.config
 import gen
 import gen.build_deploy.aws
 import release
 from dcos_installer import backend
 from dcos_installer.config import Config, make_default_config_if_needed, to_config
+from pkgpanda.util import load_yaml
 
 os.environ["BOOTSTRAP_ID"] = "12345"
 
@@ -206,6 +208,31 @@ def test_get_config(tmpdir):
     assert expected_data == config.config
 
 
+def test_config_cache(tmpdir, monkeypatch):
+    temp_config_path = tmpdir.strpath + '/config.yaml'
+    make_default_config_if_needed(temp_config_path)
+
+    loads = []
+    monkeypatch.setattr(dcos_installer.config, 'load_yaml', lambda path: loads.append(path) or load_yaml(path))
+
+    # The file is only parsed again once it changes.
+    config = Config(temp_config_path)
+    assert Config(temp_config_path).config == config.config
+    assert len(loads) == 1
+
+    # Updates don't change the cached config, until they're written.
+    config.update({'ssh_port': 2222})
+    assert Config(temp_config_path)['ssh_port'] == 22
+    config.write_config()
+    assert Config(temp_config_path)['ssh_port'] == 2222
+    assert len(loads) == 2
+
+    with open(temp_config_path, 'a') as f:
+        f.write('process_timeout: 5\n')
+    assert Config(temp_config_path)['process_timeout'] == 5
+    assert len(loads) == 3
+
+
 def test_determine_config_type(tmpdir):
     # Ensure the default created config is of simple type
     workspace = tmpdir.strpath
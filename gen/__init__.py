@@ -502,9 +502,9 @@ def build_late_package(late_files, config_id, provider):
     }
 
 
-def validate_and_raise(sources, targets):
+def validate_and_raise(sources, targets, base_resolver=None):
     # TODO(cmaloney): Make it so we only get out the dcosconfig target arguments not all the config target arguments.
-    resolver = gen.internals.resolve_configuration(sources, targets)
+    resolver = gen.internals.resolve_configuration(sources, targets, base_resolver)
     status = resolver.status_dict
 
     if status['status'] == 'errors':
@@ -548,7 +548,14 @@ def generate(
         arguments,
         extra_templates=list(),
         extra_sources=list(),
-        extra_targets=list()):
+        extra_targets=list(),
+        base_resolver=None):
+    """Generate the config packages and rendered templates for the given arguments.
+
+    `base_resolver` may be the resolver of a previous generate() call (available as `resolver` on
+    the result) with a similar configuration. Only the arguments which differ between the two are
+    then recalculated.
+    """
     # To maintain the old API where we passed arguments rather than the new name.
     user_arguments = arguments
     arguments = None
@@ -556,7 +563,7 @@ def generate(
     sources, targets, templates = get_dcosconfig_source_target_and_templates(
         user_arguments, extra_templates, extra_sources)
 
-    resolver = validate_and_raise(sources, targets + extra_targets)
+    resolver = validate_and_raise(sources, targets + extra_targets, base_resolver)
     argument_dict = get_final_arguments(resolver)
     late_variables = get_late_variables(resolver, sources)
 
@@ -679,6 +686,7 @@ def generate(
         'cluster_packages': cluster_package_info,
         'config_package_ids': config_package_ids,
         'late_package_id': late_package['name'] if late_package else None,
+        'resolver': resolver,
         'templates': rendered_templates,
         'utils': utils
     })
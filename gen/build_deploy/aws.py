@@ -370,7 +370,7 @@ def gen_supporting_template():
             cloudformation)
 
 
-def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
+def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params, base_resolver=None):
     extra_templates = [
         'aws/dcos-config.yaml',
         'aws/templates/advanced/{}'.format(template_name)
@@ -388,7 +388,8 @@ def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
         extra_templates=extra_templates,
         extra_sources=extra_sources + [aws_base_source],
         # TODO(cmaloney): Merge this with dcos_installer/backend.py::get_aws_advanced_target()
-        extra_targets=[gen.internals.Target(variables={'cloudformation_s3_url_full'})])
+        extra_targets=[gen.internals.Target(variables={'cloudformation_s3_url_full'})],
+        base_resolver=base_resolver)
 
     cloud_config = results.templates['cloud-config.yaml']
 
@@ -419,7 +420,7 @@ def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
     return (cloudformation, results)
 
 
-def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path, os_type):
+def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path, os_type, base_resolver=None):
     for node_type in ['master', 'priv-agent', 'pub-agent']:
         # TODO(cmaloney): This forcibly overwriting arguments might overwrite a user set argument
         # without noticing (such as exhibitor_storage_backend)
@@ -446,7 +447,8 @@ def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path,
                 bundle = make_advanced_bundle(arguments,
                                               [node_source, local_source, num_masters_source],
                                               template_name,
-                                              params)
+                                              params,
+                                              base_resolver)
                 yield from _as_artifact('{}.json'.format(master_tk), bundle)
 
                 # Zen template corresponding to this number of masters
@@ -463,7 +465,8 @@ def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path,
             bundle = make_advanced_bundle(arguments,
                                           [node_source, local_source],
                                           template_name,
-                                          params)
+                                          params,
+                                          base_resolver)
             yield from _as_artifact('{}-{}'.format(os_type, template_name), bundle)
 
 
@@ -483,15 +486,32 @@ aws_simple_source = Source({
 })
 
 
-def gen_simple_template(variant_prefix, filename, arguments, extra_source):
+aws_simple_templates = [
+    'aws/templates/cloudformation.json',
+    'aws/dcos-config.yaml',
+    'coreos-aws/cloud-config.yaml',
+    'coreos/cloud-config.yaml']
+
+
+def resolve_simple_base(arguments):
+    """Resolve the configuration of the single master simple template.
+
+    All the templates of a variant share most of their configuration, so this is used as the base
+    resolver for each of them. Each then only recalculates the arguments which differ.
+    """
+    num_masters_source = Source()
+    num_masters_source.add_must('num_masters', '1')
+    sources, targets, _ = gen.get_dcosconfig_source_target_and_templates(
+        arguments, aws_simple_templates, [aws_base_source, aws_simple_source, num_masters_source])
+    return gen.internals.resolve_configuration(sources, targets)
+
+
+def gen_simple_template(variant_prefix, filename, arguments, extra_source, base_resolver=None):
     results = gen.generate(
         arguments=arguments,
-        extra_templates=[
-            'aws/templates/cloudformation.json',
-            'aws/dcos-config.yaml',
-            'coreos-aws/cloud-config.yaml',
-            'coreos/cloud-config.yaml'],
-        extra_sources=[aws_base_source, aws_simple_source, extra_source])
+        extra_templates=aws_simple_templates,
+        extra_sources=[aws_base_source, aws_simple_source, extra_source],
+        base_resolver=base_resolver)
 
     cloud_config = results.templates['cloud-config.yaml']
 
@@ -570,35 +590,39 @@ def gen_buttons(build_name, reproducible_artifact_path, tag, commit, variant_arg
         })
 
 
-def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
-    # Generate the single-master and multi-master templates.
-
-    for bootstrap_variant, variant_base_args in variant_arguments.items():
-        variant_prefix = pkgpanda.util.variant_prefix(bootstrap_variant)
-
-        def make(num_masters, filename):
-            num_masters_source = Source()
-            num_masters_source.add_must('num_masters', str(num_masters))
-            yield from gen_simple_template(
-                variant_prefix,
-                filename,
-                variant_base_args,
-                num_masters_source)
-
-        # Single master templates
-        yield from make(1, 'single-master.cloudformation.json')
-
-        # Multi master templates
-        yield from make(3, 'multi-master.cloudformation.json')
-
-        # Advanced templates
-        for os_type in ['coreos', 'el7']:
-            yield from gen_advanced_template(
-                variant_base_args,
-                variant_prefix,
-                reproducible_artifact_path,
-                os_type)
+def do_create_variant(tag, build_name, reproducible_artifact_path, commit, variant, arguments, all_completes):
+    """Generate the single-master, multi-master, and advanced templates of a single variant."""
+    variant_prefix = pkgpanda.util.variant_prefix(variant)
+    base_resolver = resolve_simple_base(arguments)
+
+    def make(num_masters, filename):
+        num_masters_source = Source()
+        num_masters_source.add_must('num_masters', str(num_masters))
+        yield from gen_simple_template(
+            variant_prefix,
+            filename,
+            arguments,
+            num_masters_source,
+            base_resolver)
+
+    # Single master templates
+    yield from make(1, 'single-master.cloudformation.json')
 
+    # Multi master templates
+    yield from make(3, 'multi-master.cloudformation.json')
+
+    # Advanced templates
+    for os_type in ['coreos', 'el7']:
+        yield from gen_advanced_template(
+            arguments,
+            variant_prefix,
+            reproducible_artifact_path,
+            os_type,
+            base_resolver)
+
+
+def do_create_shared(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+    """Generate the artifacts which cover all variants."""
     # Button page linking to the basic templates.
     button_page = gen_buttons(build_name, reproducible_artifact_path, tag, commit, variant_arguments)
     yield {
@@ -608,3 +632,11 @@ def do_create(tag, build_name, reproducible_artifact_path, commit, variant_argum
 
     # This renders the infra template only, which has no difference between CE and EE
     yield from gen_supporting_template()
+
+
+def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+    for variant, arguments in variant_arguments.items():
+        yield from do_create_variant(
+            tag, build_name, reproducible_artifact_path, commit, variant, arguments, all_completes)
+
+    yield from do_create_shared(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes)
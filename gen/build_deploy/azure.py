@@ -255,16 +255,17 @@ def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix
     }
 
 
-def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+def do_create_variant(tag, build_name, reproducible_artifact_path, commit, variant, arguments, all_completes):
     for arm_t in ['dcos', 'acs']:
         for num_masters in [1, 3, 5]:
-            for bootstrap_name, gen_arguments in variant_arguments.items():
-                yield from make_template(
-                    num_masters,
-                    gen_arguments,
-                    arm_t,
-                    pkgpanda.util.variant_prefix(bootstrap_name))
+            yield from make_template(
+                num_masters,
+                arguments,
+                arm_t,
+                pkgpanda.util.variant_prefix(variant))
+
 
+def do_create_shared(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
     yield {
         'channel_path': 'azure.html',
         'local_content': gen_buttons(
@@ -277,6 +278,14 @@ def do_create(tag, build_name, reproducible_artifact_path, commit, variant_argum
     }
 
 
+def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+    for variant, arguments in variant_arguments.items():
+        yield from do_create_variant(
+            tag, build_name, reproducible_artifact_path, commit, variant, arguments, all_completes)
+
+    yield from do_create_shared(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes)
+
+
 def gen_buttons(build_name, reproducible_artifact_path, tag, commit, download_url):
     '''
     Generate the button page, that is, "Deploy a cluster to Azure" page
@@ -693,6 +693,39 @@ def fetch_dcos_launch_bin(launch_name, launch_package_id):
     return launch_path
 
 
+def do_create_variant(tag, build_name, reproducible_artifact_path, commit, variant, arguments, all_completes):
+    """Create the installer script and dcos-launch binary for a single variant."""
+    variant_name = pkgpanda.util.variant_name(variant)
+    bootstrap_installer_name = '{}installer'.format(pkgpanda.util.variant_prefix(variant))
+    bootstrap_util_name = '{}util'.format(pkgpanda.util.variant_prefix(variant))
+    if bootstrap_installer_name not in all_completes:
+        print('WARNING: No installer tree for variant: {}'.format(variant_name))
+    else:
+        with logger.scope("Building installer for variant: {}".format(variant_name)):
+
+            yield {
+                'channel_path': 'dcos_generate_config.{}sh'.format(pkgpanda.util.variant_prefix(variant)),
+                'local_path': make_installer_docker(variant, all_completes[variant],
+                                                    all_completes[bootstrap_installer_name])
+            }
+
+    if bootstrap_util_name not in all_completes:
+        print('WARNING: No util tree for variant: {}'.format(variant_name))
+    else:
+        with logger.scope("building dcos-launch for variant: {}".format(variant_name)):
+            launch_package_id = get_launch_package_id(all_completes[bootstrap_util_name]['packages'])
+            launch_name = 'dcos-launch' + pkgpanda.util.variant_suffix(variant, delim='-')
+            yield {
+                'channel_path': launch_name,
+                'local_path': fetch_dcos_launch_bin(launch_name, launch_package_id)
+            }
+
+
+def do_create_shared(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+    # Every bash artifact is specific to a variant.
+    yield from ()
+
+
 def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
     """Create a installer script for each variant in bootstrap_dict.
 
@@ -703,30 +736,7 @@ def do_create(tag, build_name, reproducible_artifact_path, commit, variant_argum
 
     Outputs the generated dcos_generate_config.sh as it's artifacts.
     """
-    # TODO(cmaloney): Build installers in parallel.
     # Variants are sorted for stable ordering.
     for variant in sorted(variant_arguments.keys(), key=lambda k: pkgpanda.util.variant_str(k)):
-        variant_name = pkgpanda.util.variant_name(variant)
-        bootstrap_installer_name = '{}installer'.format(pkgpanda.util.variant_prefix(variant))
-        bootstrap_util_name = '{}util'.format(pkgpanda.util.variant_prefix(variant))
-        if bootstrap_installer_name not in all_completes:
-            print('WARNING: No installer tree for variant: {}'.format(variant_name))
-        else:
-            with logger.scope("Building installer for variant: {}".format(variant_name)):
-
-                yield {
-                    'channel_path': 'dcos_generate_config.{}sh'.format(pkgpanda.util.variant_prefix(variant)),
-                    'local_path': make_installer_docker(variant, all_completes[variant],
-                                                        all_completes[bootstrap_installer_name])
-                }
-
-        if bootstrap_util_name not in all_completes:
-            print('WARNING: No util tree for variant: {}'.format(variant_name))
-        else:
-            with logger.scope("building dcos-launch for variant: {}".format(variant_name)):
-                launch_package_id = get_launch_package_id(all_completes[bootstrap_util_name]['packages'])
-                launch_name = 'dcos-launch' + pkgpanda.util.variant_suffix(variant, delim='-')
-                yield {
-                    'channel_path': launch_name,
-                    'local_path': fetch_dcos_launch_bin(launch_name, launch_package_id)
-                }
+        yield from do_create_variant(
+            tag, build_name, reproducible_artifact_path, commit, variant, variant_arguments[variant], all_completes)
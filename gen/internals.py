@@ -91,6 +91,7 @@ class Setter:
         self.is_optional = is_optional
         self.conditions = conditions
         self.is_user = is_user
+        self._value = value
         self._value_id = hash_checkout(value_id(value))
 
         def get_value():
@@ -119,6 +120,23 @@ class Setter:
             self.conditions,
             ", parameters {}".format(self.parameters))
 
+    def is_same(self, other) -> bool:
+        """True if `other` is guaranteed to calculate exactly the same thing as this setter.
+
+        Unlike make_id() functions are compared by identity rather than by name and parameters.
+        """
+        if (self.name, self.is_optional, self.conditions, self.is_user) != \
+                (other.name, other.is_optional, other.conditions, other.is_user):
+            return False
+
+        if isinstance(self._value, str) or isinstance(other._value, str):
+            return self._value == other._value
+        elif isinstance(self._value, Late) or isinstance(other._value, Late):
+            return isinstance(self._value, Late) and isinstance(other._value, Late) and \
+                self.late_expression == other.late_expression
+        else:
+            return self._value is other._value
+
     def make_id(self):
         return {
             'name': self.name,
@@ -404,6 +422,16 @@ class Resolvable:
         self._state = self.State.LATE
         self._value = LATE_BIND_PLACEHOLDER.format(self.name)
 
+    def finalize_from(self, other):
+        """Finalize to the same state / value as a resolvable of the same name from another Resolver."""
+        assert self._state == self.State.UNRESOLVED
+        assert other.is_finalized
+        assert self.name == other.name
+        self._state = other._state
+        self._value = other._value
+        self.error = other.error
+        self.setter = other.setter
+
     @property
     def value(self):
         assert self.is_resolved or self.is_late, "is_resolved() or is_late() must return true for " \
@@ -450,19 +478,33 @@ class Validator:
         self._validate_by_arg = dict()
         self._multi_arg_validate = dict()
 
+        # What each argument is validated by, in a form which can be compared between Validators.
+        self._signature_by_arg = dict()
+
         for function in validate_functions:
             parameters = get_function_parameters(function)
             # Could build up the single and multi parameter validation function maps in the same
             # thing but the timing / handling of when and how we run single vs. multi-parameter
             # validation functions is fairly different, the extra bit here simplifies the later code.
             if len(parameters) == 1:
-                self._validate_by_arg.setdefault(parameters.pop(), list()).append(function)
+                name = parameters.pop()
+                self._validate_by_arg.setdefault(name, list()).append(function)
+                self._signature_by_arg.setdefault(name, list()).append(function)
             else:
                 self._multi_arg_validate.setdefault(frozenset(parameters), list()).append(function)
 
         for target in targets:
             for parameter, function in target.yield_validates():
                 self._validate_by_arg.setdefault(parameter, list()).append(function)
+                # The switch validates are rebuilt for every set of targets, so compare them by the
+                # set of cases they allow rather than by identity.
+                self._signature_by_arg.setdefault(parameter, list()).append(
+                    frozenset(function.keywords['valid_values']))
+
+    def changed_arguments(self, other) -> Set[str]:
+        """Names of the arguments which `other` validates differently than this Validator."""
+        names = self._signature_by_arg.keys() | other._signature_by_arg.keys()
+        return {name for name in names if self._signature_by_arg.get(name) != other._signature_by_arg.get(name)}
 
     def validate_single(self, name: str, value: str):
         """Calls all validate functions which validate the given parameter name
@@ -517,8 +559,13 @@ class Validator:
 # dependencies.
 # TODO(cmaloney): Separate chain / path building when unwinding from the root
 #                 error messages.
+#
+# A Resolver may be given an already resolved `base` Resolver. Every argument the base resolved
+# whose setters, validation, and (transitively) dependencies are unchanged is then copied from the
+# base rather than being recalculated, so only the arguments affected by the differences between
+# the two configurations are recalculated.
 class Resolver:
-    def __init__(self, setters, validate_fns, targets):
+    def __init__(self, setters, validate_fns, targets, base=None):
         self._resolved = False
         self._setters = setters
         self._targets = targets
@@ -537,6 +584,62 @@ class Resolver:
 
         self._validator = Validator(validate_fns, targets)
 
+        # The names each argument's calculation asked for, recorded as they're resolved.
+        self._dependencies = dict()
+
+        self._base = base
+        self._reusable = set()
+        if base is not None:
+            self._reusable = base._find_reusable(setters, self._validator)
+
+    def _find_reusable(self, setters, validator):
+        """Find the arguments resolved by this Resolver which would resolve identically given the
+        new setters and validator."""
+        assert self._resolved, "Only a resolved Resolver can be used as a base"
+
+        changed = validator.changed_arguments(self._validator)
+        for name in self._setters.keys() | setters.keys():
+            old_setters = self._setters.get(name, list())
+            new_setters = setters.get(name, list())
+            if len(old_setters) != len(new_setters) or \
+                    not all(old.is_same(new) for old, new in zip(old_setters, new_setters)):
+                changed.add(name)
+
+        dependents = dict()
+        for name, dependencies in self._dependencies.items():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, set()).add(name)
+
+        # Everything which transitively depends on a changed argument has to be recalculated.
+        affected = set()
+        to_visit = list(changed)
+        while to_visit:
+            name = to_visit.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            to_visit.extend(dependents.get(name, set()))
+
+        return {name for name, resolvable in self._arguments.items()
+                if resolvable.is_finalized and name not in affected}
+
+    def _reuse(self, resolvable):
+        name = resolvable.name
+
+        # Walk everything the base resolver looked at while calculating the argument. They're all
+        # reusable as well, and visiting them makes this resolver end up with exactly the set of
+        # arguments a from-scratch resolve would have.
+        for dependency in sorted(self._base._dependencies.get(name, set())):
+            self._ensure_finalized(self._arguments[dependency])
+
+        resolvable.finalize_from(self._base._arguments[name])
+        if name in self._base._errors:
+            self._errors[name] = self._base._errors[name]
+        if name in self._base._unset:
+            self._unset.add(name)
+        if name in self._base._late:
+            self._late.add(name)
+
     def _calculate(self, resolvable):
         # Filter out any setters which have predicates / conditions which are
         # satisfiably false.
@@ -634,6 +737,9 @@ class Resolver:
         assert foo == name, "Internal consistency error: Unwinding stack seems to not be the order it was built in..."
 
     def _ensure_finalized(self, resolvable):
+        if self._eval_stack:
+            self._dependencies.setdefault(self._eval_stack[-1], set()).add(resolvable.name)
+
         if resolvable.is_finalized:
             return
 
@@ -643,6 +749,10 @@ class Resolver:
         # the second time the resolvable was encountered, and then trying to finalize a second time
         # when the stack unwinds.
         with self._stack_layer(resolvable.name):
+            if resolvable.name in self._reusable:
+                self._reuse(resolvable)
+                return
+
             try:
                 resolvable.finalize_value(*self._calculate(resolvable))
             except LateBoundException:
@@ -783,7 +893,12 @@ class Resolver:
         }
 
 
-def resolve_configuration(sources: List[Source], targets: List[Target]):
+def resolve_configuration(sources: List[Source], targets: List[Target], base_resolver: Resolver=None):
+    """Resolve the arguments needed by `targets` given `sources`.
+
+    If `base_resolver` is given, arguments it resolved which aren't affected by the differences
+    between its sources and targets and these are re-used rather than recalculated.
+    """
 
     # Merge the sources into a big dictionary of setters + validators, ensuring
     # that all setters are either strings or functions.
@@ -818,7 +933,7 @@ def resolve_configuration(sources: List[Source], targets: List[Target]):
         validate += source.validate
 
     # Use setters to calculate every required parameter
-    resolver = Resolver(setters, validate, targets)
+    resolver = Resolver(setters, validate, targets, base_resolver)
     resolver.resolve()
 
     def target_finalized(target):
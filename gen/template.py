@@ -15,14 +15,32 @@
 #   switch <identifier>
 #   case <string>:
 #   endswith
+import hashlib
+import logging
+import os
+import pickle
 from typing import Optional, Tuple
 
 from pkg_resources import resource_string
 
 import gen.internals
 
+log = logging.getLogger(__name__)
+
 identifier_valid_characters = 'abcdefghijklmnopqrstuvwxyz_0123456789'
 
+# Bump whenever the AST classes change in a way which makes previously pickled templates invalid.
+cache_format_version = 1
+
+# Parsed templates keyed by the sha1 of their source text. Parsing is deterministic, so each
+# distinct template only needs to be parsed once per process.
+_parse_cache = dict()
+
+# Optional directory where parsed templates are persisted so they can be shared across processes
+# and runs. Entries are keyed by content hash so they're invalidated automatically when a template
+# changes.
+_cache_dir = os.environ.get('GEN_TEMPLATE_CACHE_DIR')
+
 
 class SyntaxError(Exception):
 
@@ -307,68 +325,128 @@ class UnsetMarker:
     pass
 
 
-class Template:
+def _get_argument(arguments, name):
+    try:
+        return arguments[name]
+    except KeyError as ex:
+        raise UnsetParameter("Unset parameter {}".format(name), name) from ex
+
+
+def _run_ops(ops, arguments, filters, out):
+    for op in ops:
+        op(arguments, filters, out)
+
+
+def _compile_text(text):
+    def render_text(arguments, filters, out):
+        out.append(text)
+    return render_text
+
+
+def _compile_switch(chunk):
+    cases = {value: _compile_ast(sub_ast) for value, sub_ast in chunk.cases.items()}
+
+    def render_switch(arguments, filters, out):
+        choice = _get_argument(arguments, chunk.identifier)
+        if choice not in cases:
+            raise ValueError("switch %s: value `%s` is not in the set of handled cases" % (
+                chunk.identifier, choice))
+        _run_ops(cases[choice], arguments, filters, out)
+    return render_switch
+
+
+def _compile_replacement(chunk):
+    if chunk.filter is None:
+        def render_replacement(arguments, filters, out):
+            out.append(str(_get_argument(arguments, chunk.identifier)))
+        return render_replacement
+
+    def render_filtered_replacement(arguments, filters, out):
+        value = _get_argument(arguments, chunk.identifier)
+        try:
+            filter_func = filters[chunk.filter]
+        except KeyError:
+            raise UnsetParameter("Unset filter parameter {}".format(chunk.filter), chunk.filter)
+        out.append(str(filter_func(value)))
+    return render_filtered_replacement
+
+
+def _compile_for(chunk):
+    body = _compile_ast(chunk.body)
+
+    def render_for(arguments, filters, out):
+        # If the argument is a string, it should be a json list.
+        iterable = _get_argument(arguments, chunk.iterable)
+        # TODO(cmaloney): for should only be used (for now) in code which doesn't contain
+        # arbitrary user parameters.
+        # Stash the original state of the argument.
+        original_value = UnsetMarker()
+        if chunk.new_var in arguments:
+            original_value = arguments[chunk.new_var]
+
+        assert isinstance(iterable, list)
+        for value in iterable:
+            arguments[chunk.new_var] = value
+            _run_ops(body, arguments, filters, out)
+
+        # Reset the argument to the original state.
+        if isinstance(original_value, UnsetMarker):
+            del arguments[chunk.new_var]
+        else:
+            arguments[chunk.new_var] = original_value
+    return render_for
+
+
+def _compile_ast(ast):
+    # Flattens the AST into a list of closures which each append their output to a shared list.
+    # Runs of adjacent text blobs are merged into a single op.
+    ops = []
+    text = []
+    for chunk in ast:
+        if isinstance(chunk, str):
+            text.append(chunk)
+            continue
+
+        if text:
+            ops.append(_compile_text(''.join(text)))
+            text = []
+
+        if isinstance(chunk, Switch):
+            ops.append(_compile_switch(chunk))
+        elif isinstance(chunk, Replacement):
+            ops.append(_compile_replacement(chunk))
+        elif isinstance(chunk, For):
+            ops.append(_compile_for(chunk))
+        else:
+            raise NotImplementedError(
+                "Unknown chunk type {}".format(type(chunk)))
 
-    def __init__(self, ast: list):
-        self.ast = ast
+    if text:
+        ops.append(_compile_text(''.join(text)))
 
-    def render(self, arguments: dict, filters: dict={}):
+    return ops
 
-        def get_argument(name):
-            try:
-                return arguments[name]
-            except KeyError as ex:
-                raise UnsetParameter("Unset parameter {}".format(name), name) from ex
 
-        def render_ast(ast):
-            rendered = ""
-            for chunk in ast:
-                if isinstance(chunk, Switch):
-                    choice = get_argument(chunk.identifier)
-                    if choice not in chunk.cases:
-                        raise ValueError("switch %s: value `%s` is not in the set of handled cases" % (
-                            chunk.identifier, choice))
-                    rendered += render_ast(chunk.cases[choice])
-                elif isinstance(chunk, Replacement):
-                    value = get_argument(chunk.identifier)
-                    if chunk.filter is None:
-                        rendered += str(value)
-                    else:
-                        try:
-                            filter_func = filters[chunk.filter]
-                        except KeyError:
-                            raise UnsetParameter("Unset filter parameter {}".format(chunk.filter), chunk.filter)
-                        rendered += str(filter_func(value))
-                elif isinstance(chunk, For):
-                    # If the argument is a string, it should be a json list.
-                    iterable = get_argument(chunk.iterable)
-                    # TODO(cmaloney): for should only be used (for now) in code which doesn't contain
-                    # arbitrary user parameters.
-                    # Stash the original state of the argument.
-                    original_value = UnsetMarker()
-                    if chunk.new_var in arguments:
-                        original_value = arguments[chunk.new_var]
-
-                    assert isinstance(iterable, list)
-                    for value in iterable:
-                        arguments[chunk.new_var] = value
-                        rendered += render_ast(chunk.body)
-
-                    # Reset the argument to the original state.
-                    if isinstance(original_value, UnsetMarker):
-                        del arguments[chunk.new_var]
-                    else:
-                        arguments[chunk.new_var] = original_value
+class Template:
 
-                elif isinstance(chunk, str):
-                    rendered += chunk
-                else:
-                    raise NotImplementedError(
-                        "Unknown chunk type {}".format(type(chunk)))
+    def __init__(self, ast: list):
+        self.ast = ast
+        self._ops = None
+
+    def compile(self):
+        """Compile the AST into a flat list of render ops, caching the result.
 
-            return rendered
+        Rendering dispatches over the ops rather than re-walking the AST, and appends all output
+        into a single list which is joined once at the end.
+        """
+        if self._ops is None:
+            self._ops = _compile_ast(self.ast)
+        return self._ops
 
-        return render_ast(self.ast)
+    def render(self, arguments: dict, filters: dict={}):
+        out = []
+        _run_ops(self.compile(), arguments, filters, out)
+        return ''.join(out)
 
     def target_from_ast(self):
         def variables_from_ast(ast, blacklist):
@@ -416,6 +494,14 @@ class Template:
         filters.discard(None)
         return filters
 
+    def __getstate__(self):
+        # Compiled ops are closures which can't be pickled. They're rebuilt on first render.
+        return {'ast': self.ast}
+
+    def __setstate__(self, state):
+        self.ast = state['ast']
+        self._ops = None
+
     def __repr__(self):
         return "<template {}>".format(self.ast)
 
@@ -492,7 +578,52 @@ def _parse_chunks(tokenizer):
             return chunks
 
 
-def parse_str(text):
+def set_cache_dir(path: Optional[str]):
+    """Persist parsed templates to `path` in addition to the in-process cache.
+
+    Passing None disables the on-disk cache."""
+    global _cache_dir
+    _cache_dir = path
+
+
+def clear_cache():
+    _parse_cache.clear()
+
+
+def _cache_filename(key):
+    return os.path.join(_cache_dir, '{}.v{}.pickle'.format(key, cache_format_version))
+
+
+def _load_from_disk(key):
+    try:
+        with open(_cache_filename(key), 'rb') as f:
+            template = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        # A corrupt or incompatible entry just means the template gets re-parsed and re-written.
+        log.debug("Ignoring unreadable template cache entry %s: %s", key, ex)
+        return None
+
+    if not isinstance(template, Template):
+        return None
+    return template
+
+
+def _write_to_disk(key, template):
+    filename = _cache_filename(key)
+    # Write then rename so concurrent readers never see a partially written entry.
+    tmp_filename = '{}.tmp.{}'.format(filename, os.getpid())
+    try:
+        os.makedirs(_cache_dir, exist_ok=True)
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(template, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+    except OSError as ex:
+        log.warning("Unable to write template cache entry %s: %s", filename, ex)
+
+
+def _parse_str_uncached(text):
     tokenizer = Tokenizer(text)
     ast = _parse_chunks(tokenizer)
     token_type, _ = tokenizer.peek()
@@ -502,6 +633,26 @@ def parse_str(text):
     return Template(ast)
 
 
+def parse_str(text):
+    key = hashlib.sha1(text.encode()).hexdigest()
+    try:
+        return _parse_cache[key]
+    except KeyError:
+        pass
+
+    template = None
+    if _cache_dir:
+        template = _load_from_disk(key)
+
+    if template is None:
+        template = _parse_str_uncached(text)
+        if _cache_dir:
+            _write_to_disk(key, template)
+
+    _parse_cache[key] = template
+    return template
+
+
 def parse_resources(filename):
     try:
         return parse_str(resource_string(__name__, filename).decode())
@@ -119,3 +119,63 @@ def test_resolve_late():
     assert resolver.late == {'c'}
 
     # TODO(cmaloney): Test resolved from late variables
+
+
+def test_resolve_incremental():
+    calls = list()
+
+    def calc_e(a, c):
+        calls.append('e')
+        return a + c
+
+    def calc_f(b):
+        calls.append('f')
+        return b + '_f'
+
+    calc_source = Source({'must': {'e': calc_e, 'f': calc_f}})
+
+    def get_target():
+        return Target({'a', 'b', 'c', 'e', 'f'}, get_test_target().sub_scopes)
+
+    def get_user_source(c, d):
+        user_source = Source(is_user=True)
+        user_source.add_must('c', c)
+        user_source.add_must('d', d)
+        user_source.add_must('d_1_a', 'd_1_a_str')
+        user_source.add_must('d_2_a', 'd_2_a_str')
+        return user_source
+
+    base = gen.internals.resolve_configuration(
+        [test_source, calc_source, get_user_source('c_1', 'd_1')], [get_target()])
+    assert base.status_dict == {'status': 'ok'}
+    assert sorted(calls) == ['e', 'f']
+
+    def check_matches_full_resolve(user_source):
+        del calls[:]
+        full = gen.internals.resolve_configuration([test_source, calc_source, user_source], [get_target()])
+        expected_calls = sorted(calls)
+
+        del calls[:]
+        derived = gen.internals.resolve_configuration(
+            [test_source, calc_source, user_source], [get_target()], base_resolver=base)
+
+        assert derived.status_dict == full.status_dict
+        assert {k: v.value for k, v in derived.arguments.items() if not v.is_error} == \
+            {k: v.value for k, v in full.arguments.items() if not v.is_error}
+        assert derived.arguments.keys() == full.arguments.keys()
+        assert expected_calls == ['e', 'f']
+        return sorted(calls)
+
+    # Nothing changed, nothing is recalculated.
+    assert check_matches_full_resolve(get_user_source('c_1', 'd_1')) == []
+
+    # Only the arguments depending on c are recalculated.
+    assert check_matches_full_resolve(get_user_source('c_2', 'd_1')) == ['e']
+
+    # Changing a switch brings in the arguments of the other case.
+    assert check_matches_full_resolve(get_user_source('c_1', 'd_2')) == []
+
+    # The base resolver is left untouched.
+    assert base.arguments['c'].value == 'c_1'
+    assert base.arguments['e'].value == 'a_strc_1'
+    assert 'd_2_b' not in base.arguments
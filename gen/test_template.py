@@ -150,3 +150,49 @@ def test_render():
             "btcelsefoo")
     with pytest.raises(UnsetParameter):
         parse_str("{% for a in b %}{{ a }}{% endfor %}else{{ a }}").render({"b": ['b', 't', 'c']})
+
+
+def test_render_switch():
+    template = parse_str('a{% switch foo %}{% case "x" %}{{ b }}x{% case "y" %}y{% endswitch %}c')
+    assert template.render({"foo": "x", "b": "1"}) == "a1xc"
+    assert template.render({"foo": "y"}) == "ayc"
+    with pytest.raises(ValueError):
+        template.render({"foo": "z"})
+    with pytest.raises(UnsetParameter):
+        template.render({"foo": "x"})
+
+
+def test_compile():
+    template = parse_str("a{{{{ b {{ c }}d{% for e in f %}{{ e | g }}{% endfor %}")
+    ops = template.compile()
+    # Adjacent text blobs are merged into a single op.
+    assert len(ops) == 4
+    # The compiled ops are cached and reused across renders.
+    assert template.compile() is ops
+    assert template.render({"c": "1", "f": ["x", "y"]}, {"g": str.upper}) == "a{{ b 1dXY"
+
+
+def test_parse_cache(tmpdir, monkeypatch):
+    gen.template.clear_cache()
+    gen.template.set_cache_dir(str(tmpdir))
+    try:
+        text = "a{{ b }}{% for c in d %}{{ c }}{% endfor %}"
+        template = parse_str(text)
+        assert parse_str(text) is template
+        assert len(tmpdir.listdir()) == 1
+
+        # A fresh process-level cache is populated from disk without re-tokenizing.
+        gen.template.clear_cache()
+        monkeypatch.setattr(gen.template, 'Tokenizer', None)
+        from_disk = parse_str(text)
+        assert from_disk is not template
+        assert from_disk == template
+        assert from_disk.render({"b": "1", "d": ["x", "y"]}) == "a1xy"
+
+        # Changed content gets a new cache entry.
+        monkeypatch.undo()
+        assert parse_str(text + "e").render({"b": "1", "d": ["x"]}) == "a1xe"
+        assert len(tmpdir.listdir()) == 2
+    finally:
+        gen.template.set_cache_dir(None)
+        gen.template.clear_cache()
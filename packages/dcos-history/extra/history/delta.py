@@ -0,0 +1,73 @@
+"""Structural differences between consecutive Mesos state-summaries.
+
+Lists of objects with an 'id', like 'slaves' and 'frameworks', are compared object by object, so a
+delta only holds the agents and frameworks which changed. Every other top level value is stored whole
+when it changes. Deltas are plain JSON-able dicts:
+
+    {'set': {key: value},
+     'unset': [key],
+     'lists': {key: {'changed': [object], 'removed': [id], 'order': [id]}}}
+
+where 'order' is only there when the ids aren't in the order of the previous state, less the removed
+ones, followed by the ones added in 'changed'.
+"""
+
+
+def _by_id(value):
+    """Return value as a dict of its objects by id, if it's a list of objects with unique string ids."""
+    if not isinstance(value, list):
+        return None
+    if not all(isinstance(item, dict) and isinstance(item.get('id'), str) for item in value):
+        return None
+    items = {item['id']: item for item in value}
+    if len(items) != len(value):
+        return None
+    return items
+
+
+def _merged_order(old_list, removed, changed, old_items):
+    return ([item['id'] for item in old_list if item['id'] not in removed] +
+            [item['id'] for item in changed if item['id'] not in old_items])
+
+
+def diff(old, new):
+    """Return the delta which apply() turns old into new, both dicts."""
+    delta = {'set': {}, 'unset': [key for key in old if key not in new], 'lists': {}}
+    for key, value in new.items():
+        if key not in old:
+            delta['set'][key] = value
+            continue
+        old_items = _by_id(old[key])
+        new_items = _by_id(value)
+        if old_items is None or new_items is None:
+            if old[key] != value:
+                delta['set'][key] = value
+            continue
+
+        changed = [item for item in value if old_items.get(item['id']) != item]
+        removed = [item['id'] for item in old[key] if item['id'] not in new_items]
+        list_delta = {'changed': changed, 'removed': removed}
+        order = [item['id'] for item in value]
+        if _merged_order(old[key], set(removed), changed, old_items) != order:
+            list_delta['order'] = order
+        elif not changed and not removed:
+            continue
+        delta['lists'][key] = list_delta
+    return delta
+
+
+def apply(old, delta):
+    """Return the new state from the old one and the delta between them, without modifying old."""
+    new = dict(old)
+    for key in delta['unset']:
+        del new[key]
+    new.update(delta['set'])
+    for key, list_delta in delta['lists'].items():
+        old_items = {item['id']: item for item in old[key]}
+        items = dict(old_items)
+        items.update((item['id'], item) for item in list_delta['changed'])
+        order = list_delta.get('order')
+        if order is None:
+            order = _merged_order(old[key], set(list_delta['removed']), list_delta['changed'], old_items)
+        new[key] = [items[item_id] for item_id in order]
+    return new
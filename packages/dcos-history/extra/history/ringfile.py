@@ -0,0 +1,133 @@
+"""A fixed number of timestamped blobs kept in a single file, overwriting the oldest when full.
+
+The file starts with a header and an index with a record for each of slot_count slots, followed by the
+slots, slot_size bytes each. Entry n goes in slot n % slot_count, so once the file is created it doesn't
+change size as long as entries fit in a slot. When one doesn't, the file is rewritten with slots big
+enough for it.
+"""
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+MAGIC = b'DCOSHIST'
+# magic, slot_count, slot_size
+HEADER = struct.Struct('<8sII')
+# sequence number (0 if the slot is empty), timestamp, length, crc32 of the data
+RECORD = struct.Struct('<QdII')
+EMPTY_RECORD = (0, 0, 0, 0)
+MIN_SLOT_SIZE = 64 * 1024
+EPOCH = datetime(1970, 1, 1)
+
+log = logging.getLogger(__name__)
+
+
+def _fitting_slot_size(slot_size, length):
+    """Return slot_size, doubled until length fits in it"""
+    while slot_size < length:
+        slot_size *= 2
+    return slot_size
+
+
+class RingFile():
+
+    def __init__(self, path, slot_count):
+        """
+        :param path: (str) path of the file, which is created if it doesn't exist
+        :param slot_count: how many entries to keep
+        """
+        self.path = path
+        self.slot_count = slot_count
+        self.file = None
+        # Entries are read by the threads serving requests while they are appended.
+        self.lock = threading.RLock()
+        entries = []
+        try:
+            self.file = open(path, 'r+b')
+            magic, self.slot_count, self.slot_size = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('bad magic {!r}'.format(magic))
+            self.records = [RECORD.unpack(self.file.read(RECORD.size)) for _ in range(self.slot_count)]
+            self.seq = max(record[0] for record in self.records)
+            if self.slot_count == slot_count:
+                return
+            # The number of entries to keep changed, carry over the newest ones, numbered for the new slots.
+            entries = [(seq, timestamp, self.read(slot)) for seq, (timestamp, slot, _) in enumerate(self.entries(), 1)]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, struct.error) as e:
+            log.warning('Discarding unreadable history file {}: {}'.format(path, e))
+
+        self.slot_count = slot_count
+        self._rewrite(MIN_SLOT_SIZE, entries)
+
+    def _offset(self, slot):
+        return HEADER.size + self.slot_count * RECORD.size + slot * self.slot_size
+
+    def _write(self, f, seq, timestamp: datetime, data):
+        slot = seq % self.slot_count
+        f.seek(self._offset(slot))
+        f.write(data)
+        # The record is written after the data, so if writing the data was interrupted the crc won't match.
+        record = (seq, (timestamp - EPOCH).total_seconds(), len(data), zlib.crc32(data))
+        f.seek(HEADER.size + slot * RECORD.size)
+        f.write(RECORD.pack(*record))
+        return record
+
+    def _rewrite(self, slot_size, entries):
+        """Replace the file with one holding entries, a list of (seq, timestamp, data), in slots of slot_size or more"""
+        entries = [(seq, timestamp, data) for seq, timestamp, data in entries if data is not None][-self.slot_count:]
+        self.slot_size = _fitting_slot_size(slot_size, max([len(data) for _, _, data in entries] + [0]))
+        self.records = [EMPTY_RECORD] * self.slot_count
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.slot_count, self.slot_size))
+            f.write(RECORD.pack(*EMPTY_RECORD) * self.slot_count)
+            size = self._offset(self.slot_count)
+            f.truncate(size)
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                # Not supported by the OS or filesystem, the file stays sparse.
+                pass
+            for seq, timestamp, data in entries:
+                self.records[seq % self.slot_count] = self._write(f, seq, timestamp, data)
+        os.replace(tmp_path, self.path)
+        if self.file:
+            self.file.close()
+        self.file = open(self.path, 'r+b')
+        self.seq = max([seq for seq, _, _ in entries] + [0])
+
+    def entries(self):
+        """The (timestamp, slot, seq) of each entry, oldest first."""
+        return [(EPOCH + timedelta(seconds=timestamp), slot, seq) for seq, timestamp, slot in
+                sorted((record[0], record[1], slot) for slot, record in enumerate(self.records) if record[0])]
+
+    def read(self, slot, seq=None):
+        """Return the data of the entry in slot, or None if it wasn't completely written.
+
+        If seq is given, also return None if the entry in the slot isn't that one anymore.
+        """
+        with self.lock:
+            record_seq, _, length, crc = self.records[slot]
+            if seq is not None and record_seq != seq:
+                return None
+            self.file.seek(self._offset(slot))
+            data = self.file.read(length)
+        if len(data) != length or zlib.crc32(data) != crc:
+            log.warning('Ignoring corrupt entry in slot {} of {}'.format(slot, self.path))
+            return None
+        return data
+
+    def append(self, timestamp: datetime, data):
+        """Add an entry, replacing the oldest one if there are already slot_count entries."""
+        with self.lock:
+            if len(data) > self.slot_size:
+                # Entries keep their seq, and so their slot, so they can still be read by (slot, seq).
+                entries = [(seq, entry_time, self.read(slot)) for entry_time, slot, seq in self.entries()]
+                self._rewrite(_fitting_slot_size(self.slot_size, len(data)), entries)
+            self.seq += 1
+            self.records[self.seq % self.slot_count] = self._write(self.file, self.seq, timestamp, data)
+            self.file.flush()
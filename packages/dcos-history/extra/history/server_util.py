@@ -1,9 +1,13 @@
+import gzip
+import json
 import logging
 import os
 import sys
-import threading
+import time
+import weakref
+from datetime import datetime
 
-from flask import Flask, Response
+from flask import Flask, request, Response
 from flask.ext.compress import Compress
 
 from history.statebuffer import BufferCollection, BufferUpdater
@@ -11,8 +15,12 @@ from history.statebuffer import BufferCollection, BufferUpdater
 
 compress = Compress()
 state_buffer = None
+updater = None
 log = logging.getLogger(__name__)
 add_headers_cb = None
+GZIP_LEVEL = 6
+# Buffer versions start over when the service restarts, so ETags also have when it started.
+ETAG_PREFIX = '{:x}'.format(int(time.time()))
 
 
 try:
@@ -45,10 +53,35 @@ def headers_cb():
     return headers
 
 
+class ResponseCache():
+    """Keeps the gzipped body of the response for each buffer, building it again only once the buffer changed.
+
+    The body isn't also kept uncompressed, as that would hold every state of the buffer in full, undoing the
+    compression of the buffers. Clients which don't accept gzip get it decompressed.
+    """
+
+    def __init__(self):
+        # buffer -> (version, gzipped body)
+        self.bodies = weakref.WeakKeyDictionary()
+
+    def get(self, buffer):
+        # Read before dumping the buffer, so that if it is updated meanwhile the body gets built again next time.
+        version = buffer.version
+        cached = self.bodies.get(buffer)
+        if cached is None or cached[0] != version:
+            body = _json_array_(buffer.dump()).encode()
+            cached = (version, gzip.compress(body, GZIP_LEVEL))
+            self.bodies[buffer] = cached
+        return cached[1]
+
+
+response_cache = ResponseCache()
+
+
 def update():
-    BufferUpdater(state_buffer, headers_cb).update()
-    update_thread = threading.Timer(2, update)
-    update_thread.start()
+    global updater
+    updater = BufferUpdater(state_buffer, headers_cb)
+    updater.run()
 
 
 def create_app():
@@ -75,6 +108,7 @@ def home():
     return _response_("history/last - to get the last fetched state\n" +
                       "history/minute - to get the state array of the last minute\n" +
                       "history/hour - to get the state array of the last hour\n" +
+                      "history/stats - to get statistics of fetching the state\n" +
                       "ping - to get a pong\n")
 
 
@@ -86,6 +120,10 @@ def last():
     return _response_(state_buffer.dump('last')[0])
 
 
+def stats():
+    return _response_(json.dumps(updater.stats() if updater else {}))
+
+
 def minute():
     return _buffer_response_('minute')
 
@@ -95,11 +133,44 @@ def hour():
 
 
 def _buffer_response_(name):
-    return _response_("[" + ",".join(state_buffer.dump(name)) + "]")
-
+    """The states in the buffer as a JSON array, or only those since the ?since= time in seconds since the epoch
 
-def _response_(content):
-    return Response(response=content, content_type="application/json", headers=headers_cb())
+    Responses have a weak ETag, so polls can use If-None-Match to get a 304 Not Modified until the buffer
+    changes, and an X-History-Timestamp header with the time of the newest state to pass as since next time.
+    """
+    buffer = state_buffer.buffers[name]
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = datetime.fromtimestamp(float(since))
+        except (ValueError, OverflowError, OSError):
+            return _response_('Invalid since: {}\n'.format(since), status=400)
+    etag = '{}-{}-{}'.format(ETAG_PREFIX, name, buffer.version)
+    headers = headers_cb()
+    if buffer.last_update:
+        headers['X-History-Timestamp'] = str(buffer.last_update.timestamp())
+    headers['Vary'] = 'Accept-Encoding'
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    elif since is not None:
+        response = _response_(_json_array_(buffer.dump(since)), headers=headers)
+    elif 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+        headers['Content-Encoding'] = 'gzip'
+        response = _response_(response_cache.get(buffer), headers=headers)
+    else:
+        response = _response_(gzip.decompress(response_cache.get(buffer)), headers=headers)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _json_array_(states):
+    return "[" + ",".join(states) + "]"
+
+
+def _response_(content, status=200, headers=None):
+    return Response(response=content, status=status, content_type="application/json",
+                    headers=headers_cb() if headers is None else headers)
 
 
 def route(app):
@@ -108,6 +179,7 @@ def route(app):
     app.add_url_rule('/history/last', view_func=last)
     app.add_url_rule('/history/minute', view_func=minute)
     app.add_url_rule('/history/hour', view_func=hour)
+    app.add_url_rule('/history/stats', view_func=stats)
 
 
 def test():
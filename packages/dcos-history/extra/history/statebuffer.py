@@ -2,16 +2,27 @@ import json
 import logging
 import os
 import threading
-from collections import deque
+import time
+import zlib
+from collections import deque, namedtuple
 from datetime import datetime, timedelta
 from typing import Optional
 
 import requests
 
+from history import delta
+from history.ringfile import RingFile
+
 logging.getLogger('requests.packages.urllib3').setLevel(logging.WARN)
 
 FETCH_PERIOD = 2
 FILE_EXT = '.state-summary.json'
+RING_FILE = 'state-summary.ring'
+COMPRESSION_LEVEL = 6
+# Store a full state every this many updates, and deltas from the previous state in between.
+KEYFRAME_INTERVAL = 10
+# Marks stored data which is a delta rather than a full state, which never starts with a NUL.
+DELTA_MARKER = '\0'
 
 STATE_SUMMARY_URI = os.getenv('STATE_SUMMARY_URI', 'http://leader.mesos:5050/state-summary')
 
@@ -26,11 +37,33 @@ if 'TLS_VERIFY' in os.environ:
     else:
         TLS_VERIFY = os.environ['TLS_VERIFY']
 
+# Reused for every fetch, so the connection to the master is kept alive between them.
+session = requests.Session()
+DELTA_ENCODING = os.getenv('HISTORY_DELTA_ENCODING', 'false') == 'true'
+
 
 def parse_log_time(fname):
     return datetime.strptime(fname, '%Y-%m-%dT%H:%M:%S.%f{}'.format(FILE_EXT))
 
 
+def compress(state):
+    return zlib.compress(state.encode(), COMPRESSION_LEVEL)
+
+
+def decompress(data):
+    return zlib.decompress(data).decode()
+
+
+# In place of the data of a state which is only read from the ring file when it's needed.
+OnDisk = namedtuple('OnDisk', ['slot', 'seq'])
+# In place of the states missing for count updates, from a gap in the data.
+Gap = namedtuple('Gap', ['count'])
+
+
+def _update_count(data):
+    return data.count if isinstance(data, Gap) else 1
+
+
 def fetch_state(headers_cb):
     timestamp = datetime.now()
     try:
@@ -39,7 +72,7 @@ def fetch_state(headers_cb):
         # state-summary. leader.mesos isn't updated instantly.
         # That requires mesos stop returning hostnames from `/master/redirect`.
         # See: https://github.com/apache/mesos/blob/master/src/master/http.cpp#L746
-        resp = requests.get(STATE_SUMMARY_URI, timeout=FETCH_PERIOD * .9, headers=headers_cb(), verify=TLS_VERIFY)
+        resp = session.get(STATE_SUMMARY_URI, timeout=FETCH_PERIOD * .9, headers=headers_cb(), verify=TLS_VERIFY)
         resp.raise_for_status()
         state = resp.text
     except Exception as e:
@@ -50,11 +83,13 @@ def fetch_state(headers_cb):
 
 class HistoryBuffer():
 
-    def __init__(self, time_window, update_period, path=None):
+    def __init__(self, time_window, update_period, path=None, keyframe_interval=None):
         """
         :param time_window: how many seconds this buffer will span
         :param update_period: the number of seconds between updates for this buffer
         :param path: (str) path for the dir to write to disk in
+        :param keyframe_interval: if set, store a full state every this many updates and only what
+            changed from the previous state in between
         """
         updates_per_window = int(time_window / update_period)
         if time_window % update_period != 0:
@@ -62,7 +97,19 @@ class HistoryBuffer():
                 'Invalid updates per window: {} '
                 'time_window/update_period must be an integer'.format(updates_per_window))
 
-        self.in_memory = deque([], updates_per_window)
+        self.updates_per_window = updates_per_window
+        self.keyframe_interval = keyframe_interval
+        # The parsed last state added, which the next one is stored as a delta from.
+        self.last_state = None
+        self.since_keyframe = 0
+        # (timestamp, zlib compressed state or delta, OnDisk or Gap), oldest first. With deltas, up to
+        # keyframe_interval more updates than the window are kept, so the oldest one in the window can
+        # always be decoded.
+        self.in_memory = deque()
+        self.max_updates = updates_per_window + (keyframe_interval or 0)
+        self.update_count = 0
+        # Incremented on every update, for telling whether what dump() returns changed.
+        self.version = 0
         self.update_period = timedelta(seconds=update_period)
 
         if path:
@@ -71,77 +118,142 @@ class HistoryBuffer():
             except FileExistsError:
                 logging.info('Using previously created buffer persistence dir: {}'.format(path))
             self.path = path
-            self.disk_count = updates_per_window
-            old_files = [os.path.join(self.path, f) for f in os.listdir(self.path)]
-            filtered_old_files = [f for f in old_files if f.endswith(FILE_EXT)]
-            self.disk_files = list(sorted(filtered_old_files))
-            backup_files = self.disk_files[-1 * updates_per_window:]
-            backup_count = len(backup_files)
-
-            def update_and_ff(f_path, ff_end):
-                """Accounts for gaps between data in memory with blank filler
-                """
-                # Set timestamp to None for memory-only buffer updates
-                with open(f_path, 'r') as fh:
-                    self._update_buffer(fh.read())
-                while (ff_end - self.update_period) >= self.next_update:
-                    self._update_buffer('{}')
-
-            for idx, f in enumerate(backup_files):
+            self.ring = RingFile(os.path.join(path, RING_FILE), self.max_updates)
+            self._import_backup_files()
+            # Only the index of the ring file is read, the backups are read from it when they're dumped.
+            backups = sorted(self.ring.entries())
+
+            for idx, (timestamp, slot, seq) in enumerate(backups):
                 if idx == 0:
-                    # set the first update time to correspond to the oldest backup file
+                    # set the first update time to correspond to the oldest backup
                     # before we attempt to do an update and fastforward
-                    self.next_update = parse_log_time(f.split('/')[-1])
-                if idx == (backup_count - 1):
-                    # Last backup file, fastforward to present
-                    update_and_ff(f, datetime.now())
-                else:
-                    # More backup files, only fastforward to the next one
-                    next_filetime = parse_log_time(backup_files[idx + 1].split('/')[-1])
-                    update_and_ff(f, next_filetime)
+                    self.next_update = timestamp
+                # More backups, only fastforward to the next one, otherwise fastforward to present
+                ff_end = backups[idx + 1][0] if idx + 1 < len(backups) else datetime.now()
+                # Memory-only buffer updates, the backups are already on disk
+                self._update_buffer(OnDisk(slot, seq), timestamp)
+                # Accounts for gaps between data in memory with blank filler
+                if (ff_end - self.update_period) >= self.next_update:
+                    count = (ff_end - self.update_period - self.next_update) // self.update_period + 1
+                    self._update_buffer(Gap(count), self.next_update)
         else:
-            self.disk_count = 0
+            self.ring = None
 
         # Guarantees first call after instanciation will cause update
         self.next_update = datetime.now()
 
-    def _get_datafile_name(self, timestamp: datetime):
-        assert timestamp.tzinfo is None
-        return '{}/{}{}'.format(self.path, timestamp.isoformat(), FILE_EXT)
-
-    def _clean_excess_disk_files(self):
-        while len(self.disk_files) > self.disk_count:
-            os.remove(self.disk_files.pop(0))
+    def _import_backup_files(self):
+        """Move the backups kept as one file per update by earlier versions into the ring file"""
+        backup_files = sorted(f for f in os.listdir(self.path) if f.endswith(FILE_EXT))
+        for f in backup_files[-1 * self.ring.slot_count:]:
+            with open(os.path.join(self.path, f), 'r') as fh:
+                self.ring.append(parse_log_time(f), compress(fh.read()))
+        for f in backup_files:
+            os.remove(os.path.join(self.path, f))
 
     def add_data(self, timestamp: datetime, state):
         if timestamp >= self.next_update:
-            self._update_buffer(state, storage_time=timestamp)
+            self._update_buffer(self._encode(state), timestamp, persist=True)
+
+    def _encode(self, state):
+        if not self.keyframe_interval:
+            return compress(state)
+        try:
+            parsed = json.loads(state)
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            parsed = None
+
+        last_state, self.last_state = self.last_state, parsed
+        if last_state and parsed is not None and self.since_keyframe < self.keyframe_interval - 1:
+            self.since_keyframe += 1
+            return compress(DELTA_MARKER + json.dumps(delta.diff(last_state, parsed), separators=(',', ':')))
+        self.since_keyframe = 0
+        return compress(state)
 
-    def _update_buffer(self, state, storage_time: Optional[datetime]=None):
-        self.in_memory.append(state)
-        self.next_update += self.update_period
+    def _update_buffer(self, data, timestamp: datetime, persist=False):
+        count = _update_count(data)
+        self.in_memory.append((timestamp, data))
+        self.update_count += count
+        self.next_update += count * self.update_period
+        self.version += 1
 
-        if storage_time and (self.disk_count > 0):
-            data_file = self._get_datafile_name(storage_time)
-            with open(data_file, 'w') as f:
-                json.dump(state, f)
-            self.disk_files.append(data_file)
-            self._clean_excess_disk_files()
+        while self.update_count > self.max_updates:
+            excess = self.update_count - self.max_updates
+            first_timestamp, first = self.in_memory[0]
+            if isinstance(first, Gap) and first.count > excess:
+                self.in_memory[0] = (first_timestamp + excess * self.update_period, Gap(first.count - excess))
+                self.update_count -= excess
+            else:
+                self.in_memory.popleft()
+                self.update_count -= _update_count(first)
 
-    def dump(self):
-        return self.in_memory
+        if persist and self.ring:
+            self.ring.append(timestamp, data)
+
+    @property
+    def last_update(self) -> Optional[datetime]:
+        """The time of the newest state in the buffer"""
+        if not self.in_memory:
+            return None
+        timestamp, data = self.in_memory[-1]
+        return timestamp + (_update_count(data) - 1) * self.update_period
+
+    def dump(self, since: Optional[datetime]=None):
+        """Return the states in the window, oldest first, or only those newer than since"""
+        states = deque([], self.updates_per_window)
+        entries = list(self.in_memory)
+        # Updates before the window are only decoded for the deltas in it.
+        first_dumped = sum(_update_count(data) for _, data in entries) - self.updates_per_window
+        idx = 0
+        # The previous state as text, and parsed once a delta from it needs it.
+        previous_text = None
+        previous = None
+        for timestamp, data in entries:
+            if isinstance(data, Gap):
+                # Blank filler, deltas after it are from the state before the gap.
+                for i in range(data.count):
+                    if idx >= first_dumped and (since is None or timestamp + i * self.update_period > since):
+                        states.append('{}')
+                    idx += 1
+                continue
+            if isinstance(data, OnDisk):
+                data = self.ring.read(*data)
+            text = None if data is None else decompress(data)
+            if text is None:
+                # The backup wasn't completely written, show it like a state which couldn't be fetched.
+                previous_text, previous = None, None
+            elif not text.startswith(DELTA_MARKER):
+                previous_text, previous = text, None
+            else:
+                try:
+                    if previous is None:
+                        previous = json.loads(previous_text)
+                    previous = delta.apply(previous, json.loads(text[len(DELTA_MARKER):]))
+                    previous_text = None
+                except (TypeError, ValueError, KeyError, AttributeError):
+                    # The state this is a delta from is gone, e.g. the ring file was shrunk.
+                    previous_text, previous = None, None
+            if idx >= first_dumped and (since is None or timestamp > since):
+                if previous_text is None and previous is not None:
+                    previous_text = json.dumps(previous, separators=(',', ':'))
+                states.append('{}' if previous_text is None else previous_text)
+            idx += 1
+        return states
 
 
 class BufferCollection():
     """Defines the buffers to be maintained"""
     def __init__(self, buffer_dir):
+        keyframe_interval = KEYFRAME_INTERVAL if DELTA_ENCODING else None
         self.buffers = {
-            'minute': HistoryBuffer(60, 2, path=buffer_dir + '/minute'),
-            'hour': HistoryBuffer(60 * 60, 60, path=buffer_dir + '/hour'),
+            'minute': HistoryBuffer(60, 2, path=buffer_dir + '/minute', keyframe_interval=keyframe_interval),
+            'hour': HistoryBuffer(60 * 60, 60, path=buffer_dir + '/hour', keyframe_interval=keyframe_interval),
             'last': HistoryBuffer(FETCH_PERIOD, FETCH_PERIOD)}
 
-    def dump(self, name):
-        return self.buffers[name].dump()
+    def dump(self, name, since=None):
+        return self.buffers[name].dump(since)
 
     def add_data(self, timestamp, data):
         for buf in self.buffers.keys():
@@ -157,11 +269,59 @@ class BufferUpdater():
     def __init__(self, buffer_collection, headers_cb):
         self.buffer_collection = buffer_collection
         self.headers_cb = headers_cb
+        self.stopped = threading.Event()
+        self.thread = None
+        self.next_tick = None
+        self.fetches = 0
+        self.fetch_seconds = 0
+        self.last_fetch_seconds = None
+        self.max_fetch_seconds = 0
+        self.skipped_ticks = 0
 
     def update(self):
-        self.buffer_collection.add_data(*fetch_state(self.headers_cb))
+        start = time.monotonic()
+        timestamp, state = fetch_state(self.headers_cb)
+        duration = time.monotonic() - start
+        self.fetches += 1
+        self.fetch_seconds += duration
+        self.last_fetch_seconds = duration
+        self.max_fetch_seconds = max(self.max_fetch_seconds, duration)
+        self.buffer_collection.add_data(timestamp, state)
 
     def run(self):
+        """Update, then keep updating every FETCH_PERIOD seconds from a thread until stop() is called
+
+        Updates are scheduled from when run() was called rather than from when the last one finished, so
+        they don't drift. If an update takes longer than FETCH_PERIOD, the ticks it ran over are skipped
+        rather than catching up with updates back to back.
+        """
+        self.next_tick = time.monotonic()
         self.update()
-        t = threading.Timer(FETCH_PERIOD, self.run)
-        t.start()
+        self.thread = threading.Thread(target=self._loop, name='history-updater', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stopped.wait(self._schedule(time.monotonic())):
+            self.update()
+
+    def _schedule(self, now):
+        """Advance to the next tick which hasn't passed at now, returning the seconds until it"""
+        self.next_tick += FETCH_PERIOD
+        if now > self.next_tick:
+            skipped = int((now - self.next_tick) // FETCH_PERIOD) + 1
+            logging.warning('Fetching state took {:.1f}s, skipping {} update(s)'.format(
+                self.last_fetch_seconds, skipped))
+            self.skipped_ticks += skipped
+            self.next_tick += skipped * FETCH_PERIOD
+        return self.next_tick - now
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        return {
+            'fetches': self.fetches,
+            'fetch_seconds_mean': self.fetch_seconds / self.fetches if self.fetches else None,
+            'fetch_seconds_last': self.last_fetch_seconds,
+            'fetch_seconds_max': self.max_fetch_seconds,
+            'skipped_ticks': self.skipped_ticks}
@@ -1,16 +1,23 @@
 """Test uses randomly generated data such that data ordering
 and refreshing can be checked
 """
+import gzip
+import hashlib
+import json
 import os
 import random
 import string
+import time
+from collections import deque
 from datetime import datetime, timedelta
 
 import pytest
 
 import history.server_util
 import history.statebuffer
-from history.statebuffer import FETCH_PERIOD, FILE_EXT
+from history import delta
+from history.ringfile import MIN_SLOT_SIZE, RingFile
+from history.statebuffer import FETCH_PERIOD, FILE_EXT, RING_FILE
 
 
 @pytest.fixture(scope='function')
@@ -85,8 +92,9 @@ def test_endpoint_hour(history_service):
 
 def test_file_trimming(history_service):
     history_service[1](30 * 60 * 2)  # 2 hours of data
-    assert len(os.listdir(history_service[3].buffers['minute'].path)) == 30
-    assert len(os.listdir(history_service[3].buffers['hour'].path)) == 60
+    assert os.listdir(history_service[3].buffers['minute'].path) == [RING_FILE]
+    assert len(history_service[3].buffers['minute'].ring.entries()) == 30
+    assert len(history_service[3].buffers['hour'].ring.entries()) == 60
 
 
 def test_data_recovery(monkeypatch, tmpdir):
@@ -134,16 +142,165 @@ def test_data_recovery(monkeypatch, tmpdir):
     assert resp_data == exp_resp
     # also check that all the previous data is '2old'
     assert all([s == '2old' for s in resp_data[:-11]])
-    # check that excess old data was trimmed, but 'user' data is untouched
-    assert len(os.listdir(sb.buffers['minute'].path)) == 31
+    # check that the old backup files were moved into the ring file, but 'user' data is untouched
+    assert len(os.listdir(sb.buffers['minute'].path)) == 2
+    assert len(sb.buffers['minute'].ring.entries()) == 30
     resp = test_client.get("/history/hour")
     # No data was left for hour, so nothing loads other than the first update
     assert resp.data.decode() == '[baz]'
 
 
+def test_response_cache(history_service):
+    test_client, populate_buffer, mock_data, _ = history_service
+    populate_buffer(10)
+    resp = test_client.get('/history/minute', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.data).decode() == '[' + ','.join(mock_data) + ']'
+    etag = resp.headers['ETag']
+    timestamp = resp.headers['X-History-Timestamp']
+
+    # Unchanged buffers aren't dumped again
+    body = history.server_util.response_cache.get(history.server_util.state_buffer.buffers['minute'])
+    assert history.server_util.response_cache.get(history.server_util.state_buffer.buffers['minute']) is body
+    resp = test_client.get('/history/minute', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+    populate_buffer(2)
+    resp = test_client.get('/history/minute', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.data.decode() == '[' + ','.join(mock_data) + ']'
+
+    resp = test_client.get('/history/minute?since=' + timestamp)
+    assert resp.data.decode() == '[' + ','.join(mock_data[-2:]) + ']'
+    resp = test_client.get('/history/minute?since=' + resp.headers['X-History-Timestamp'])
+    assert resp.data.decode() == '[]'
+    assert test_client.get('/history/minute?since=yesterday').status_code == 400
+
+
+def test_updater_schedule(history_service):
+    updater = history.statebuffer.BufferUpdater(history_service[3], None)
+    updater.next_tick = 100
+    assert updater._schedule(100.5) == FETCH_PERIOD - 0.5
+    # Updates which run over are neither run late nor back to back
+    updater.last_fetch_seconds = 2.5 * FETCH_PERIOD
+    assert updater._schedule(100 + 3.5 * FETCH_PERIOD) == 0.5 * FETCH_PERIOD
+    assert updater.skipped_ticks == 2
+    assert updater.next_tick == 100 + 4 * FETCH_PERIOD
+
+
+def test_updater_run(history_service, monkeypatch):
+    test_client, _, mock_data, _ = history_service
+    monkeypatch.setattr(history.statebuffer, 'FETCH_PERIOD', 0.01)
+    updater = history.statebuffer.BufferUpdater(history_service[3], None)
+    monkeypatch.setattr(history.server_util, 'updater', updater)
+    updater.run()
+    # The first update is done before returning
+    assert updater.fetches >= 1
+    while updater.fetches < 5:
+        time.sleep(0.01)
+    updater.stop()
+    updater.thread.join()
+    stats = json.loads(test_client.get('/history/stats').data.decode())
+    assert stats['fetches'] == len(mock_data)
+    assert stats['fetch_seconds_max'] >= stats['fetch_seconds_mean'] > 0
+
+
+def test_lazy_recovery(monkeypatch, tmpdir):
+    path = tmpdir.join('minute').strpath
+    os.makedirs(path)
+    ring = RingFile(os.path.join(path, RING_FILE), 30)
+    now = datetime.now()
+    ring.append(now - timedelta(days=7), history.statebuffer.compress('old'))
+    ring.append(now - timedelta(seconds=5 * FETCH_PERIOD), history.statebuffer.compress('foo'))
+    ring.append(now - timedelta(seconds=2 * FETCH_PERIOD), history.statebuffer.compress('bar'))
+
+    reads = []
+    real_read = RingFile.read
+    monkeypatch.setattr(RingFile, 'read', lambda *args: reads.append(args) or real_read(*args))
+    buffer = history.statebuffer.HistoryBuffer(60, FETCH_PERIOD, path=path)
+    # Backups are only read when they're dumped, gaps are kept as their number of updates
+    assert reads == []
+    assert [type(data).__name__ for _, data in buffer.in_memory] == ['Gap', 'OnDisk', 'Gap', 'OnDisk', 'Gap']
+    assert buffer.in_memory[0][1].count == 25
+    assert buffer.dump() == deque(['{}'] * 25 + ['foo', '{}', '{}', 'bar', '{}'])
+    assert len(reads) == 2
+
+
 def test_add_headers(history_service):
     resp = history_service[0].get('/history/minute')
     # check that new header is added
     assert resp.headers['Authorization'] == 'test'
     # check that original headers are still there
     assert resp.headers['Access-Control-Max-Age'] == '86400'
+
+
+def test_ring_file(tmpdir):
+    path = tmpdir.join('ring').strpath
+    start_time = datetime.now()
+    ring = RingFile(path, 3)
+    # The last entry doesn't fit in a slot, so the file gets rewritten with bigger ones.
+    data = [str(i).encode() * (i * MIN_SLOT_SIZE // 4) for i in range(1, 7)]
+    for i, d in enumerate(data):
+        ring.append(start_time + timedelta(seconds=i), d)
+    assert ring.slot_size == 2 * MIN_SLOT_SIZE
+
+    def contents(ring):
+        return [(timestamp, ring.read(slot, seq)) for timestamp, slot, seq in ring.entries()]
+
+    expected = [(start_time + timedelta(seconds=i), data[i]) for i in range(3, 6)]
+    assert contents(ring) == expected
+    size = os.path.getsize(path)
+    ring.append(start_time + timedelta(seconds=6), b'7')
+    assert os.path.getsize(path) == size
+    expected = expected[1:] + [(start_time + timedelta(seconds=6), b'7')]
+
+    # Reopening keeps the entries, and drops the oldest ones if there are fewer slots
+    assert contents(RingFile(path, 3)) == expected
+    assert contents(RingFile(path, 2)) == expected[1:]
+
+    # Entries which weren't completely written are ignored
+    ring = RingFile(path, 2)
+    with open(path, 'r+b') as f:
+        f.seek(ring._offset(ring.entries()[0][1]))
+        f.write(b'x')
+    assert contents(RingFile(path, 2)) == [(expected[1][0], None), expected[2]]
+
+
+def make_state(i):
+    # Agents come and go from the start of the list, frameworks are listed newest first
+    return {
+        'hostname': 'master',
+        'tick': i,
+        'slaves': [
+            {'id': 'S{}'.format(j), 'pid': hashlib.sha1(str(j).encode()).hexdigest(), 'used': i if j == i % 5 else 0}
+            for j in range(i % 3, 200)],
+        'frameworks': [{'id': 'F{}'.format(j)} for j in reversed(range(i % 4))]}
+
+
+def test_delta():
+    states = [make_state(i) for i in range(12)] + [{'hostname': 'other', 'slaves': 'S0'}, make_state(0)]
+    for old, new in zip(states, states[1:]):
+        assert delta.apply(old, delta.diff(old, new)) == new
+    assert delta.diff(states[0], states[0]) == {'set': {}, 'unset': [], 'lists': {}}
+    assert delta.diff(states[3], states[4])['lists']['slaves'] == {
+        'changed': [dict(states[4]['slaves'][2], used=0), dict(states[4]['slaves'][3], used=4)],
+        'removed': ['S0']}
+
+
+def test_delta_encoding(tmpdir):
+    path = tmpdir.join('minute').strpath
+    start_time = datetime.now()
+    states = [make_state(i) for i in range(30)]
+    buffer = history.statebuffer.HistoryBuffer(20, 2, path=path, keyframe_interval=4)
+    for i, state in enumerate(states):
+        buffer.add_data(start_time + timedelta(seconds=i * 2), json.dumps(state))
+    assert [json.loads(state) for state in buffer.dump()] == states[-10:]
+    # Entries from before the window are kept for the deltas in it
+    assert len(buffer.in_memory) == 14
+    full_size = sum(len(history.statebuffer.compress(json.dumps(state))) for state in states[-14:])
+    assert sum(len(data) for _, data in buffer.in_memory) < full_size / 2
+
+    buffer = history.statebuffer.HistoryBuffer(20, 2, path=path, keyframe_interval=4)
+    assert [json.loads(state) for state in buffer.dump()] == states[-10:]
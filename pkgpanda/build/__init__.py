@@ -1,3 +1,4 @@
+import concurrent.futures
 import copy
 import json
 import multiprocessing
@@ -6,11 +7,15 @@ import random
 import shutil
 import string
 import tempfile
+import time
 from contextlib import contextmanager
+from functools import partial
 from os import chdir, getcwd, mkdir
 from os.path import exists
 from subprocess import CalledProcessError, check_call, check_output
 
+import requests
+
 import pkgpanda.build.constants
 import pkgpanda.build.src_fetchers
 from pkgpanda import expand_require as expand_require_exceptions
@@ -19,15 +24,20 @@ from pkgpanda.actions import add_package_file
 from pkgpanda.constants import RESERVED_UNIT_NAMES
 from pkgpanda.exceptions import FetchError, PackageError, ValidationError
 from pkgpanda.util import (check_forbidden_services, download_atomic,
-                           hash_checkout, load_json, load_string, logger,
-                           make_file, make_tar, rewrite_symlinks, write_json,
-                           write_string)
+                           extract_tarball, hash_checkout, load_json,
+                           load_string, logger, make_file, make_tar,
+                           rewrite_symlinks, write_json, write_string)
+
+# Seconds to wait on the repository when checking whether it has a package, see has_remote_package.
+REMOTE_PACKAGE_CHECK_TIMEOUT = 30
 
 
 class BuildError(Exception):
     """An error while building something."""
 
     def __init__(self, msg: str):
+        # Pass msg up so the exception can be pickled when raised in a build worker process.
+        super().__init__(msg)
         self.msg = msg
 
     def __str__(self):
@@ -253,6 +263,7 @@ class PackageStore:
         # Load an upstream if one exists
         # TODO(cmaloney): Allow upstreams to have upstreams
         self._package_cache_dir = self._packages_dir + "/cache/packages"
+        self._src_cache_dir = self._packages_dir + "/cache/src"
         self._upstream_dir = self._packages_dir + "/cache/upstream/checkout"
         self._upstream = None
         self._upstream_package_dir = self._upstream_dir + "/packages"
@@ -263,7 +274,7 @@ class PackageStore:
             try:
                 self._upstream = get_src_fetcher(
                     load_optional_json(upstream_config),
-                    self._packages_dir + '/cache/upstream',
+                    self.get_src_cache_folder(),
                     packages_dir)
                 self._upstream.checkout_to(self._upstream_dir)
                 if os.path.exists(self._upstream_package_dir + "/upstream.json"):
@@ -346,6 +357,11 @@ class PackageStore:
         check_call(['mkdir', '-p', directory])
         return directory
 
+    def get_src_cache_folder(self):
+        """Folder source fetchers cache downloads in, shared by all packages and variants."""
+        check_call(['mkdir', '-p', self._src_cache_dir])
+        return self._src_cache_dir
+
     def list_trees(self):
         return get_variants_from_filesystem(self._packages_dir, 'treeinfo.json')
 
@@ -371,13 +387,30 @@ class PackageStore:
     def packages_dir(self):
         return self._packages_dir
 
+    def get_package_url(self, pkg_id: PackageId):
+        return self._repository_url + '/packages/{0}/{1}.tar.xz'.format(pkg_id.name, pkg_id)
+
+    def has_remote_package(self, pkg_id: PackageId):
+        """Check whether try_fetch_by_id() would find the package, without downloading it."""
+        if self._repository_url is None:
+            return False
+
+        url = self.get_package_url(pkg_id)
+        if url.startswith('file://'):
+            return os.path.exists(url[len('file://'):])
+        try:
+            return requests.head(url, allow_redirects=True, timeout=REMOTE_PACKAGE_CHECK_TIMEOUT).status_code == 200
+        except requests.exceptions.RequestException as ex:
+            logger.warning("Unable to check for {} at {}, assuming it isn't there: {}".format(pkg_id, url, ex))
+            return False
+
     def try_fetch_by_id(self, pkg_id: PackageId):
         if self._repository_url is None:
             return False
 
         # TODO(cmaloney): Use storage providers to download instead of open coding.
         pkg_path = "{}.tar.xz".format(pkg_id)
-        url = self._repository_url + '/packages/{0}/{1}'.format(pkg_id.name, pkg_path)
+        url = self.get_package_url(pkg_id)
         try:
             directory = self.get_package_cache_folder(pkg_id.name)
             # TODO(cmaloney): Move to some sort of logging mechanism?
@@ -420,12 +453,61 @@ def get_docker_id(docker_name):
     return check_output(["docker", "inspect", "-f", "{{ .Id }}", docker_name]).decode('utf-8').strip()
 
 
-def hash_files_in_folder(directory):
+class FileHashCache:
+    """Remembers the sha1 of files so unchanged files don't have to be read again.
+
+    A file is unchanged if its size, mtime and inode all match the ones it had when it was hashed.
+    Only the files looked up since the cache was loaded are written back by `save()`, so entries
+    for files which went away get dropped.
+    """
+
+    # Files modified this recently may be modified again without their mtime changing, so they're
+    # always rehashed.
+    racy_seconds = 2
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._hashes = dict()
+        self._seen = dict()
+        if os.path.exists(filename):
+            try:
+                self._hashes = load_json(filename)
+            except ValueError as ex:
+                logger.warning("Ignoring unreadable file hash cache: {}".format(ex))
+
+    def sha1(self, filename):
+        abs_filename = os.path.abspath(filename)
+        stat = os.stat(abs_filename)
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        entry = self._hashes.get(abs_filename)
+        if entry is not None and entry['stat'] == key:
+            self._seen[abs_filename] = entry
+            return entry['sha1']
+
+        file_sha1 = pkgpanda.util.sha1(abs_filename)
+        if time.time() - stat.st_mtime > self.racy_seconds:
+            self._seen[abs_filename] = {'stat': key, 'sha1': file_sha1}
+        return file_sha1
+
+    def save(self):
+        if self._seen == self._hashes:
+            return
+        tmp_filename = self._filename + '.tmp'
+        write_json(tmp_filename, self._seen)
+        os.replace(tmp_filename, self._filename)
+        self._hashes = self._seen
+        self._seen = dict()
+
+
+def hash_files_in_folder(directory, hash_cache=None):
     """Given a relative path, hashes all files inside that folder and subfolders
 
     Returns a dictionary from filename to the hash of that file. If that whole
     dictionary is hashed, you get a hash of all the contents of the folder.
 
+    Files are hashed concurrently. If a FileHashCache is given, files which
+    haven't changed since it last saw them aren't read again.
+
     This is split out from calculating the whole folder hash so that the
     behavior in different walking corner cases can be more easily tested.
     """
@@ -434,6 +516,7 @@ def hash_files_in_folder(directory):
         "Got path: {}".format(directory)
     directory = directory.rstrip('/')
     file_hash_dict = {}
+    file_paths = {}
     # TODO(cmaloney): Disallow symlinks as they're hard to hash, people can symlink / copy in their
     # build steps if needed.
     for root, dirs, filenames in os.walk(directory):
@@ -441,7 +524,7 @@ def hash_files_in_folder(directory):
         for name in filenames:
             path = root + '/' + name
             base = path[len(directory) + 1:]
-            file_hash_dict[base] = pkgpanda.util.sha1(path)
+            file_paths[base] = path
 
         # If the directory has files inside of it, then it'll be picked up implicitly. by the files
         # or folders inside of it. If it contains nothing, it wouldn't be picked up but the existence
@@ -453,6 +536,15 @@ def hash_files_in_folder(directory):
             if path:
                 file_hash_dict[root[len(directory) + 1:]] = ""
 
+    # hashlib releases the GIL while hashing large buffers so threads hash files in parallel.
+    file_sha1 = pkgpanda.util.sha1 if hash_cache is None else hash_cache.sha1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+        for base, sha in zip(file_paths.keys(), executor.map(file_sha1, file_paths.values())):
+            file_hash_dict[base] = sha
+
+    if hash_cache is not None:
+        hash_cache.save()
+
     return file_hash_dict
 
 
@@ -464,16 +556,16 @@ def as_cwd(path):
     chdir(start_dir)
 
 
-def hash_folder_abs(directory, work_dir):
+def hash_folder_abs(directory, work_dir, hash_cache=None):
     assert directory.startswith(work_dir), "directory must be inside work_dir: {} {}".format(directory, work_dir)
     assert not work_dir[-1] == '/', "This code assumes no trailing slash on the work_dir"
 
     with as_cwd(work_dir):
-        return hash_folder(directory[len(work_dir) + 1:])
+        return hash_folder(directory[len(work_dir) + 1:], hash_cache)
 
 
-def hash_folder(directory):
-    return hash_checkout(hash_files_in_folder(directory))
+def hash_folder(directory, hash_cache=None):
+    return hash_checkout(hash_files_in_folder(directory, hash_cache))
 
 
 # Try to read json from the given file. If it is an empty file, then return an
@@ -509,7 +601,28 @@ def load_buildinfo(path, variant):
     return buildinfo
 
 
-def make_bootstrap_tarball(package_store, packages, variant):
+def get_package_layer(package_store, pkg_path, pkg_id):
+    """Return a folder in the bootstrap cache containing the extracted package.
+
+    Each package is only extracted the first time it is used. The folder must never be modified,
+    it is hardlinked into every bootstrap tarball the package is in.
+    """
+    layer_dir = package_store.get_bootstrap_cache_dir() + '/layers/' + pkg_id
+    if not os.path.exists(layer_dir):
+        tmp_dir = layer_dir + '_tmp'
+        check_call(['rm', '-rf', tmp_dir])
+        extract_tarball(pkg_path, tmp_dir)
+        os.rename(tmp_dir, layer_dir)
+    return layer_dir
+
+
+def make_bootstrap_tarball(package_store, packages, variant, layered=True):
+    """Make the bootstrap tarball containing the given package tarballs, activated.
+
+    If layered, packages are extracted once into a per package id layer in the bootstrap cache which
+    is hardlinked into the bootstrap, so only packages which changed since the last bootstrap was
+    made have to be extracted.
+    """
     # Convert filenames to package ids
     pkg_ids = list()
     for pkg_path in packages:
@@ -556,7 +669,11 @@ def make_bootstrap_tarball(package_store, packages, variant):
 
     print("Creating bootstrap tarball for variant {}".format(variant))
 
-    work_dir = tempfile.mkdtemp(prefix='mkpanda_bootstrap_tmp')
+    if layered:
+        # Hardlinking the layers needs the work dir on the same filesystem as the bootstrap cache.
+        work_dir = tempfile.mkdtemp(prefix='mkpanda_bootstrap_tmp', dir=bootstrap_cache_dir)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='mkpanda_bootstrap_tmp')
 
     def make_abs(path):
         return os.path.join(work_dir, path)
@@ -570,7 +687,11 @@ def make_bootstrap_tarball(package_store, packages, variant):
         pkg_id = filename[:-len(".tar.xz")]
 
         def local_fetcher(id, target):
-            shutil.unpack_archive(pkg_path, target, "gztar")
+            if layered:
+                check_call(['mkdir', '-p', os.path.dirname(target)])
+                check_call(['cp', '-al', get_package_layer(package_store, pkg_path, id), target])
+            else:
+                extract_tarball(pkg_path, target)
         repository.add(local_fetcher, pkg_id, False)
 
     # Activate the packages inside the repository.
@@ -609,26 +730,75 @@ def make_bootstrap_tarball(package_store, packages, variant):
     return mark_latest()
 
 
-def build_tree_variants(package_store, mkbootstrap):
-    """ Builds all possible tree variants in a given package store
+def get_requires(package_store, pkg_tuple):
+    return {expand_require(require) for require in package_store.packages[pkg_tuple]['requires']}
+
+
+def build_in_dependency_order(build_order, get_requires, build_fn, jobs=1):
+    """Call build_fn(name, variant) for every package tuple in build_order.
+
+    build_order must list every package after the packages it requires. With `jobs` greater than one,
+    up to that many packages whose requires have all been built are built at the same time, each in
+    a worker process. Variants of the same package share a cache folder, so they're never built at
+    the same time. Ties are broken by build_order.
+
+    Returns a dictionary from package tuple to what build_fn returned for it.
     """
-    result = dict()
-    tree_variants = get_variants_from_filesystem(package_store.packages_dir, 'treeinfo.json')
-    if len(tree_variants) == 0:
-        raise Exception('No treeinfo.json can be found in {}'.format(package_store.packages_dir))
-    for variant in tree_variants:
-        result[variant] = pkgpanda.build.build_tree(package_store, mkbootstrap, variant)
-    return result
+    results = dict()
+    if jobs <= 1:
+        for pkg_tuple in build_order:
+            results[pkg_tuple] = build_fn(*pkg_tuple)
+        return results
+
+    pending = list(build_order)
+    running = dict()
+    error = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            # After a failure let the running builds finish, but don't start any more.
+            if error is not None:
+                pending = list()
+
+            running_names = {name for name, _ in running.values()}
+            for pkg_tuple in list(pending):
+                if len(running) >= jobs:
+                    break
+                if pkg_tuple[0] in running_names:
+                    continue
+                if not get_requires(pkg_tuple) <= results.keys():
+                    continue
+                pending.remove(pkg_tuple)
+                running[executor.submit(build_fn, *pkg_tuple)] = pkg_tuple
+                running_names.add(pkg_tuple[0])
+
+            if not running:
+                if pending:
+                    raise BuildError("Unable to build {}. Their requires aren't in the build order.".format(pending))
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pkg_tuple = running.pop(future)
+                try:
+                    results[pkg_tuple] = future.result()
+                except Exception as ex:
+                    if error is None:
+                        error = ex
+
+    if error is not None:
+        raise error
 
+    return results
 
-def build_tree(package_store, mkbootstrap, tree_variant):
-    """Build packages and bootstrap tarballs for one or all tree variants.
 
-    Returns a dict mapping tree variants to bootstrap IDs.
+def get_package_sets(package_store, tree_variant):
+    if tree_variant:
+        return [package_store.get_package_set(tree_variant)]
+    return package_store.get_all_package_sets()
 
-    If tree_variant is None, builds all available tree variants.
 
-    """
+def get_build_order(package_store, package_sets):
+    """Return all the packages needed by package_sets, each after the packages it requires."""
     # TODO(cmaloney): Add support for circular dependencies. They are doable
     # long as there is a pre-built version of enough of the packages.
 
@@ -689,27 +859,115 @@ def build_tree(package_store, mkbootstrap, tree_variant):
                 continue
             visit(pkg_tuple)
 
-    if tree_variant:
-        package_sets = [package_store.get_package_set(tree_variant)]
-    else:
-        package_sets = package_store.get_all_package_sets()
+    # Build all required packages for all tree variants.
+    for package_set in package_sets:
+        visit_packages(package_set.all_packages)
+
+    return build_order
+
+
+def plan_tree(package_store, tree_variant):
+    """Work out which packages of one or all tree variants need to be built, without building anything.
+
+    Package ids are calculated the same way build() does, but no sources are fetched, no docker
+    images are pulled and nothing is downloaded. The docker image ids which are part of the package
+    id come from the images available locally, so packages whose image isn't available (and the
+    packages which require them) have an unknown package id.
+
+    Returns a machine-readable report with an entry per package, in build order. The status of each
+    package is one of:
+     - local: the package is in the package cache.
+     - remote: the package can be downloaded from the repository url.
+     - build: the package needs to be built.
+     - unknown: the package id couldn't be calculated, `reason` says why.
+    """
+    package_ids = dict()
+    docker_ids = dict()
+
+    def get_dependency_id(requires_name, requires_variant):
+        if (requires_name, requires_variant) not in package_ids:
+            raise BuildError("Package id of dependency {} variant {} is unknown".format(
+                requires_name,
+                pkgpanda.util.variant_name(requires_variant)))
+        return package_ids[(requires_name, requires_variant)]
+
+    def get_local_docker_id(docker_name):
+        if docker_name not in docker_ids:
+            try:
+                docker_ids[docker_name] = get_docker_id(docker_name)
+            except (CalledProcessError, OSError) as ex:
+                docker_ids[docker_name] = BuildError(
+                    "Docker image {} isn't available locally: {}".format(docker_name, ex))
+        if isinstance(docker_ids[docker_name], BuildError):
+            raise docker_ids[docker_name]
+        return docker_ids[docker_name]
+
+    packages = list()
+    for name, variant in get_build_order(package_store, get_package_sets(package_store, tree_variant)):
+        entry = {
+            'name': name,
+            'variant': variant,
+            'package_id': None,
+        }
+        try:
+            pkg_id = resolve_package(package_store, name, variant, get_dependency_id, get_local_docker_id)['pkg_id']
+        except BuildError as ex:
+            entry['status'] = 'unknown'
+            entry['reason'] = str(ex)
+        else:
+            package_ids[(name, variant)] = str(pkg_id)
+            entry['package_id'] = str(pkg_id)
+            if exists(package_store.get_package_path(pkg_id)):
+                entry['status'] = 'local'
+            elif package_store.has_remote_package(pkg_id):
+                entry['status'] = 'remote'
+            else:
+                entry['status'] = 'build'
+        packages.append(entry)
+
+    return {'packages': packages}
+
+
+def build_tree_variants(package_store, mkbootstrap, jobs=1):
+    """ Builds all possible tree variants in a given package store
+    """
+    result = dict()
+    tree_variants = get_variants_from_filesystem(package_store.packages_dir, 'treeinfo.json')
+    if len(tree_variants) == 0:
+        raise Exception('No treeinfo.json can be found in {}'.format(package_store.packages_dir))
+    for variant in tree_variants:
+        result[variant] = pkgpanda.build.build_tree(package_store, mkbootstrap, variant, jobs)
+    return result
+
+
+def build_tree(package_store, mkbootstrap, tree_variant, jobs=1):
+    """Build packages and bootstrap tarballs for one or all tree variants.
+
+    Returns a dict mapping tree variants to bootstrap IDs.
+
+    If tree_variant is None, builds all available tree variants.
+
+    Up to `jobs` packages which don't depend on each other are built at the same time.
+
+    """
+    package_sets = get_package_sets(package_store, tree_variant)
 
     with logger.scope("resolve package graph"):
-        # Build all required packages for all tree variants.
-        for package_set in package_sets:
-            visit_packages(package_set.all_packages)
+        build_order = get_build_order(package_store, package_sets)
+
+    # Run the builds, store the built package paths for later use.
+    # TODO(cmaloney): Only build the requested variants, rather than all variants.
+    build_fn = partial(build, package_store, clean_after_build=True, use_flow_id=jobs > 1)
+    build_results = build_in_dependency_order(
+        build_order,
+        partial(get_requires, package_store),
+        build_fn,
+        jobs)
 
     built_packages = dict()
-    for (name, variant) in build_order:
+    for (name, variant), pkg_path in build_results.items():
         built_packages.setdefault(name, dict())
-
-        # Run the build, store the built package path for later use.
-        # TODO(cmaloney): Only build the requested variants, rather than all variants.
-        built_packages[name][variant] = build(
-            package_store,
-            name,
-            variant,
-            True)
+        built_packages[name][variant] = pkg_path
 
     # Build bootstrap tarballs for all tree variants.
     def make_bootstrap(package_set):
@@ -806,31 +1064,22 @@ class IdBuilder():
         return self._buildinfo
 
 
-def build(package_store: PackageStore, name: str, variant, clean_after_build, recursive=False):
-    msg = "Building package {} variant {}".format(name, pkgpanda.util.variant_name(variant))
-    with logger.scope(msg):
-        return _build(package_store, name, variant, clean_after_build, recursive)
+def resolve_package(package_store, name, variant, get_dependency_id, get_docker_id):
+    """Work out the build ids, and from them the package id, of a package without building it.
 
+    get_dependency_id(name, variant) returns the package id string of a package required by this
+    one, get_docker_id(docker_name) the id of the docker image the package is built in.
 
-def _build(package_store, name, variant, clean_after_build, recursive):
-    assert isinstance(package_store, PackageStore)
-    tmpdir = tempfile.TemporaryDirectory(prefix="pkgpanda_repo")
-    repository = Repository(tmpdir.name)
-
+    Returns a dictionary with the package id and everything from the buildinfo needed to build it.
+    """
     package_dir = package_store.get_package_folder(name)
 
     def src_abs(name):
         return package_dir + '/' + name
 
-    def cache_abs(filename):
-        return package_store.get_package_cache_folder(name) + '/' + filename
-
     # Build pkginfo over time, translating fields from buildinfo.
     pkginfo = {}
 
-    # Build up the docker command arguments over time, translating fields as needed.
-    cmd = DockerCmd()
-
     assert (name, variant) in package_store.packages, \
         "Programming error: name, variant should have been validated to be valid before calling build()."
 
@@ -860,10 +1109,7 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     fetchers = dict()
     try:
         for src_name, src_info in sorted(sources.items()):
-            # TODO(cmaloney): Switch to a unified top level cache directory shared by all packages
-            cache_dir = package_store.get_package_cache_folder(name) + '/' + src_name
-            check_call(['mkdir', '-p', cache_dir])
-            fetcher = get_src_fetcher(src_info, cache_dir, package_dir)
+            fetcher = get_src_fetcher(src_info, package_store.get_src_cache_folder(), package_dir)
             fetchers[src_name] = fetcher
             checkout_ids[src_name] = fetcher.get_id()
     except ValidationError as ex:
@@ -889,23 +1135,16 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     # Add the "extra" folder inside the package as an additional source if it
     # exists
     if os.path.exists(extra_dir):
-        extra_id = hash_folder_abs(extra_dir, package_dir)
+        hash_cache = FileHashCache(package_store.get_package_cache_folder(name) + '/extra_hashes.json')
+        extra_id = hash_folder_abs(extra_dir, package_dir, hash_cache)
         builder.add('extra_source', extra_id)
         final_buildinfo['extra_source'] = extra_id
 
     # Figure out the docker name.
     docker_name = builder.take('docker')
-    cmd.container = docker_name
 
     # Add the id of the docker build environment to the build_ids.
-    try:
-        docker_id = get_docker_id(docker_name)
-    except CalledProcessError:
-        # docker pull the container and try again
-        check_call(['docker', 'pull', docker_name])
-        docker_id = get_docker_id(docker_name)
-
-    builder.update('docker', docker_id)
+    builder.update('docker', get_docker_id(docker_name))
 
     # TODO(cmaloney): The environment variables should be generated during build
     # not live in buildinfo.json.
@@ -916,7 +1155,6 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     if pkginfo['state_directory'] not in [True, False]:
         raise BuildError("state_directory in buildinfo.json must be a boolean `true` or `false`")
 
-    username = None
     if builder.has('username'):
         username = builder.take('username')
         if not isinstance(username, str):
@@ -928,7 +1166,6 @@ def _build(package_store, name, variant, clean_after_build, recursive):
             raise BuildError("username in buildinfo.json didn't meet the validation rules. {}".format(ex))
         pkginfo['username'] = username
 
-    group = None
     if builder.has('group'):
         group = builder.take('group')
         if not isinstance(group, str):
@@ -940,15 +1177,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
             raise BuildError("group in buildinfo.json didn't meet the validation rules. {}".format(ex))
         pkginfo['group'] = group
 
-    # Packages need directories inside the fake install root (otherwise docker
-    # will try making the directories on a readonly filesystem), so build the
-    # install root now, and make the package directories in it as we go.
-    install_dir = tempfile.mkdtemp(prefix="pkgpanda-")
-
-    active_packages = list()
     active_package_ids = set()
     active_package_variants = dict()
-    auto_deps = set()
 
     # Final package has the same requires as the build.
     requires = builder.take('requires')
@@ -987,52 +1217,22 @@ def _build(package_store, name, variant, clean_after_build, recursive):
 
         active_package_variants[requires_name] = requires_variant
 
-        # Figure out the last build of the dependency, add that as the
-        # fully expanded dependency.
-        requires_last_build = package_store.get_last_build_filename(requires_name, requires_variant)
-        if not os.path.exists(requires_last_build):
-            if recursive:
-                # Build the dependency
-                build(package_store, requires_name, requires_variant, clean_after_build, recursive)
-            else:
-                raise BuildError("No last build file found for dependency {} variant {}. Rebuild "
-                                 "the dependency".format(requires_name, requires_variant))
-
         try:
-            pkg_id_str = load_string(requires_last_build)
-            auto_deps.add(pkg_id_str)
-            pkg_buildinfo = package_store.get_buildinfo(requires_name, requires_variant)
-            pkg_requires = pkg_buildinfo['requires']
-            pkg_path = repository.package_path(pkg_id_str)
-            pkg_tar = pkg_id_str + '.tar.xz'
-            if not os.path.exists(package_store.get_package_cache_folder(requires_name) + '/' + pkg_tar):
-                raise BuildError(
-                    "The build tarball {} refered to by the last_build file of the dependency {} "
-                    "variant {} doesn't exist. Rebuild the dependency.".format(
-                        pkg_tar,
-                        requires_name,
-                        requires_variant))
-
-            active_package_ids.add(pkg_id_str)
-
-            # Mount the package into the docker container.
-            cmd.volumes[pkg_path] = "/opt/mesosphere/packages/{}:ro".format(pkg_id_str)
-            os.makedirs(os.path.join(install_dir, "packages/{}".format(pkg_id_str)))
+            # Add the fully expanded id of the dependency.
+            active_package_ids.add(get_dependency_id(requires_name, requires_variant))
 
             # Add the dependencies of the package to the set which will be
             # activated.
             # TODO(cmaloney): All these 'transitive' dependencies shouldn't
             # be available to the package being built, only what depends on
             # them directly.
-            to_check += pkg_requires
+            to_check += package_store.get_buildinfo(requires_name, requires_variant)['requires']
         except ValidationError as ex:
             raise BuildError("validating package needed as dependency {0}: {1}".format(requires_name, ex)) from ex
         except PackageError as ex:
             raise BuildError("loading package needed as dependency {0}: {1}".format(requires_name, ex)) from ex
 
     # Add requires to the package id, calculate the final package id.
-    # NOTE: active_packages isn't fully constructed here since we lazily load
-    # packages not already in the repository.
     builder.update('requires', list(active_package_ids))
     version_extra = None
     if builder.has('version_extra'):
@@ -1062,6 +1262,92 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     final_buildinfo['name'] = name
     final_buildinfo['variant'] = variant
 
+    return {
+        'pkg_id': pkg_id,
+        'version': version,
+        'build_script': build_script,
+        'extra_dir': extra_dir,
+        'docker_name': docker_name,
+        'fetchers': fetchers,
+        'dependency_ids': active_package_ids,
+        'pkginfo': pkginfo,
+        'final_buildinfo': final_buildinfo
+    }
+
+
+def build(package_store: PackageStore, name: str, variant, clean_after_build, recursive=False, use_flow_id=False):
+    msg = "Building package {} variant {}".format(name, pkgpanda.util.variant_name(variant))
+    # When packages are built concurrently each one's log messages are grouped by a flow id.
+    flow_id = None
+    if use_flow_id:
+        flow_id = '{}{}'.format(pkgpanda.util.variant_prefix(variant), name)
+    with logger.scope(msg, flow_id=flow_id):
+        return _build(package_store, name, variant, clean_after_build, recursive, flow_id)
+
+
+def _build(package_store, name, variant, clean_after_build, recursive, flow_id=None):
+    assert isinstance(package_store, PackageStore)
+    tmpdir = tempfile.TemporaryDirectory(prefix="pkgpanda_repo")
+    repository = Repository(tmpdir.name)
+
+    def cache_abs(filename):
+        return package_store.get_package_cache_folder(name) + '/' + filename
+
+    def get_dependency_id(requires_name, requires_variant):
+        # Figure out the last build of the dependency, add that as the
+        # fully expanded dependency.
+        requires_last_build = package_store.get_last_build_filename(requires_name, requires_variant)
+        if not os.path.exists(requires_last_build):
+            if recursive:
+                # Build the dependency
+                build(package_store, requires_name, requires_variant, clean_after_build, recursive)
+            else:
+                raise BuildError("No last build file found for dependency {} variant {}. Rebuild "
+                                 "the dependency".format(requires_name, requires_variant))
+
+        pkg_id_str = load_string(requires_last_build)
+        pkg_tar = pkg_id_str + '.tar.xz'
+        if not os.path.exists(package_store.get_package_cache_folder(requires_name) + '/' + pkg_tar):
+            raise BuildError(
+                "The build tarball {} refered to by the last_build file of the dependency {} "
+                "variant {} doesn't exist. Rebuild the dependency.".format(
+                    pkg_tar,
+                    requires_name,
+                    requires_variant))
+        return pkg_id_str
+
+    def get_or_pull_docker_id(docker_name):
+        try:
+            return get_docker_id(docker_name)
+        except CalledProcessError:
+            # docker pull the container and try again
+            check_call(['docker', 'pull', docker_name])
+            return get_docker_id(docker_name)
+
+    package = resolve_package(package_store, name, variant, get_dependency_id, get_or_pull_docker_id)
+    pkg_id = package['pkg_id']
+    version = package['version']
+    build_script = package['build_script']
+    extra_dir = package['extra_dir']
+    fetchers = package['fetchers']
+    auto_deps = package['dependency_ids']
+    pkginfo = package['pkginfo']
+    final_buildinfo = package['final_buildinfo']
+
+    # Build up the docker command arguments over time, translating fields as needed.
+    cmd = DockerCmd()
+    cmd.container = package['docker_name']
+
+    # Packages need directories inside the fake install root (otherwise docker
+    # will try making the directories on a readonly filesystem), so build the
+    # install root now, and make the package directories in it as we go.
+    install_dir = tempfile.mkdtemp(prefix="pkgpanda-")
+    active_packages = list()
+    for pkg_id_str in auto_deps:
+        # Mount the package into the docker container.
+        cmd.volumes[repository.package_path(pkg_id_str)] = "/opt/mesosphere/packages/{}:ro".format(pkg_id_str)
+        os.makedirs(os.path.join(install_dir, "packages/{}".format(pkg_id_str)))
+
     # If the package is already built, don't do anything.
     pkg_path = package_store.get_package_cache_folder(name) + '/{}.tar.xz'.format(pkg_id)
 
@@ -1216,7 +1502,7 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     # TODO(cmaloney): Move to an RAII wrapper.
     check_call(['rm', '-rf', install_dir])
 
-    with logger.scope("Build package tarball"):
+    with logger.scope("Build package tarball", flow_id=flow_id):
         # Check for forbidden services before packaging the tarball:
         try:
             check_forbidden_services(cache_abs("result"), RESERVED_UNIT_NAMES)
@@ -6,7 +6,12 @@ the necessary dependencies.
 
 Usage:
   mkpanda [--repository-url=<repository_url>] [--dont-clean-after-build] [--recursive] [--variant=<variant>]
-  mkpanda tree [--mkbootstrap] [--repository-url=<repository_url>] [--variant=<variant>]
+  mkpanda tree [--mkbootstrap] [--repository-url=<repository_url>] [--variant=<variant>] [--jobs=<jobs>]
+  mkpanda tree --plan=<report> [--repository-url=<repository_url>] [--variant=<variant>]
+
+Options:
+  --jobs=<jobs>      Number of packages to build at the same time [default: 1].
+  --plan=<report>    Don't build anything, write which packages would be built to the JSON file <report>.
 """
 
 import sys
@@ -17,6 +22,7 @@ from docopt import docopt
 
 import pkgpanda.build
 import pkgpanda.build.constants
+from pkgpanda.util import write_json
 
 
 def main():
@@ -30,10 +36,14 @@ def main():
         # Make a local repository for build dependencies
         if arguments['tree']:
             package_store = pkgpanda.build.PackageStore(getcwd(), arguments['--repository-url'])
+            if arguments['--plan']:
+                write_json(arguments['--plan'], pkgpanda.build.plan_tree(package_store, target_variant))
+                sys.exit(0)
+            jobs = int(arguments['--jobs'])
             if variant_arg is None:
-                pkgpanda.build.build_tree_variants(package_store, arguments['--mkbootstrap'])
+                pkgpanda.build.build_tree_variants(package_store, arguments['--mkbootstrap'], jobs)
             else:
-                pkgpanda.build.build_tree(package_store, arguments['--mkbootstrap'], target_variant)
+                pkgpanda.build.build_tree(package_store, arguments['--mkbootstrap'], target_variant, jobs)
             sys.exit(0)
 
         # Package name is the folder name.
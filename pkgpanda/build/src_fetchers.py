@@ -1,6 +1,9 @@
 import abc
+import fcntl
+import hashlib
 import os.path
 import shutil
+from contextlib import contextmanager
 from subprocess import CalledProcessError, check_call, check_output
 
 from pkgpanda.exceptions import ValidationError
@@ -17,6 +20,26 @@ def is_sha(sha_str):
         return False
 
 
+@contextmanager
+def cache_lock(path):
+    """Hold an exclusive lock on the shared cache entry at `path`.
+
+    The source cache is shared by all packages, which may be built at the same time, so
+    entries must only be created / updated while holding the lock.
+    """
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst to save space, copying if the two aren't on the same filesystem."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 def fetch_git(bare_folder, git_uri):
     # Do a git clone if the cache folder doesn't exist yet, otherwise
     # do a git pull of everything.
@@ -87,32 +110,35 @@ class GitSrcFetcher(SourceFetcher):
         self.url = src_info['git']
         self.ref = src_info['ref']
         self.ref_origin = src_info['ref_origin']
-        self.bare_folder = cache_dir + "/cache.git".format()
+        # One bare repository per remote, shared by every package which uses it.
+        self.bare_folder = '{}/git/{}.git'.format(cache_dir, hashlib.sha1(self.url.encode()).hexdigest())
 
     def get_id(self):
         return {"commit": self.ref}
 
     def checkout_to(self, directory):
-        # fetch into a bare repository so if we're on a host which has a cache we can
-        # only get the new commits.
-        fetch_git(self.bare_folder, self.url)
-
-        # Warn if the ref_origin is set and gives a different sha1 than the
-        # current ref.
-        try:
-            origin_commit = get_git_sha1(self.bare_folder, self.ref_origin)
-        except Exception as ex:
-            raise ValidationError("Unable to find sha1 of ref_origin {}: {}".format(self.ref_origin, ex))
-        if self.ref != origin_commit:
-            logger.warning(
-                "Current ref doesn't match the ref origin. "
-                "Package ref should probably be updated to pick up "
-                "new changes to the code:" +
-                " Current: {}, Origin: {}".format(self.ref,
-                                                  origin_commit))
-
-        # Clone into `src/`.
-        check_call(["git", "clone", "-q", self.bare_folder, directory])
+        os.makedirs(os.path.dirname(self.bare_folder), exist_ok=True)
+        with cache_lock(self.bare_folder):
+            # fetch into a bare repository so if we're on a host which has a cache we can
+            # only get the new commits.
+            fetch_git(self.bare_folder, self.url)
+
+            # Warn if the ref_origin is set and gives a different sha1 than the
+            # current ref.
+            try:
+                origin_commit = get_git_sha1(self.bare_folder, self.ref_origin)
+            except Exception as ex:
+                raise ValidationError("Unable to find sha1 of ref_origin {}: {}".format(self.ref_origin, ex))
+            if self.ref != origin_commit:
+                logger.warning(
+                    "Current ref doesn't match the ref origin. "
+                    "Package ref should probably be updated to pick up "
+                    "new changes to the code:" +
+                    " Current: {}, Origin: {}".format(self.ref,
+                                                      origin_commit))
+
+            # Clone into `src/`. A local clone hardlinks the objects of the bare repository.
+            check_call(["git", "clone", "-q", self.bare_folder, directory])
 
         # Checkout from the bare repo in the cache folder at the specific sha1
         check_call([
@@ -285,10 +311,11 @@ class UrlSrcFetcher(SourceFetcher):
 
         self.url = src_info['url']
         self.extract = (self.kind == 'url_extract')
-        self.cache_dir = cache_dir
-        self.cache_filename = self._get_filename(cache_dir)
         self.working_directory = working_directory
         self.sha = src_info['sha1']
+        # Downloads are stored by their sha1 so packages which use the same artifact share it.
+        self.cache_dir = cache_dir + '/url/' + self.sha
+        self.cache_filename = self._get_filename(self.cache_dir)
 
     def _get_filename(self, out_dir):
         assert '://' in self.url, "Scheme separator not found in url {}".format(self.url)
@@ -300,28 +327,29 @@ class UrlSrcFetcher(SourceFetcher):
         }
 
     def checkout_to(self, directory):
-        # Download file to cache if it isn't already there
-        if not os.path.exists(self.cache_filename):
-            print("Downloading source tarball {}".format(self.url))
-            download_atomic(self.cache_filename, self.url, self.working_directory)
-
-        # Validate the sha1 of the source is given and matches the sha1
-        file_sha = sha1(self.cache_filename)
-
-        if self.sha != file_sha:
-            corrupt_filename = self.cache_filename + '.corrupt'
-            check_call(['mv', self.cache_filename, corrupt_filename])
-            raise ValidationError(
-                "Provided sha1 didn't match sha1 of downloaded file, corrupt download saved as {}. "
-                "Provided: {}, Download file's sha1: {}, Url: {}".format(
-                    corrupt_filename, self.sha, file_sha, self.url))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with cache_lock(self.cache_dir):
+            # Download file to cache if it isn't already there
+            if not os.path.exists(self.cache_filename):
+                print("Downloading source tarball {}".format(self.url))
+                download_atomic(self.cache_filename, self.url, self.working_directory)
+
+            # Validate the sha1 of the source is given and matches the sha1
+            file_sha = sha1(self.cache_filename)
+
+            if self.sha != file_sha:
+                corrupt_filename = self.cache_filename + '.corrupt'
+                check_call(['mv', self.cache_filename, corrupt_filename])
+                raise ValidationError(
+                    "Provided sha1 didn't match sha1 of downloaded file, corrupt download saved as {}. "
+                    "Provided: {}, Download file's sha1: {}, Url: {}".format(
+                        corrupt_filename, self.sha, file_sha, self.url))
 
         if self.extract:
             extract_archive(self.cache_filename, directory)
         else:
-            # Copy the file(s) into src/
-            # TODO(cmaloney): Hardlink to save space?
-            shutil.copyfile(self.cache_filename, self._get_filename(directory))
+            # Link the file(s) into src/
+            link_or_copy(self.cache_filename, self._get_filename(directory))
 
 
 all_fetchers = {
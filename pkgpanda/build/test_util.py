@@ -1,4 +1,14 @@
+import json
+import os
+import time
+from functools import partial
+from subprocess import CalledProcessError, check_output
+
+import pytest
+import requests
+
 import pkgpanda.build
+import pkgpanda.util
 
 
 def test_hash_files_in_folder(tmpdir):
@@ -84,3 +94,195 @@ def test_hash_files_in_folder(tmpdir):
             'baz/bang/new': '15bc116ce980d703d62a16531b0ef5bb42fef91c',
             'baz/bang/swish/swipe': 'e855a8aca0e15c14144901428df7042798a622d6'
         }
+
+
+def test_file_hash_cache(tmpdir, monkeypatch):
+    cache_filename = str(tmpdir.join('hashes.json'))
+    folder = tmpdir.join('extra')
+    folder.join('foo').write('foo contents', ensure=True)
+    folder.join('bar').write('bar contents', ensure=True)
+    expected = {
+        'bar': '4acccb318abb44e0b8c4ba5e4e4a7fafa40243dd',
+        'foo': '8a44735524900cdc94460b8999b581836535470e'
+    }
+
+    # Files modified just now are never cached.
+    with tmpdir.as_cwd():
+        assert pkgpanda.build.hash_files_in_folder('extra', pkgpanda.build.FileHashCache(cache_filename)) == expected
+    assert not os.path.exists(cache_filename)
+
+    monkeypatch.setattr(pkgpanda.build.FileHashCache, 'racy_seconds', -60)
+    with tmpdir.as_cwd():
+        assert pkgpanda.build.hash_files_in_folder('extra', pkgpanda.build.FileHashCache(cache_filename)) == expected
+
+    # Unchanged files come from the cache rather than being read again.
+    hashed = []
+    real_sha1 = pkgpanda.util.sha1
+    monkeypatch.setattr(pkgpanda.util, 'sha1', lambda filename: hashed.append(filename) or real_sha1(filename))
+    folder.join('foo').write('new foo contents')
+    with tmpdir.as_cwd():
+        hashes = pkgpanda.build.hash_files_in_folder('extra', pkgpanda.build.FileHashCache(cache_filename))
+    assert hashes['bar'] == expected['bar']
+    assert hashes['foo'] == 'c43ecf47620fad8c82e626229823f461f5aff037'
+    assert hashed == [str(folder.join('foo'))]
+
+
+def _logged_build(log_path, name, variant):
+    with open(log_path, 'a') as f:
+        f.write('start {}\n'.format(name))
+    time.sleep(0.1)
+    with open(log_path, 'a') as f:
+        f.write('end {}\n'.format(name))
+    if name == 'broken':
+        raise pkgpanda.build.BuildError("broken can't be built")
+    return '{}.tar.xz'.format(pkgpanda.util.variant_prefix(variant) + name)
+
+
+def test_build_in_dependency_order(tmpdir):
+    requires = {
+        ('a', None): set(),
+        ('b', None): {('a', None)},
+        ('c', None): set(),
+        ('c', 'ee'): set(),
+        ('d', None): {('b', None), ('c', None)},
+    }
+    build_order = [('a', None), ('b', None), ('c', None), ('c', 'ee'), ('d', None)]
+    log_path = str(tmpdir.join('log'))
+
+    for jobs in [1, 3]:
+        tmpdir.join('log').write('')
+        results = pkgpanda.build.build_in_dependency_order(
+            build_order,
+            requires.__getitem__,
+            partial(_logged_build, log_path),
+            jobs)
+        assert results == {
+            ('a', None): 'a.tar.xz',
+            ('b', None): 'b.tar.xz',
+            ('c', None): 'c.tar.xz',
+            ('c', 'ee'): 'ee.c.tar.xz',
+            ('d', None): 'd.tar.xz',
+        }
+
+        log = tmpdir.join('log').read().splitlines()
+        # Every package starts after all of its requires ended.
+        for (name, _), reqs in requires.items():
+            for req_name, _ in reqs:
+                assert log.index('end ' + req_name) < log.index('start ' + name)
+        # Variants of one package never build at the same time.
+        c_events = [line for line in log if line.endswith(' c')]
+        assert c_events == ['start c', 'end c', 'start c', 'end c']
+
+
+def test_build_in_dependency_order_error(tmpdir):
+    requires = {
+        ('broken', None): set(),
+        ('a', None): set(),
+        ('b', None): {('broken', None)},
+    }
+    build_order = [('broken', None), ('a', None), ('b', None)]
+    log_path = str(tmpdir.join('log'))
+
+    with pytest.raises(pkgpanda.build.BuildError):
+        pkgpanda.build.build_in_dependency_order(build_order, requires.__getitem__, partial(_logged_build, log_path), 2)
+
+    # Packages which require a failed package are never built.
+    assert 'start b' not in tmpdir.join('log').read().splitlines()
+
+
+def test_url_src_fetcher_shared_cache(tmpdir):
+    tmpdir.join('artifact.txt').write('artifact contents')
+    src_info = {
+        'kind': 'url',
+        'url': 'file://artifact.txt',
+        'sha1': pkgpanda.util.sha1(str(tmpdir.join('artifact.txt')))
+    }
+    cache_dir = str(tmpdir.join('cache'))
+
+    # Two packages using the same artifact share one download.
+    for pkg in ['a', 'b']:
+        src_dir = tmpdir.join(pkg).ensure(dir=True)
+        fetcher = pkgpanda.build.get_src_fetcher(src_info, cache_dir, str(tmpdir))
+        fetcher.checkout_to(str(src_dir))
+        assert src_dir.join('artifact.txt').read() == 'artifact contents'
+
+    cached = tmpdir.join('cache/url/{}/artifact.txt'.format(src_info['sha1']))
+    assert os.stat(str(cached)).st_nlink == 3
+
+
+def test_plan_tree(tmpdir, monkeypatch):
+    tmpdir.join('treeinfo.json').write(json.dumps({'bootstrap_package_list': ['base', 'app']}))
+    tmpdir.join('base/buildinfo.json').write(json.dumps({'docker': 'ubuntu:14.04.4'}), ensure=True)
+    tmpdir.join('base/build').write('')
+    tmpdir.join('app/buildinfo.json').write(json.dumps({'docker': 'ubuntu:14.04.4', 'requires': ['base']}), ensure=True)
+    tmpdir.join('app/build').write('')
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+
+    def no_docker(docker_name):
+        raise CalledProcessError(1, ['docker', 'inspect', docker_name])
+
+    # Without the docker image the package ids can't be calculated.
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_id', no_docker)
+    plan = pkgpanda.build.plan_tree(package_store, None)['packages']
+    assert [(p['name'], p['status'], p['package_id']) for p in plan] == [
+        ('base', 'unknown', None),
+        ('app', 'unknown', None)]
+    assert 'ubuntu:14.04.4' in plan[0]['reason']
+
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_id', lambda docker_name: 'sha256:1234')
+    plan = pkgpanda.build.plan_tree(package_store, None)['packages']
+    assert [(p['name'], p['variant'], p['status']) for p in plan] == [
+        ('base', None, 'build'),
+        ('app', None, 'build')]
+
+    # A package in the cache doesn't need to be built, nor does the plan change its dependents.
+    base_id = pkgpanda.PackageId(plan[0]['package_id'])
+    tmpdir.join('cache/packages/base/{}.tar.xz'.format(base_id)).write('', ensure=True)
+    new_plan = pkgpanda.build.plan_tree(package_store, None)['packages']
+    assert [p['status'] for p in new_plan] == ['local', 'build']
+    assert [p['package_id'] for p in new_plan] == [p['package_id'] for p in plan]
+
+    # Packages available in the repository can be downloaded rather than built.
+    repository = tmpdir.join('repository')
+    app_id = pkgpanda.PackageId(plan[1]['package_id'])
+    repository.join('packages/app/{}.tar.xz'.format(app_id)).write('', ensure=True)
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), 'file://' + str(repository))
+    assert [p['status'] for p in pkgpanda.build.plan_tree(package_store, None)['packages']] == ['local', 'remote']
+
+
+def test_has_remote_package_unreachable(tmpdir, monkeypatch):
+    tmpdir.join('treeinfo.json').write(json.dumps({'bootstrap_package_list': []}))
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), 'https://repository.invalid')
+    timeouts = []
+
+    def unresponsive(url, **kwargs):
+        timeouts.append(kwargs.get('timeout'))
+        raise requests.exceptions.ConnectTimeout(url)
+
+    # A repository which doesn't answer is given up on, and the package treated as not being there.
+    monkeypatch.setattr(requests, 'head', unresponsive)
+    assert not package_store.has_remote_package(pkgpanda.PackageId('app--1234'))
+    assert timeouts == [pkgpanda.build.REMOTE_PACKAGE_CHECK_TIMEOUT]
+
+
+def test_make_bootstrap_tarball_layered(tmpdir):
+    resources_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../test_resources/packages')
+    pkg_ids = ['mesos--0.22.0', 'mesos-config--ffddcfb53168d42f92e4771c6f8a8a9a818fd6b8']
+    packages = list()
+    for pkg_id in pkg_ids:
+        pkg_path = str(tmpdir.join(pkg_id + '.tar.xz'))
+        pkgpanda.util.make_tar(pkg_path, os.path.join(resources_dir, pkg_id))
+        packages.append(pkg_path)
+
+    def make_bootstrap(name, layered):
+        package_store = pkgpanda.build.PackageStore(str(tmpdir.join(name).ensure(dir=True)), None)
+        bootstrap_id = pkgpanda.build.make_bootstrap_tarball(package_store, packages, None, layered)
+        bootstrap_path = '{}/{}.bootstrap.tar.xz'.format(package_store.get_bootstrap_cache_dir(), bootstrap_id)
+        return bootstrap_id, set(check_output(['tar', '-tf', bootstrap_path]).decode().splitlines())
+
+    assert make_bootstrap('layered', True) == make_bootstrap('extracted', False)
+
+    # Every package got its own layer, which is left in place for the next bootstrap.
+    layers_dir = tmpdir.join('layered/cache/bootstrap/layers')
+    assert set(os.listdir(str(layers_dir))) == set(pkg_ids)
+    assert [p for p in os.listdir(str(tmpdir.join('layered/cache/bootstrap'))) if 'tmp' in p] == []
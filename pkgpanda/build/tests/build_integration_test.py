@@ -90,7 +90,9 @@ def test_single_source_corrupt(tmpdir):
         package("resources-nonbootstrapable/single_source_corrupt", "single_source", tmpdir)
 
     # Check the corrupt file got moved to the right place
-    expect_fs(str(tmpdir.join("cache/packages/single_source/single_source")), ["foo.corrupt"])
+    expect_fs(
+        str(tmpdir.join("cache/src/url/da39a3ee5e6b4b0d3255bfef95601890afd80709")),
+        ["foo.corrupt"])
 
 
 def test_bootstrap(tmpdir):
@@ -115,3 +115,28 @@ def test_split_by_token():
     assert list(split_by_token('{', '}', 'some text {token} some more text', strip_token_decoration=True)) == [
         ('some text ', False), ('token', True), (' some more text', False)
     ]
+
+
+@pytest.mark.parametrize('compressor', ['auto', 'xz'] + pkgpanda.util.xz_programs)
+def test_make_and_extract_tar(tmpdir, compressor):
+    src = tmpdir.join('src')
+    src.join('foo').write('foo contents', ensure=True)
+    src.join('bar/baz').write('baz contents', ensure=True)
+
+    tarball = str(tmpdir.join('result.tar.xz'))
+    pkgpanda.util.make_tar(tarball, str(src), compressor)
+    assert pkgpanda.util.is_xz(tarball)
+
+    # Tarballs can be extracted no matter which program compressed them.
+    for extract_compressor in ['auto', 'xz']:
+        dst = tmpdir.join('dst-' + extract_compressor)
+        pkgpanda.util.extract_tarball(tarball, str(dst), extract_compressor)
+        assert dst.join('foo').read() == 'foo contents'
+        assert dst.join('bar/baz').read() == 'baz contents'
+
+
+def test_get_xz_program():
+    assert pkgpanda.util.get_xz_program('xz') is None
+    assert pkgpanda.util.get_xz_program('auto') in pkgpanda.util.xz_programs + [None]
+    with pytest.raises(ValueError):
+        pkgpanda.util.get_xz_program('gzip')
@@ -8,6 +8,7 @@ import shutil
 import socketserver
 import subprocess
 from contextlib import contextmanager, ExitStack
+from functools import lru_cache
 from itertools import chain
 from multiprocessing import Process
 from shutil import rmtree, which
@@ -120,9 +121,58 @@ def download_atomic(out_filename, url, work_dir):
         raise
 
 
-def extract_tarball(path, target):
+# Programs tar can run to (de)compress xz using multiple threads, in order of preference.
+xz_programs = ['pixz', 'pxz', 'xz -T0']
+
+
+@lru_cache()
+def xz_supports_threads():
+    try:
+        version = subprocess.check_output(['xz', '--version']).decode()
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    match = re.search(r'(\d+)\.(\d+)', version)
+    return match is not None and (int(match.group(1)), int(match.group(2))) >= (5, 2)
+
+
+def get_xz_program(compressor='auto'):
+    """Return the program tar should use for xz, None to use tar's builtin (single threaded) xz.
+
+    compressor is one of:
+     - 'auto': the first of xz_programs which is available.
+     - 'xz': tar's builtin xz.
+     - one of xz_programs: that program if it is available, otherwise tar's builtin xz.
+    """
+    if compressor == 'xz':
+        return None
+    if compressor == 'auto':
+        candidates = xz_programs
+    elif compressor in xz_programs:
+        candidates = [compressor]
+    else:
+        raise ValueError("Unknown compressor {}. Must be one of: {}".format(
+            compressor, ['auto', 'xz'] + xz_programs))
+
+    for program in candidates:
+        executable = program.split()[0]
+        if not which(executable):
+            continue
+        if executable == 'xz' and not xz_supports_threads():
+            continue
+        return program
+    return None
+
+
+def is_xz(path):
+    with open(path, 'rb') as f:
+        return f.read(6) == b'\xfd7zXZ\x00'
+
+
+def extract_tarball(path, target, compressor='auto'):
     """Extract the tarball into target.
 
+    If the tarball is xz compressed it is decompressed using `compressor` (See get_xz_program).
+
     If there are any errors, delete the folder being extracted to.
     """
     # TODO(cmaloney): Validate extraction will pass before unpacking as much as possible.
@@ -131,7 +181,11 @@ def extract_tarball(path, target):
     try:
         assert os.path.exists(path), "Path doesn't exist but should: {}".format(path)
         check_call(['mkdir', '-p', target])
-        check_call(['tar', '-xf', path, '-C', target])
+        tar_cmd = ['tar']
+        xz_program = get_xz_program(compressor) if is_xz(path) else None
+        if xz_program:
+            tar_cmd += ['--use-compress-program=' + xz_program]
+        check_call(tar_cmd + ['-xf', path, '-C', target])
     except:
         # If there are errors, we can't really cope since we are already in an error state.
         rmtree(target, ignore_errors=True)
@@ -199,7 +253,7 @@ def sha1(filename):
 
     with open(filename, 'rb') as fh:
         while 1:
-            buf = fh.read(4096)
+            buf = fh.read(2 ** 20)
             if not buf:
                 break
             hasher.update(buf)
@@ -225,10 +279,12 @@ def expect_fs(folder, contents):
         raise ValueError("Invalid type {0} passed to expect_fs".format(type(contents)))
 
 
-def make_tar(result_filename, change_folder):
+def make_tar(result_filename, change_folder, compressor='auto'):
+    """Make an xz compressed tarball of change_folder, compressing using `compressor` (See get_xz_program)."""
     tar_cmd = ["tar", "--numeric-owner", "--owner=0", "--group=0"]
-    if which("pxz"):
-        tar_cmd += ["--use-compress-program=pxz", "-cf"]
+    xz_program = get_xz_program(compressor)
+    if xz_program:
+        tar_cmd += ["--use-compress-program=" + xz_program, "-cf"]
     else:
         tar_cmd += ["-cJf"]
     tar_cmd += [result_filename, "-C", change_folder, "."]
@@ -7,6 +7,7 @@ Co-ordinates across all gen.build_deploy
 """
 
 import argparse
+import concurrent.futures
 import copy
 import importlib
 import inspect
@@ -386,7 +387,41 @@ def built_resource_to_artifacts(built_resource: dict):
 #       'content': '',
 #       'content_file': '',
 #       }]}}
-def make_channel_artifacts(metadata):
+def _make_provider_artifacts(unit):
+    """Run one (provider, variant) unit of make_channel_artifacts().
+
+    Module level so it can be sent to worker processes. Returns the list of artifacts built.
+    """
+    name, kind, kwargs = unit
+    module = load_providers()[name]
+    if kind == 'variant':
+        variant = kwargs['variant']
+        scope_name = "Creating {} deploy tools for variant {}".format(
+            module.__name__, pkgpanda.util.variant_name(variant))
+        flow_id = '{}-variant-{}'.format(name, pkgpanda.util.variant_str(variant))
+        built_resources = module.do_create_variant(**kwargs)
+    else:
+        assert kind == 'shared'
+        scope_name = "Creating {} deploy tools shared by all variants".format(module.__name__)
+        flow_id = '{}-shared'.format(name)
+        built_resources = module.do_create_shared(**kwargs)
+
+    artifacts = list()
+    with logger.scope(scope_name, flow_id=flow_id):
+        for built_resource in built_resources:
+            assert isinstance(built_resource, dict), built_resource
+            artifacts += built_resource_to_artifacts(built_resource)
+
+    return artifacts
+
+
+def make_channel_artifacts(metadata, jobs=1):
+    """Generate the artifacts of every provider for every variant.
+
+    Each provider's per-variant artifacts and its artifacts shared across variants are separate
+    units of work. With `jobs` greater than one the units are run in that many worker processes.
+    Artifacts are always returned in the same order, regardless of the number of jobs.
+    """
     artifacts = []
 
     # Set logging to debug so we get gen error messages, since those are
@@ -400,6 +435,7 @@ def make_channel_artifacts(metadata):
 
     provider_data = {}
     providers = load_providers()
+    units = list()
     for name, module in sorted(providers.items()):
         bootstrap_url = metadata['repository_url']
 
@@ -424,41 +460,44 @@ def make_channel_artifacts(metadata):
                 mod = importlib.machinery.SourceFileLoader('gen_extra.calc', 'gen_extra/calc.py').load_module()
                 variant_arguments[variant].update(mod.provider_template_defaults)
 
-        # Add templates for the default variant.
+        # TODO(cmaloney): Cleanup by just having this make and pass another source.
+        module_specific_variant_arguments = copy.deepcopy(variant_arguments)
+        for arg_dict in module_specific_variant_arguments.values():
+            if module.__name__ == 'gen.build_deploy.aws':
+                arg_dict['cloudformation_s3_url_full'] = metadata['cloudformation_s3_url_full']
+            elif module.__name__ == 'gen.build_deploy.azure':
+                arg_dict['azure_download_url'] = metadata['azure_download_url']
+            elif module.__name__ == 'gen.build_deploy.bash':
+                pass
+            else:
+                raise NotImplementedError("Unknown how to add args to deploy tool: {}".format(module.__name__))
+
         # Use keyword args to make not matching ordering a loud error around changes.
-        with logger.scope("Creating {} deploy tools".format(module.__name__)):
-            # TODO(cmaloney): Cleanup by just having this make and pass another source.
-            module_specific_variant_arguments = copy.deepcopy(variant_arguments)
-            for arg_dict in module_specific_variant_arguments.values():
-                if module.__name__ == 'gen.build_deploy.aws':
-                    arg_dict['cloudformation_s3_url_full'] = metadata['cloudformation_s3_url_full']
-                elif module.__name__ == 'gen.build_deploy.azure':
-                    arg_dict['azure_download_url'] = metadata['azure_download_url']
-                elif module.__name__ == 'gen.build_deploy.bash':
-                    pass
-                else:
-                    raise NotImplementedError("Unknown how to add args to deploy tool: {}".format(module.__name__))
-
-            for built_resource in module.do_create(
-                    tag=metadata['tag'],
-                    build_name=metadata['build_name'],
-                    reproducible_artifact_path=metadata['reproducible_artifact_path'],
-                    commit=metadata['commit'],
-                    variant_arguments=module_specific_variant_arguments,
-                    all_completes=metadata['all_completes']):
-
-                assert isinstance(built_resource, dict), built_resource
-
-                # Type switch
-                if 'packages' in built_resource:
-                    for package in built_resource['packages']:
-                        artifacts.append(get_gen_package_artifact(package))
-                else:
-                    assert 'packages' not in built_resource
-                    artifacts.append(built_resource)
+        common_kwargs = {
+            'tag': metadata['tag'],
+            'build_name': metadata['build_name'],
+            'reproducible_artifact_path': metadata['reproducible_artifact_path'],
+            'commit': metadata['commit'],
+            'all_completes': metadata['all_completes']}
+
+        # Variants are sorted for stable ordering.
+        for variant in sorted(module_specific_variant_arguments.keys(), key=pkgpanda.util.variant_str):
+            kwargs = dict(common_kwargs, variant=variant, arguments=module_specific_variant_arguments[variant])
+            units.append((name, 'variant', kwargs))
+        units.append((name, 'shared', dict(common_kwargs, variant_arguments=module_specific_variant_arguments)))
+
+    if jobs > 1:
+        # map() returns results in the order of the units, so the artifact list is deterministic.
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            unit_artifacts = list(executor.map(_make_provider_artifacts, units))
+    else:
+        unit_artifacts = [_make_provider_artifacts(unit) for unit in units]
+
+    for unit_artifact_list in unit_artifacts:
+        artifacts += unit_artifact_list
 
-            # TODO(cmaloney): Check the provider artifacts adhere to the artifact template.
-            artifacts += provider_data.get('artifacts', list())
+    # TODO(cmaloney): Check the provider artifacts adhere to the artifact template.
+    artifacts += provider_data.get('artifacts', list())
 
     log.setLevel(original_log_level)
 
@@ -716,9 +755,10 @@ class ReleaseManager():
 
             self.__storage_providers[name] = storage
 
-    def __init__(self, config, noop):
+    def __init__(self, config, noop, jobs=1):
         self._setup_storage(config.get('storage', dict()))
         self.__noop = noop
+        self.__jobs = jobs
         self.__config = config
 
         preferred_name = config.get('options', dict()).get('preferred')
@@ -781,7 +821,7 @@ class ReleaseManager():
         assert 'tag' in metadata
         del metadata['channel_artifacts']
 
-        metadata['channel_artifacts'] = make_channel_artifacts(metadata)
+        metadata['channel_artifacts'] = make_channel_artifacts(metadata, self.__jobs)
 
         storage_commands = repository.make_commands(metadata)
         self.apply_storage_commands(storage_commands)
@@ -793,7 +833,7 @@ class ReleaseManager():
         metadata = self.get_metadata(src_channel)
         self.fetch_key_artifacts(metadata)
         del metadata['channel_artifacts']
-        make_channel_artifacts(metadata)
+        make_channel_artifacts(metadata, self.__jobs)
 
         return metadata
 
@@ -829,7 +869,7 @@ class ReleaseManager():
         metadata['tag'] = tag
         assert 'channel_artifacts' not in metadata
 
-        metadata['channel_artifacts'] = make_channel_artifacts(metadata)
+        metadata['channel_artifacts'] = make_channel_artifacts(metadata, self.__jobs)
 
         storage_commands = repository.make_commands(metadata)
         self.apply_storage_commands(storage_commands)
@@ -865,6 +905,13 @@ def main():
         help="YAML configuration file",
         default="dcos-release.config.yaml")
 
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help="Number of worker processes to generate provider artifacts (templates, installers) with.")
+
     # Moves the latest of a given release name to the given release name.
     promote = subparsers.add_parser('promote')
     promote.set_defaults(action='promote')
@@ -911,7 +958,7 @@ def main():
         print("ERROR: Failed to open release configuration file '{}': {}".format(options.config, ex))
         sys.exit(1)
 
-    release_manager = ReleaseManager(config, options.noop)
+    release_manager = ReleaseManager(config, options.noop, options.jobs)
     if options.action == 'promote':
         release_manager.promote(options.source_channel, options.destination_repository, options.destination_channel)
     elif options.action == 'create':
@@ -596,7 +596,7 @@ def mock_make_tar(result_filename, folder):
 
 # Test that the do_create functions for each provider output data in the right
 # shape.
-def test_make_channel_artifacts(monkeypatch):
+def test_make_channel_artifacts(monkeypatch, tmpdir):
     logging.basicConfig(level=logging.DEBUG)
     monkeypatch.setattr('gen.build_deploy.bash.make_installer_docker', mock_make_installer_docker)
     monkeypatch.setattr('gen.build_deploy.bash.fetch_dcos_launch_bin', lambda v, l_i: 'dcos-launch')
@@ -655,13 +655,18 @@ def test_make_channel_artifacts(monkeypatch):
         'azure_download_url': 'https://azure.example.com'
     }
 
-    channel_artifacts = release.make_channel_artifacts(metadata)
+    with tmpdir.mkdir('serial').as_cwd():
+        channel_artifacts = release.make_channel_artifacts(metadata)
 
     # Validate the artifacts are vaguely useful
     for artifact in channel_artifacts:
         assert 'local_path' in artifact or 'local_content' in artifact
         assert 'reproducible_path' in artifact or 'channel_path' in artifact
 
+    # Generating in worker processes gives exactly the same artifacts in the same order.
+    with tmpdir.mkdir('parallel').as_cwd():
+        assert release.make_channel_artifacts(metadata, jobs=3) == channel_artifacts
+
 
 def test_make_abs():
     assert release.make_abs("/foo") == '/foo'
@@ -1,11 +1,18 @@
 import asyncio
+import collections
 import copy
 import logging
 import os
 import pty
+import shutil
+import tempfile
+import time
+import uuid
 from contextlib import contextmanager
 
+import pkgpanda.util
 import ssh.validate
+from ssh.scheduler import Scheduler
 from ssh.utils import CommandChain, JsonDelegate
 
 log = logging.getLogger(__name__)
@@ -56,9 +63,62 @@ def add_host(target, default_port):
     return Node(target, default_port=default_port)
 
 
+class FanOut():
+    """State of distributing one local file into a remote directory on all the hosts.
+
+    sources holds the hosts which currently have the file and are idle, and local_copies None tokens
+    standing for the local machine. A copy takes a source, so every host serves one copy at a time and the
+    local machine local_copies of them, and gives it back when done.
+    """
+    def __init__(self, local_path, local_copies):
+        self.local_path = local_path
+        self.sources = asyncio.Queue()
+        for _ in range(local_copies):
+            self.sources.put_nowait(None)
+        # Checksum the local file in the background while the first copies are running.
+        self.sha1 = asyncio.get_event_loop().run_in_executor(None, pkgpanda.util.sha1, local_path)
+
+
+class OutputBuffer():
+    """The last max_lines lines a process wrote to a stream, as they are read.
+
+    A line for which is_segment_start returns True is always kept, and starts a new segment with its own
+    max_lines, so the markers between the commands of a batch and each command's last lines survive.
+    """
+    def __init__(self, max_lines, is_segment_start=None):
+        self.max_lines = max_lines
+        self.is_segment_start = is_segment_start
+        # [first line, number of lines dropped, last lines]
+        self.segments = [[None, 0, collections.deque(maxlen=max_lines)]]
+        # The last line, until its newline is read.
+        self.partial = b''
+
+    def extend(self, lines):
+        for line in lines:
+            if self.is_segment_start is not None and self.is_segment_start(line):
+                self.segments.append([line, 0, collections.deque(maxlen=self.max_lines)])
+                continue
+            segment = self.segments[-1]
+            if len(segment[2]) == self.max_lines:
+                segment[1] += 1
+            segment[2].append(line)
+
+    def getvalue(self):
+        lines = []
+        for first, dropped, last_lines in self.segments:
+            if first is not None:
+                lines.append(first)
+            if dropped:
+                lines.append('[{} lines of output not kept]'.format(dropped))
+            lines.extend(last_lines)
+        lines.append(self.partial.decode(errors='replace'))
+        return '\n'.join(lines).encode()
+
+
 class MultiRunner():
     def __init__(self, targets: list, async_delegate=None, user=None, key_path=None, extra_opts='',
-                 process_timeout=120, parallelism=10, default_port=22):
+                 process_timeout=120, parallelism=10, default_port=22, connection_reuse=False,
+                 batch_commands=False, max_parallelism=None, stream_output=False, max_output_lines=1000):
         # TODO(cmaloney): accept an "ssh_config" object which generates an ssh
         # config file, then add a '-F' to that temporary config file rather than
         # manually building up / adding the arguments in _get_base_args which is
@@ -70,11 +130,42 @@ class MultiRunner():
         self.key_path = key_path
         self.ssh_bin = '/usr/bin/ssh'
         self.scp_bin = '/usr/bin/scp'
+        # Used to serve distributed files from one host to another, see distribute_async.
+        self.ssh_agent_bin = '/usr/bin/ssh-agent'
+        self.ssh_add_bin = '/usr/bin/ssh-add'
+        self.peer_scp_bin = 'scp'
+        # Hosts may not be able to reach each other, e.g. across a firewall, so give up on a peer quickly.
+        self.peer_connect_timeout = 10
+        # How many copies of a distributed file are sent from the local machine at once, the others come from
+        # hosts which already have it.
+        self.local_copies = 2
         self.async_delegate = async_delegate
         self.__targets = []
         for target in targets:
             self.__targets.append(add_host(target, default_port))
         self.__parallelism = parallelism
+        # If max_parallelism is larger than parallelism, the number of hosts worked on at once adapts between the
+        # two, see Scheduler.
+        self.__max_parallelism = max_parallelism
+
+        # If connection_reuse is set, all the commands run on a host while its chains are dispatched share
+        # one authenticated SSH connection (ControlMaster). Maps Node -> path of the control socket.
+        self.connection_reuse = connection_reuse
+        self.__control_paths = {}
+
+        # If batch_commands is set, consecutive execute commands of a chain are run on a host as one remote script.
+        self.batch_commands = batch_commands
+
+        # If stream_output is set, output is read line by line as the commands run. Lines are handed to the
+        # async_delegate's on_output as they arrive, and only the last max_output_lines of each stream of a
+        # command are kept for its result.
+        self.stream_output = stream_output
+        self.max_output_lines = max_output_lines
+
+        # Maps (local_path, remote_dir) -> FanOut for the distribute commands of the running chains.
+        self.__fan_outs = {}
+        self.__agent = None
+        self.__agent_sock = None
 
     def _get_base_args(self, bin_name, host):
         # TODO(cmaloney): Switch to SSH config file, documented above. A single
@@ -96,27 +187,151 @@ class MultiRunner():
             '-oPasswordAuthentication=no',
             '{}{}'.format(port_option, host.port),
             '-i', self.key_path]
+        if host in self.__control_paths:
+            # Use the host's master connection if it is up, otherwise connect directly.
+            shared_opts += ['-oControlMaster=no', '-oControlPath={}'.format(self.__control_paths[host])]
         shared_opts.extend(add_opts)
         return shared_opts
 
     @asyncio.coroutine
-    def run_cmd_return_dict_async(self, cmd, host, namespace, future, stage):
+    def _run_control_cmd(self, host, control_args):
+        # The master connection goes to the background, so don't give it pipes which would be kept open.
+        cmd = [arg for arg in self._get_base_args(self.ssh_bin, host) if arg not in ['-tt', '-oControlMaster=no']]
+        cmd += control_args + ['{}@{}'.format(self.user, host.ip)]
+        log.debug('running ssh control command {}'.format(cmd))
+        process = yield from asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL)
+        try:
+            return (yield from asyncio.wait_for(process.wait(), self.process_timeout))
+        except asyncio.TimeoutError:
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass
+            return None
+
+    @asyncio.coroutine
+    def open_connection(self, host):
+        """Start a master connection to host which later ssh / scp commands to it are multiplexed over."""
+        control_dir = tempfile.mkdtemp(prefix='dcos-ssh-')
+        self.__control_paths[host] = os.path.join(control_dir, 'control')
+        returncode = yield from self._run_control_cmd(host, ['-fnNM'])
+        if returncode != 0:
+            log.warning('Unable to open a shared SSH connection to {}, every command will connect separately. '
+                        'Exit code: {}'.format(host, returncode))
+
+    @asyncio.coroutine
+    def close_connection(self, host):
+        """Stop the master connection to host, if there is one."""
+        control_path = self.__control_paths.get(host)
+        if control_path is None:
+            return
+        if os.path.exists(control_path):
+            yield from self._run_control_cmd(host, ['-Oexit'])
+        del self.__control_paths[host]
+        shutil.rmtree(os.path.dirname(control_path), ignore_errors=True)
+
+    @asyncio.coroutine
+    def start_agent(self):
+        """Start an ssh-agent holding key_path, which hosts use through agent forwarding to copy to each other.
+
+        If the agent can't be started distributed files are all copied from the local machine.
+        """
+        agent_dir = tempfile.mkdtemp(prefix='dcos-ssh-agent-')
+        sock = os.path.join(agent_dir, 'agent')
+        try:
+            self.__agent = yield from asyncio.create_subprocess_exec(
+                self.ssh_agent_bin, '-D', '-a', sock, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            for _ in range(50):
+                if os.path.exists(sock):
+                    break
+                yield from asyncio.sleep(0.1)
+            add = yield from asyncio.create_subprocess_exec(
+                self.ssh_add_bin, self.key_path, env={'SSH_AUTH_SOCK': sock}, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            returncode = yield from asyncio.wait_for(add.wait(), self.process_timeout)
+        except (OSError, asyncio.TimeoutError) as ex:
+            returncode = str(ex)
+        self.__agent_sock = sock
+        if returncode != 0:
+            log.warning('Unable to start an ssh-agent, files will only be copied from this machine: {}'.format(
+                returncode))
+            yield from self.stop_agent()
+
+    @asyncio.coroutine
+    def stop_agent(self):
+        if self.__agent is not None and self.__agent.returncode is None:
+            self.__agent.terminate()
+            yield from self.__agent.wait()
+        if self.__agent_sock is not None:
+            shutil.rmtree(os.path.dirname(self.__agent_sock), ignore_errors=True)
+        self.__agent = None
+        self.__agent_sock = None
+
+    @asyncio.coroutine
+    def _run_process_async(self, cmd, timeout, env=None, on_output=None, is_segment_start=None):
+        """Run cmd, returning the process and its stdout and stderr.
+
+        If the process doesn't finish within timeout seconds it is terminated, returncode is left
+        as None and whatever it output up until then is returned.
+
+        With stream_output, on_output(stream_name, lines) is called with each batch of lines read, and
+        only the end of the output is returned, see OutputBuffer.
+        """
+        if env is None:
+            env = {'TERM': 'linux'}
+        if self.stream_output:
+            stdout = OutputBuffer(self.max_output_lines, is_segment_start)
+            stderr = OutputBuffer(self.max_output_lines)
+        else:
+            stdout = bytearray()
+            stderr = bytearray()
+
+        def filter_lines(lines):
+            return [line for line in lines if not line.lstrip('\r').startswith('Warning: Permanently added')]
+
+        @asyncio.coroutine
+        def read(stream, output, name):
+            while True:
+                chunk = yield from stream.read(4096)
+                if not chunk:
+                    break
+                if not self.stream_output:
+                    output.extend(chunk)
+                    continue
+                lines = (output.partial + chunk).split(b'\n')
+                output.partial = lines.pop()
+                lines = [line.decode(errors='replace') for line in lines]
+                if name == 'stderr':
+                    lines = filter_lines(lines)
+                output.extend(lines)
+                if on_output is not None and lines:
+                    on_output(name, lines)
+            if self.stream_output and on_output is not None and output.partial:
+                on_output(name, [output.partial.decode(errors='replace')])
+
         with make_slave_pty() as slave_pty:
             process = yield from asyncio.create_subprocess_exec(
                 *cmd, stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 stdin=slave_pty,
-                env={'TERM': 'linux'})
-            stdout = b''
-            stderr = b''
+                env=env)
             try:
-                stdout, stderr = yield from asyncio.wait_for(process.communicate(), self.process_timeout)
+                yield from asyncio.wait_for(
+                    asyncio.gather(read(process.stdout, stdout, 'stdout'), read(process.stderr, stderr, 'stderr'),
+                                   process.wait()),
+                    timeout)
             except asyncio.TimeoutError:
                 try:
                     process.terminate()
                 except ProcessLookupError:
                     log.info('process with pid {} not found'.format(process.pid))
-                log.error('timeout of {} sec reached. PID {} killed'.format(self.process_timeout, process.pid))
+                log.error('timeout of {} sec reached. PID {} killed'.format(timeout, process.pid))
+
+        if self.stream_output:
+            return process, stdout.getvalue(), stderr.getvalue()
 
         # For each possible line in stderr, match from the beginning of the line for the
         # the confusing warning: "Warning: Permanently added ...". If the warning exists,
@@ -125,6 +340,17 @@ class MultiRunner():
         stderr = bytes('\n'.join([line for line in err_arry if not line.startswith(
             'Warning: Permanently added')]), 'utf-8')
 
+        return process, bytes(stdout), stderr
+
+    @asyncio.coroutine
+    def run_cmd_return_dict_async(self, cmd, host, namespace, future, stage, timeout=None):
+        def on_output(stream_name, lines):
+            if self.async_delegate is not None:
+                self.async_delegate.on_output(namespace, host, stage, stream_name, lines)
+
+        process, stdout, stderr = yield from self._run_process_async(
+            cmd, timeout or self.process_timeout, on_output=on_output)
+
         process_output = {
             '{}:{}'.format(host.ip, host.port): {
                 "cmd": cmd,
@@ -141,9 +367,9 @@ class MultiRunner():
 
     @asyncio.coroutine
     def run_async(self, host, command, namespace, future, stage):
-        # command consists of (command_flag, command, rollback, stage)
-        # we will ignore all but command for now
-        _, cmd, _, _ = command
+        # command consists of (command_flag, command, rollback, timeout, stage)
+        # we will ignore rollback and stage for now
+        _, cmd, _, timeout, _ = command
 
         # we may lazy evaluate a command based on Node() class
         if callable(cmd):
@@ -151,14 +377,112 @@ class MultiRunner():
 
         full_cmd = self._get_base_args(self.ssh_bin, host) + ['{}@{}'.format(self.user, host.ip)] + cmd
         log.debug('executing command {}'.format(full_cmd))
-        result = yield from self.run_cmd_return_dict_async(full_cmd, host, namespace, future, stage)
+        result = yield from self.run_cmd_return_dict_async(full_cmd, host, namespace, future, stage, timeout)
         return result
 
+    @asyncio.coroutine
+    def run_batch_async(self, host, commands, namespace, futures, stages):
+        """Run several execute commands on host as a single remote script.
+
+        The script stops at the first command which fails, like a chain does. Markers around each
+        command's output split it back up into the same process_output the commands would have had
+        if they were run one at a time, with one future per command being set. The ssh process' own
+        stderr is attributed to the last command which ran. Returns the process_outputs of the
+        commands which ran.
+        """
+        cmds = []
+        timeout = 0
+        for _, cmd, _, cmd_timeout, _ in commands:
+            # we may lazy evaluate a command based on Node() class
+            cmds.append(cmd(host) if callable(cmd) else cmd)
+            timeout += cmd_timeout or self.process_timeout
+
+        token = uuid.uuid4().hex
+        script = []
+        for index, cmd in enumerate(cmds):
+            script += [
+                "echo '{} start {}'".format(token, index),
+                '(',
+                ' '.join(cmd),
+                ')',
+                'rc=$?',
+                "echo '{} end {}' $rc".format(token, index),
+                'if [ $rc -ne 0 ]; then exit $rc; fi']
+        target = '{}@{}'.format(self.user, host.ip)
+        full_cmd = self._get_base_args(self.ssh_bin, host) + [target, '\n'.join(script)]
+        log.debug('executing batch of {} commands {}'.format(len(cmds), full_cmd))
+
+        def split_marker(line):
+            # An end marker follows the command's last line directly if that has no newline.
+            index = line.find(token)
+            if index == -1:
+                return line, None
+            return line[:index], line[index:].rstrip('\r').split(' ')
+
+        # Hand output to the delegate as the output of the command which started last.
+        running = [0]
+
+        def on_output(stream_name, lines):
+            output_lines = []
+            for line in lines:
+                text, marker = split_marker(line)
+                if marker is None:
+                    output_lines.append(line)
+                    continue
+                if text:
+                    output_lines.append(text)
+                if self.async_delegate is not None and output_lines:
+                    self.async_delegate.on_output(namespace, host, stages[running[0]], stream_name, output_lines)
+                output_lines = []
+                if marker[1] == 'start':
+                    running[0] = int(marker[2])
+            if self.async_delegate is not None and output_lines:
+                self.async_delegate.on_output(namespace, host, stages[running[0]], stream_name, output_lines)
+
+        process, stdout, stderr = yield from self._run_process_async(
+            full_cmd, timeout, on_output=on_output, is_segment_start=lambda line: token in line)
+
+        # Split the output up by the markers, collecting (stdout lines, returncode) per command which ran.
+        # Like the output of a command run by itself, the last line is the one without a newline, which is
+        # empty if the command didn't get to its end marker.
+        outputs = []
+        for line in stdout.decode().split('\n'):
+            text, marker = split_marker(line)
+            if marker is None:
+                if outputs and outputs[-1][1] is None:
+                    outputs[-1][0].append(line)
+            elif marker[1] == 'start':
+                outputs.append(([], None))
+            elif outputs:
+                outputs[-1] = (outputs[-1][0] + [text], int(marker[3]))
+        if outputs and outputs[-1][1] is None:
+            outputs[-1] = (outputs[-1][0] + [''], process.returncode)
+        if not outputs:
+            # The script never started, e.g. ssh couldn't connect.
+            outputs.append((stdout.decode().split('\n'), process.returncode))
+
+        results = []
+        for index, (stdout_lines, returncode) in enumerate(outputs):
+            last = index == len(outputs) - 1
+            process_output = {
+                '{}:{}'.format(host.ip, host.port): {
+                    "cmd": self._get_base_args(self.ssh_bin, host) + [target] + cmds[index],
+                    "stdout": stdout_lines,
+                    "stderr": stderr.decode().split('\n') if last else [''],
+                    "returncode": returncode,
+                    "pid": process.pid,
+                    "stage": stages[index]
+                }
+            }
+            futures[index].set_result((namespace, process_output, host))
+            results.append(process_output)
+        return results
+
     @asyncio.coroutine
     def copy_async(self, host, command, namespace, future, stage):
         # command[0] is command_flag, command[-1] is stage
         # we will ignore them here.
-        _, local_path, remote_path, remote_to_local, recursive, _ = command
+        _, local_path, remote_path, remote_to_local, recursive, timeout, _ = command
         copy_command = []
         if recursive:
             copy_command += ['-r']
@@ -169,10 +493,113 @@ class MultiRunner():
             copy_command += [local_path, remote_full_path]
         full_cmd = self._get_base_args(self.scp_bin, host) + copy_command
         log.debug('copy with command {}'.format(full_cmd))
-        result = yield from self.run_cmd_return_dict_async(full_cmd, host, namespace, future, stage)
+        result = yield from self.run_cmd_return_dict_async(full_cmd, host, namespace, future, stage, timeout)
         return result
 
-    def _run_chain_command(self, chain: CommandChain, host, chain_result):
+    @asyncio.coroutine
+    def distribute_async(self, host, command, namespace, future, stage):
+        """Copy a local file to host, from a host which already has it when possible, and verify its checksum.
+
+        Every host which received the file intact becomes a source for the following hosts, so the
+        number of copies in flight grows with each round instead of all of them going out over the
+        local machine's uplink. A copy from another host runs scp on that host with the agent
+        forwarded. If it fails the copy is retried from the next source, and the host which failed
+        to serve it isn't used as a source again.
+
+        Forwarding the agent lets the source host use the installer's key, and so reach every other
+        host, while the copy is running. Root on a source host can use that, so only distribute to
+        hosts which trust each other.
+
+        Without an agent, e.g. when it couldn't be started, this is a plain copy_async.
+        """
+        # command[0] is command_flag, command[-1] is stage
+        # we will ignore them here.
+        _, local_path, remote_dir, timeout, _ = command
+        if self.__agent_sock is None:
+            result = yield from self.copy_async(
+                host, (CommandChain.copy_flag, local_path, remote_dir, False, False, timeout, stage),
+                namespace, future, stage)
+            return result
+
+        timeout = timeout or self.process_timeout
+        key = (local_path, remote_dir)
+        if key not in self.__fan_outs:
+            self.__fan_outs[key] = FanOut(local_path, self.local_copies)
+        fan_out = self.__fan_outs[key]
+        remote_file = os.path.join(remote_dir, os.path.basename(local_path))
+        remote_full_path = '{}@{}:{}'.format(self.user, host.ip, remote_dir)
+
+        while True:
+            source = yield from fan_out.sources.get()
+            # The source is given back for the following hosts, unless it failed to serve the copy, as they
+            # would most likely fail to get it from there too. The local machine is always given back.
+            give_back = True
+            try:
+                if source is None:
+                    full_cmd = self._get_base_args(self.scp_bin, host) + [local_path, remote_full_path]
+                    log.debug('copy with command {}'.format(full_cmd))
+                    process, stdout, stderr = yield from self._run_process_async(full_cmd, timeout)
+                    break
+                full_cmd = self._get_base_args(self.ssh_bin, source) + [
+                    '-A', '{}@{}'.format(self.user, source.ip), self.peer_scp_bin,
+                    '-oConnectTimeout={}'.format(self.peer_connect_timeout), '-oStrictHostKeyChecking=no',
+                    '-oUserKnownHostsFile=/dev/null', '-oBatchMode=yes', '-oPasswordAuthentication=no',
+                    '-P{}'.format(host.port), remote_file, remote_full_path]
+                log.debug('copy from {} with command {}'.format(source, full_cmd))
+                process, stdout, stderr = yield from self._run_process_async(
+                    full_cmd, timeout, {'TERM': 'linux', 'SSH_AUTH_SOCK': self.__agent_sock})
+                if process.returncode == 0:
+                    break
+                log.warning('Copying {} from {} to {} failed, copying it from another source'.format(
+                    remote_file, source, host))
+                give_back = False
+            finally:
+                if give_back:
+                    fan_out.sources.put_nowait(source)
+
+        returncode = process.returncode
+        if returncode == 0:
+            sha1 = yield from fan_out.sha1
+            verify_cmd = self._get_base_args(self.ssh_bin, host) + [
+                '{}@{}'.format(self.user, host.ip), 'sha1sum', remote_file]
+            verify, verify_stdout, verify_stderr = yield from self._run_process_async(
+                verify_cmd, self.process_timeout)
+            stdout += verify_stdout
+            stderr += verify_stderr
+            returncode = verify.returncode
+            if returncode == 0 and verify_stdout.decode().split(' ')[0] != sha1:
+                stderr += 'Checksum of {} does not match {}, expected sha1 {}'.format(
+                    remote_file, local_path, sha1).encode()
+                returncode = 1
+        if returncode == 0:
+            fan_out.sources.put_nowait(host)
+
+        process_output = {
+            '{}:{}'.format(host.ip, host.port): {
+                "cmd": full_cmd,
+                "stdout": stdout.decode().split('\n'),
+                "stderr": stderr.decode().split('\n'),
+                "returncode": returncode,
+                "pid": process.pid,
+                "stage": stage
+            }
+        }
+
+        future.set_result((namespace, process_output, host))
+        return process_output
+
+    def _group_commands(self, commands):
+        """Split a chain's commands into the groups run together, see batch_commands."""
+        groups = []
+        for command in commands:
+            if (self.batch_commands and groups and command[0] == CommandChain.execute_flag and
+                    groups[-1][-1][0] == CommandChain.execute_flag):
+                groups[-1].append(command)
+            else:
+                groups.append([command])
+        return groups
+
+    def _run_chain_command(self, chain: CommandChain, host, chain_result, scheduler=None):
 
         # Prepare status json
         if self.async_delegate is not None:
@@ -184,7 +611,8 @@ class MultiRunner():
 
         command_map = {
             CommandChain.execute_flag: self.run_async,
-            CommandChain.copy_flag: self.copy_async
+            CommandChain.copy_flag: self.copy_async,
+            CommandChain.distribute_flag: self.distribute_async
         }
 
         process_exit_code_map = {
@@ -201,37 +629,59 @@ class MultiRunner():
                 'host_status_count': 'hosts_failed'
             }
         }
-        for command in chain.get_commands():
-            stage = command[-1]
-            if stage is not None:
-                # a stage can be a function which takes a Node() object and does evaluation
-                if callable(stage):
-                    stage = stage(host)
-                log.debug('{}: {}'.format(host_port, stage))
-            future = asyncio.Future()
-
-            if self.async_delegate is not None:
-                log.debug('Using async_delegate with callback')
-                callback_called = asyncio.Future()
-                future.add_done_callback(lambda future: self.async_delegate.on_update(future, callback_called))
-
-            # command[0] is a type of a command, could be CommandChain.execute_flag, CommandChain.copy_flag
-            result = yield from command_map.get(command[0], None)(host, command, chain.namespace, future, stage)
-            status = process_exit_code_map.get(result[host_port]['returncode'], process_exit_code_map['failed'])
-            host_status = status['host_status']
-
-            if self.async_delegate is not None:
-                # We need to make sure the callback was executed before we can proceed further
-                # 5 seconds should be enough for a callback.
-                try:
-                    yield from asyncio.wait_for(callback_called, 5)
-                except asyncio.TimeoutError:
-                    log.error('Callback did not execute within 5 sec')
-                    host_status = 'terminated'
+        for commands in self._group_commands(chain.get_commands()):
+            stages = []
+            futures = []
+            callbacks_called = []
+            for command in commands:
+                stage = command[-1]
+                if stage is not None:
+                    # a stage can be a function which takes a Node() object and does evaluation
+                    if callable(stage):
+                        stage = stage(host)
+                    log.debug('{}: {}'.format(host_port, stage))
+                stages.append(stage)
+                future = asyncio.Future()
+                futures.append(future)
+
+                if self.async_delegate is not None:
+                    log.debug('Using async_delegate with callback')
+                    callback_called = asyncio.Future()
+                    callbacks_called.append(callback_called)
+                    future.add_done_callback(
+                        lambda future, callback_called=callback_called: self.async_delegate.on_update(
+                            future, callback_called))
+
+            start = time.time()
+            if len(commands) == 1:
+                # command[0] is a type of a command, could be CommandChain.execute_flag, CommandChain.copy_flag
+                command = commands[0]
+                results = [(yield from command_map.get(command[0], None)(
+                    host, command, chain.namespace, futures[0], stages[0]))]
+            else:
+                results = yield from self.run_batch_async(host, commands, chain.namespace, futures, stages)
+            if scheduler is not None:
+                scheduler.observe(tuple(stages), time.time() - start)
+
+            for index, result in enumerate(results):
+                status = process_exit_code_map.get(result[host_port]['returncode'], process_exit_code_map['failed'])
+                host_status = status['host_status']
+
+                if self.async_delegate is not None:
+                    # We need to make sure the callback was executed before we can proceed further
+                    # 5 seconds should be enough for a callback.
+                    try:
+                        yield from asyncio.wait_for(callbacks_called[index], 5)
+                    except asyncio.TimeoutError:
+                        log.error('Callback did not execute within 5 sec')
+                        host_status = 'terminated'
+                        break
+
+                _, result, host_object = futures[index].result()
+                chain_result.append(result)
+                if host_status != 'success':
                     break
 
-            _, result, host_object = future.result()
-            chain_result.append(result)
             if host_status != 'success':
                 break
 
@@ -240,17 +690,26 @@ class MultiRunner():
             self.async_delegate.on_done(chain.namespace, result, host_status=host_status)
 
     @asyncio.coroutine
-    def dispatch_chain(self, host, chains, sem):
+    def dispatch_chain(self, host, chains, scheduler):
         log.debug('Started dispatch_chain for host {}'.format(host))
         chain_result = []
-        with (yield from sem):
-            for chain in chains:
-                yield from self._run_chain_command(chain, host, chain_result)
+        yield from scheduler.acquire()
+        try:
+            if self.connection_reuse:
+                yield from self.open_connection(host)
+            try:
+                for chain in chains:
+                    yield from self._run_chain_command(chain, host, chain_result, scheduler)
+            finally:
+                if self.connection_reuse:
+                    yield from self.close_connection(host)
+        finally:
+            scheduler.release()
         return chain_result
 
     @asyncio.coroutine
     def run_commands_chain_async(self, chains: list, block=False, state_json_dir=None, delegate_extra_params={}):
-        sem = asyncio.Semaphore(self.__parallelism)
+        scheduler = Scheduler(self.__parallelism, self.__max_parallelism)
 
         if state_json_dir:
             log.debug('Using default JsonDelegate method, state_json_dir {}'.format(state_json_dir))
@@ -260,17 +719,30 @@ class MultiRunner():
 
         if block:
             log.debug('Waiting for run_command_chain_async to execute')
-            tasks = []
-            for host in self.__targets:
-                tasks.append(asyncio.async(self.dispatch_chain(host, chains, sem)))
-
-            yield from asyncio.wait(tasks)
+            result = yield from self.dispatch_chains(chains, scheduler)
             log.debug('run_command_chain_async executed')
-            return [task.result() for task in tasks]
+            return result
         else:
             log.debug('Started run_command_chain_async in non-blocking mode')
+            asyncio.async(self.dispatch_chains(chains, scheduler))
+
+    @asyncio.coroutine
+    def dispatch_chains(self, chains, scheduler):
+        distribute = any(command[0] == CommandChain.distribute_flag
+                         for chain in chains for command in chain.get_commands())
+        if distribute and len(self.__targets) > 1:
+            yield from self.start_agent()
+
+        try:
+            tasks = []
             for host in self.__targets:
-                asyncio.async(self.dispatch_chain(host, chains, sem))
+                tasks.append(asyncio.async(self.dispatch_chain(host, chains, scheduler)))
+
+            yield from asyncio.wait(tasks)
+        finally:
+            self.__fan_outs = {}
+            yield from self.stop_agent()
+        return [task.result() for task in tasks]
 
     def validate(self):
         """Raises an AssertException if validation does not pass"""
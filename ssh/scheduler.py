@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import resource
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler():
+    """Limits how many hosts MultiRunner works on at once, like a semaphore whose size can change.
+
+    The limit starts at parallelism. If max_parallelism is larger, the limit grows by one each time a
+    command completes about as fast as the fastest run of the same stage so far, and halves (never going
+    below parallelism) when one is more than slowdown times slower. Hosts getting slow to respond is the
+    sign the bootstrap machine or its network is saturated. The limit doesn't grow past what the local
+    machine can sustain: the open file descriptor and process limits, and a load average above the
+    number of CPUs.
+    """
+    # Pipes and pty for the ssh / scp process, its master connection, and slack.
+    fds_per_host = 12
+    # The ssh / scp process and its master connection.
+    processes_per_host = 2
+    slowdown = 2
+    # Quick commands vary by more than slowdown, so don't back off over differences below this.
+    min_slowdown_seconds = 1
+
+    def __init__(self, parallelism, max_parallelism=None):
+        self.parallelism = parallelism
+        self.max_parallelism = max(parallelism, max_parallelism or parallelism)
+        self.limit = parallelism
+        self.active = 0
+        self.__waiters = []
+        self.__fastest = {}
+
+    @asyncio.coroutine
+    def acquire(self):
+        while self.active >= self.limit:
+            waiter = asyncio.Future()
+            self.__waiters.append(waiter)
+            yield from waiter
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.__wake()
+
+    def __wake(self):
+        free = self.limit - self.active
+        while free > 0 and self.__waiters:
+            waiter = self.__waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def get_local_limit(self):
+        """The number of hosts the local machine has the resources to work on at once."""
+        limit = self.max_parallelism
+        fds, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if fds != resource.RLIM_INFINITY and os.path.isdir('/proc/self/fd'):
+            # The hosts being worked on already have their descriptors open.
+            limit = min(limit, self.active + (fds - len(os.listdir('/proc/self/fd'))) // self.fds_per_host)
+        processes, _ = resource.getrlimit(resource.RLIMIT_NPROC)
+        if processes != resource.RLIM_INFINITY:
+            # Leave half of the user's processes for everything else running as them.
+            limit = min(limit, processes // 2 // self.processes_per_host)
+        return limit
+
+    def observe(self, stage, duration):
+        """Adjust the limit after a command of stage took duration seconds on a host."""
+        fastest = min(self.__fastest.get(stage, duration), duration)
+        self.__fastest[stage] = fastest
+        if self.max_parallelism == self.parallelism:
+            return
+
+        if duration > fastest * self.slowdown + self.min_slowdown_seconds:
+            limit = max(self.parallelism, self.limit // 2)
+            if limit != self.limit:
+                log.debug('{} took {:.1f}s rather than {:.1f}s, working on {} hosts at once instead of {}'.format(
+                    stage, duration, fastest, limit, self.limit))
+            self.limit = limit
+        elif self.limit < self.get_local_limit() and os.getloadavg()[0] < os.cpu_count():
+            self.limit += 1
+            self.__wake()
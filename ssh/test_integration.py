@@ -228,18 +228,51 @@ def test_scp_recursive_async(sshd_manager, loop):
                     assert workspace + '/recursive_pilot.txt' in process_result['cmd']
 
 
+def test_ssh_connection_reuse_async(sshd_manager, loop):
+    with sshd_manager.run(2) as sshd_ports:
+        workspace = str(sshd_manager.tmpdir)
+        pkgpanda.util.write_string(workspace + '/pilot.txt', 'pilot')
+        runner = MultiRunner(['127.0.0.1:{}'.format(port) for port in sshd_ports], user=getpass.getuser(),
+                             key_path=sshd_manager.key_path, connection_reuse=True)
+
+        chain = CommandChain('test')
+        chain.add_execute(['uname', '-a'])
+        chain.add_copy(workspace + '/pilot.txt', workspace + '/pilot.txt.copied')
+        chain.add_execute(['cat', workspace + '/pilot.txt.copied'])
+        try:
+            results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                              state_json_dir=workspace))
+        finally:
+            loop.close()
+
+        control_dirs = set()
+        for host_result in results:
+            assert len(host_result) == 3
+            for command_result in host_result:
+                for host, process_result in command_result.items():
+                    assert process_result['returncode'] == 0, process_result['stderr']
+                    control_paths = [opt for opt in process_result['cmd'] if opt.startswith('-oControlPath=')]
+                    assert len(control_paths) == 1
+                    control_dirs.add(os.path.dirname(control_paths[0][len('-oControlPath='):]))
+            assert 'pilot' in host_result[2][host]['stdout'][0]
+
+        # Each host got its own master connection, which was closed after its chains ran.
+        assert len(control_dirs) == 2
+        assert not any(os.path.exists(d) for d in control_dirs)
+
+
 def test_command_chain():
     chain = CommandChain('test')
     chain.add_execute(['cmd2'])
     chain.add_copy('/local', '/remote')
     chain.prepend_command(['cmd1'])
-    chain.add_execute(['cmd3'])
+    chain.add_execute(['cmd3'], timeout=600)
 
     assert chain.get_commands() == [
-        ('execute', ['cmd1'], None, None),
-        ('execute', ['cmd2'], None, None),
-        ('copy', '/local', '/remote', False, False, None),
-        ('execute', ['cmd3'], None, None)
+        ('execute', ['cmd1'], None, None, None),
+        ('execute', ['cmd2'], None, None, None),
+        ('copy', '/local', '/remote', False, False, None, None),
+        ('execute', ['cmd3'], None, 600, None)
     ]
 
 
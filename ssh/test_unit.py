@@ -1,10 +1,18 @@
+import asyncio
 import copy
+import getpass
+import json
 import os
+import subprocess
 import tempfile
+import time
 
 import pytest
 
 import ssh.validate
+from ssh.runner import MultiRunner
+from ssh.scheduler import Scheduler
+from ssh.utils import CommandChain, JsonStateStore, SyncCmdDelegate
 
 
 @pytest.fixture
@@ -111,3 +119,334 @@ def test_ssh_parallelism(default_config):
         default_config['ssh_parallelism'] = 'foo'
         assert ssh.validate.validate_config(default_config) == {
             'ssh_parallelism': 'Must be an integer but got a str: foo'}
+
+
+def test_ssh_peer_distribution(default_config):
+    with tempfile.NamedTemporaryFile() as tmp:
+        default_config['ssh_key_path'] = tmp.name
+        default_config['ssh_peer_distribution'] = 'true'
+        assert ssh.validate.validate_config(default_config) == {}
+
+        default_config['ssh_peer_distribution'] = 'yes'
+        assert ssh.validate.validate_config(default_config) == {
+            'ssh_peer_distribution': "Must be one of 'true', 'false'. Got 'yes'."}
+
+
+FAKE_SSH = """#!/bin/sh
+# Runs the remote command locally, ignoring everything up to user@host.
+while [ "$1" != "{target}" ]; do
+    shift
+done
+shift
+exec sh -c "$*"
+"""
+
+
+@pytest.yield_fixture
+def loop():
+    default_loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(default_loop)
+
+
+@pytest.mark.parametrize('batch_commands', [False, True])
+def test_batch_commands(tmpdir, loop, batch_commands):
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_SSH.format(target='{}@127.0.0.1'.format(getpass.getuser())))
+    fake_ssh.chmod(0o755)
+
+    runner = MultiRunner(['127.0.0.1:22'], user=getpass.getuser(), key_path='/dev/null',
+                         batch_commands=batch_commands)
+    runner.ssh_bin = str(fake_ssh)
+
+    chain = CommandChain('test')
+    chain.add_execute(['echo', 'one'], stage='first')
+    chain.add_execute(lambda node: ['echo', node.ip], stage=lambda node: 'second')
+    chain.add_execute(['echo', 'three', '&&', 'exit', '3'], stage='third')
+    chain.add_execute(['echo', 'never'], stage='fourth')
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                      state_json_dir=str(tmpdir)))
+
+    # Batched or not, each command ran gets its own result and the chain stops at the failure.
+    assert len(results) == 1
+    outputs = [command_result['127.0.0.1:22'] for command_result in results[0]]
+    assert [(o['stage'], o['returncode'], o['stdout'][0].strip()) for o in outputs] == [
+        ('first', 0, 'one'),
+        ('second', 0, '127.0.0.1'),
+        ('third', 3, 'three')]
+    assert outputs[1]['cmd'][-2:] == ['echo', '127.0.0.1']
+    assert len({o['pid'] for o in outputs}) == (1 if batch_commands else 3)
+
+    with open(str(tmpdir.join('test.json'))) as f:
+        state = json.load(f)
+    assert [c['stage'] for c in state['hosts']['127.0.0.1:22']['commands']] == ['first', 'second', 'third']
+    assert state['hosts']['127.0.0.1:22']['host_status'] == 'failed'
+
+
+@pytest.mark.parametrize('batch_commands', [False, True])
+def test_stream_output(tmpdir, loop, batch_commands):
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_SSH.format(target='{}@127.0.0.1'.format(getpass.getuser())))
+    fake_ssh.chmod(0o755)
+
+    class RecordingDelegate(SyncCmdDelegate):
+        def __init__(self):
+            self.output = []
+
+        def on_output(self, name, host, stage, stream_name, lines):
+            self.output += [(stage, stream_name, line) for line in lines]
+
+    delegate = RecordingDelegate()
+    runner = MultiRunner(['127.0.0.1:22'], user=getpass.getuser(), key_path='/dev/null', async_delegate=delegate,
+                         batch_commands=batch_commands, stream_output=True, max_output_lines=10)
+    runner.ssh_bin = str(fake_ssh)
+
+    chain = CommandChain('test')
+    chain.add_execute(['seq', '1', '50'], stage='count')
+    chain.add_execute(['echo', 'error', '>&2', '&&', 'printf', 'last'], stage='last')
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True))
+
+    # The delegate saw all of the output as it was read, the results only keep its end.
+    assert [line for stage, stream_name, line in delegate.output if stage == 'count'] == \
+        [str(i) for i in range(1, 51)]
+    assert ('last', 'stderr', 'error') in delegate.output
+    assert ('last', 'stdout', 'last') in delegate.output
+    outputs = [command_result['127.0.0.1:22'] for command_result in results[0]]
+    assert outputs[0]['stdout'][:2] == ['[40 lines of output not kept]', '41']
+    assert outputs[0]['stdout'][-2:] == ['50', '']
+    assert outputs[1]['stdout'][-1] == 'last'
+    assert 'error' in outputs[1]['stderr']
+
+
+def test_json_state_store(tmpdir, loop):
+    store = JsonStateStore()
+    store.flush_interval = 0.1
+    path = str(tmpdir.join('test.json'))
+
+    # Updates are kept in memory, and written out together after the interval.
+    store.set(path, {'hosts': {}})
+    store.get(path)['hosts']['127.0.0.1:22'] = {'host_status': 'running'}
+    store.set(path, store.get(path))
+    assert not os.path.exists(path)
+    loop.run_until_complete(asyncio.sleep(0.2))
+    with open(path) as f:
+        assert json.load(f) == {'hosts': {'127.0.0.1:22': {'host_status': 'running'}}}
+
+    # Unless they're flushed right away.
+    store.set(path, {'hosts': {}}, flush=True)
+    with open(path) as f:
+        assert json.load(f) == {'hosts': {}}
+    assert tmpdir.listdir() == [tmpdir.join('test.json')]
+
+    # A forgotten state is read from the file again.
+    store.forget(path)
+    with open(path, 'w') as f:
+        json.dump({'chain_name': 'test'}, f)
+    assert store.get(path) == {'chain_name': 'test'}
+    assert store.get(str(tmpdir.join('missing.json'))) is None
+
+
+def test_stage_timeout(tmpdir, loop):
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_SSH.format(target='{}@127.0.0.1'.format(getpass.getuser())))
+    fake_ssh.chmod(0o755)
+
+    runner = MultiRunner(['127.0.0.1:22'], user=getpass.getuser(), key_path='/dev/null', process_timeout=0.5)
+    runner.ssh_bin = str(fake_ssh)
+
+    chain = CommandChain('test')
+    chain.add_execute(['sleep', '1', '&&', 'echo', 'slow'], stage='slow', timeout=10)
+    chain.add_execute(['sleep', '1', '&&', 'echo', 'slower'], stage='default')
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                      state_json_dir=str(tmpdir)))
+
+    outputs = [command_result['127.0.0.1:22'] for command_result in results[0]]
+    assert [(o['stage'], o['returncode']) for o in outputs] == [('slow', 0), ('default', None)]
+
+
+def test_scheduler(loop, monkeypatch):
+    scheduler = Scheduler(2, 4)
+    monkeypatch.setattr(scheduler, 'get_local_limit', lambda: 3)
+    monkeypatch.setattr(os, 'getloadavg', lambda: (0, 0, 0))
+
+    @asyncio.coroutine
+    def acquire_all(count):
+        tasks = [asyncio.async(scheduler.acquire()) for _ in range(count)]
+        yield from asyncio.sleep(0.01)
+        return tasks
+
+    tasks = loop.run_until_complete(acquire_all(4))
+    assert [task.done() for task in tasks] == [True, True, False, False]
+
+    # Commands completing as fast as before let it work on more hosts, up to what the machine can take.
+    scheduler.observe('stage', 1)
+    scheduler.observe('stage', 1.5)
+    scheduler.observe('stage', 1)
+    assert scheduler.limit == 3
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert [task.done() for task in tasks] == [True, True, True, False]
+
+    # A slowdown backs off, but not below parallelism.
+    scheduler.observe('stage', 10)
+    assert scheduler.limit == 2
+    scheduler.release()
+    scheduler.release()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert tasks[3].done()
+    assert scheduler.active == 2
+
+    # Without a max_parallelism it's a semaphore.
+    fixed = Scheduler(2)
+    fixed.observe('stage', 1)
+    assert fixed.limit == 2
+    assert fixed.get_local_limit() == 2
+
+
+FAKE_DISTRIBUTE_SSH = """#!/bin/sh
+# Runs the remote command locally, with /remote being a directory per host.
+while true; do
+    case "$1" in
+        *@*) break ;;
+    esac
+    shift
+done
+host=${{1#*@}}
+shift
+exec sh -c "$(echo " $*" | sed "s# /remote# {root}/$host/remote#g")"
+"""
+
+FAKE_DISTRIBUTE_SCP = """#!/bin/sh
+# Copies locally, user@host:/path being a directory per host.
+for arg; do
+    case "$arg" in
+        -*) ;;
+        *@*) dest={root}/$(echo "${{arg#*@}}" | tr : /) ;;
+        *) src=$arg ;;
+    esac
+done
+echo "$src" >> {root}/copies
+case "$src" in
+    {fail}*) exit 1 ;;
+    {root}*) ;;
+    *) sleep 1 ;;
+esac
+cp "$src" "$dest"
+case "$dest" in
+    {corrupt}*) echo corrupted >> "$dest/$(basename "$src")" ;;
+esac
+"""
+
+
+@pytest.mark.parametrize('corrupt', [False, True])
+def test_distribute(tmpdir, loop, corrupt):
+    hosts = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+    root = tmpdir.join('hosts')
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_DISTRIBUTE_SSH.format(root=root))
+    fake_scp = tmpdir.join('scp')
+    fake_scp.write(FAKE_DISTRIBUTE_SCP.format(
+        root=root, corrupt=root.join('127.0.0.3') if corrupt else 'none', fail='none'))
+    for fake in [fake_ssh, fake_scp]:
+        fake.chmod(0o755)
+    key_path = tmpdir.join('key')
+    subprocess.check_call(['ssh-keygen', '-q', '-N', '', '-f', str(key_path)])
+    tmpdir.join('package.tar.xz').write('package')
+
+    runner = MultiRunner(hosts, user=getpass.getuser(), key_path=str(key_path))
+    runner.ssh_bin = str(fake_ssh)
+    runner.scp_bin = runner.peer_scp_bin = str(fake_scp)
+    runner.local_copies = 1
+
+    chain = CommandChain('test')
+    chain.add_execute(['mkdir', '-p', '/remote/packages'], stage='Creating package directory')
+    chain.add_distribute(str(tmpdir.join('package.tar.xz')), '/remote/packages', stage='Copying packages')
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                      state_json_dir=str(tmpdir)))
+
+    copies = {}
+    for host, host_results in zip(hosts, results):
+        copies[host] = host_results[-1]['{}:22'.format(host)]
+        assert copies[host]['stage'] == 'Copying packages'
+    # Copies from here are slow, so while the second host gets the file from here, the third one gets it
+    # from the first.
+    assert sum('-A' in copy['cmd'] for copy in copies.values()) == 1
+
+    for host in hosts:
+        if corrupt and host == '127.0.0.3':
+            assert copies[host]['returncode'] == 1
+            assert 'Checksum of /remote/packages/package.tar.xz does not match' in '\n'.join(
+                copies[host]['stderr'])
+        else:
+            assert copies[host]['returncode'] == 0
+            assert root.join(host, 'remote', 'packages', 'package.tar.xz').read() == 'package'
+
+
+def test_distribute_peer_failure(tmpdir, loop):
+    hosts = ['127.0.0.{}'.format(i) for i in range(1, 9)]
+    root = tmpdir.join('hosts')
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_DISTRIBUTE_SSH.format(root=root))
+    fake_scp = tmpdir.join('scp')
+    # The hosts can't reach each other.
+    fake_scp.write(FAKE_DISTRIBUTE_SCP.format(root=root, corrupt='none', fail=root))
+    for fake in [fake_ssh, fake_scp]:
+        fake.chmod(0o755)
+    key_path = tmpdir.join('key')
+    subprocess.check_call(['ssh-keygen', '-q', '-N', '', '-f', str(key_path)])
+    tmpdir.join('package.tar.xz').write('package')
+
+    runner = MultiRunner(hosts, user=getpass.getuser(), key_path=str(key_path))
+    runner.ssh_bin = str(fake_ssh)
+    runner.scp_bin = runner.peer_scp_bin = str(fake_scp)
+
+    chain = CommandChain('test')
+    chain.add_execute(['mkdir', '-p', '/remote/packages'], stage='Creating package directory')
+    chain.add_distribute(str(tmpdir.join('package.tar.xz')), '/remote/packages', stage='Copying packages')
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                      state_json_dir=str(tmpdir)))
+
+    # Hosts which fail to get the file from another host get it from here instead, and the other
+    # host isn't tried again.
+    peer_copies = [src for src in root.join('copies').read().split() if src.startswith(str(root))]
+    assert peer_copies
+    assert len(set(peer_copies)) == len(peer_copies)
+    for host, host_results in zip(hosts, results):
+        copy = host_results[-1]['{}:22'.format(host)]
+        assert copy['returncode'] == 0
+        assert '-A' not in copy['cmd']
+        assert root.join(host, 'remote', 'packages', 'package.tar.xz').read() == 'package'
+
+
+def test_distribute_without_agent(tmpdir, loop):
+    hosts = ['127.0.0.1', '127.0.0.2', '127.0.0.3', '127.0.0.4']
+    root = tmpdir.join('hosts')
+    fake_ssh = tmpdir.join('ssh')
+    fake_ssh.write(FAKE_DISTRIBUTE_SSH.format(root=root))
+    fake_scp = tmpdir.join('scp')
+    fake_scp.write(FAKE_DISTRIBUTE_SCP.format(root=root, corrupt='none', fail='none'))
+    for fake in [fake_ssh, fake_scp]:
+        fake.chmod(0o755)
+    tmpdir.join('package.tar.xz').write('package')
+
+    runner = MultiRunner(hosts, user=getpass.getuser(), key_path='/dev/null')
+    runner.ssh_bin = str(fake_ssh)
+    runner.scp_bin = runner.peer_scp_bin = str(fake_scp)
+    runner.ssh_agent_bin = str(tmpdir.join('missing'))
+
+    chain = CommandChain('test')
+    chain.add_execute(['mkdir', '-p', '/remote/packages'], stage='Creating package directory')
+    chain.add_distribute(str(tmpdir.join('package.tar.xz')), '/remote/packages', stage='Copying packages')
+    start = time.monotonic()
+    results = loop.run_until_complete(runner.run_commands_chain_async([chain], block=True,
+                                                                      state_json_dir=str(tmpdir)))
+
+    # All the hosts get the file from here at once, each copy taking a second.
+    assert time.monotonic() - start < len(hosts)
+    for host, host_results in zip(hosts, results):
+        copy = host_results[-1]['{}:22'.format(host)]
+        assert copy['returncode'] == 0
+        assert copy['cmd'][0] == str(fake_scp)
+        assert root.join(host, 'remote', 'packages', 'package.tar.xz').read() == 'package'
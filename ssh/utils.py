@@ -1,8 +1,10 @@
 import abc
+import asyncio
 import datetime
 import json
 import logging
 import os
+import tempfile
 from typing import Callable, Union
 
 log = logging.getLogger(__name__)
@@ -15,28 +17,39 @@ class CommandChain():
     :param cmd: String, command to execute
     :param rollback: String (optional) a rollback command
     :param stage: String (optional)
+    :param timeout: Number of seconds (optional) the command may take, rather than the runner's process_timeout
     :return:
     '''
     execute_flag = 'execute'
     copy_flag = 'copy'
+    distribute_flag = 'distribute'
 
     def __init__(self, namespace):
         self.commands_stack = []
         self.namespace = namespace
 
-    def add_execute(self, cmd: Union[list, Callable], rollback=None, stage=None):
-        self.commands_stack.append((self.execute_flag, cmd, rollback, stage))
+    def add_execute(self, cmd: Union[list, Callable], rollback=None, stage=None, timeout=None):
+        self.commands_stack.append((self.execute_flag, cmd, rollback, timeout, stage))
 
-    def add_copy(self, local_path, remote_path, remote_to_local=False, recursive=False, stage=None):
-        self.commands_stack.append((self.copy_flag, local_path, remote_path, remote_to_local, recursive, stage))
+    def add_copy(self, local_path, remote_path, remote_to_local=False, recursive=False, stage=None, timeout=None):
+        self.commands_stack.append(
+            (self.copy_flag, local_path, remote_path, remote_to_local, recursive, timeout, stage))
+
+    def add_distribute(self, local_path, remote_dir, stage=None, timeout=None):
+        # Copy a local file into remote_dir on every host. Hosts which already received it may
+        # serve it to the others, and the copy is verified against the local file's checksum.
+        # A host serving the file does so over ssh -A, with an agent holding the runner's key
+        # forwarded to it, so root on it can reach every other host while the copy runs. Only
+        # use this when the hosts trust each other, otherwise use add_copy.
+        self.commands_stack.append((self.distribute_flag, local_path, remote_dir, timeout, stage))
 
     def get_commands(self):
         # Return all commands
         return self.commands_stack
 
-    def prepend_command(self: list, cmd, rollback=None, stage=None):
+    def prepend_command(self: list, cmd, rollback=None, stage=None, timeout=None):
         # We can specify a command to be executed before the main chain of commands, for example some setup commands
-        self.commands_stack.insert(0, (self.execute_flag, cmd, rollback, stage))
+        self.commands_stack.insert(0, (self.execute_flag, cmd, rollback, timeout, stage))
 
 
 class AbstractSSHLibDelegate(metaclass=abc.ABCMeta):
@@ -71,6 +84,105 @@ class AbstractSSHLibDelegate(metaclass=abc.ABCMeta):
         :return:
         '''
 
+    def on_output(self, name, host, stage, stream_name, lines):
+        '''
+        A method called with the lines a command outputs as it runs, if the runner streams output
+        :param name: A unique chain identifier
+        :param host: The ssh.Node the command runs on
+        :param stage: String, the stage of the command
+        :param stream_name: String, stdout or stderr
+        :param lines: A list of lines, without their newline
+        :return:
+        '''
+        pass
+
+
+class JsonStateStore():
+    '''
+    The state of chains run with a JsonDelegate, kept in memory by the path of its json file.
+
+    A changed state is written out at most every flush_interval seconds rather than on every update,
+    replacing the file with a complete new one so readers of the file never see a partial write.
+    '''
+    flush_interval = 1
+
+    def __init__(self):
+        self.states = {}
+        self.dirty = set()
+        self.subscribers = {}
+        self.__flush_handle = None
+        self.__flush_loop = None
+
+    def get(self, path):
+        '''
+        The state stored at path, read from the file if it isn't in memory. None if there is none.
+        The state is shared, it must be changed through set()
+        '''
+        if path not in self.states:
+            if not os.path.isfile(path):
+                return None
+            with open(path) as f:
+                self.states[path] = json.load(f)
+        return self.states[path]
+
+    def set(self, path, state, flush=False):
+        self.states[path] = state
+        self.dirty.add(path)
+        if flush:
+            self.flush(path)
+            return
+
+        # Only one flush is pending at a time, in the loop the updates come from.
+        loop = asyncio.get_event_loop()
+        if self.__flush_handle is not None and self.__flush_loop is loop and not loop.is_closed():
+            return
+        self.__flush_loop = loop
+        self.__flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self, path=None):
+        '''Write the state at path, or all changed states, to disk.'''
+        if path is None:
+            if self.__flush_handle is not None:
+                self.__flush_handle.cancel()
+                self.__flush_handle = None
+            paths = list(self.dirty)
+        else:
+            paths = [path] if path in self.dirty else []
+
+        for path in paths:
+            self.dirty.discard(path)
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.states[path], f)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except IOError:
+                log.error('Could not update state file {}'.format(path))
+
+    def forget(self, path):
+        '''Drop the state at path from memory, for when its file is removed or changed elsewhere.'''
+        self.states.pop(path, None)
+        self.dirty.discard(path)
+
+    def subscribe(self, path):
+        '''Return an asyncio.Queue which gets the (event, data) published for the state at path.'''
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(path, []).append(queue)
+        return queue
+
+    def unsubscribe(self, path, queue):
+        self.subscribers[path].remove(queue)
+        if not self.subscribers[path]:
+            del self.subscribers[path]
+
+    def publish(self, path, event, data):
+        for queue in self.subscribers.get(path, []):
+            queue.put_nowait((event, data))
+
+
+json_state_store = JsonStateStore()
+
 
 class JsonDelegate(AbstractSSHLibDelegate):
     def __init__(self, state_dir, targets_len, total_hosts=None, total_masters=None, total_agents=None, **kwargs):
@@ -98,19 +210,14 @@ class JsonDelegate(AbstractSSHLibDelegate):
 
     def _read_json_state(self, name):
         status_file = os.path.join(self.state_dir, '{}.json'.format(name))
-        if os.path.isfile(status_file):
-            with open(status_file) as f:
-                return json.load(f)
-        return {}
+        return json_state_store.get(status_file) or {}
 
-    def _dump_json_state(self, name, status_json):
+    def _dump_json_state(self, name, status_json, flush=False):
         status_file = os.path.join(self.state_dir, '{}.json'.format(name))
+        json_state_store.set(status_file, status_json, flush=flush)
 
-        with open(status_file, 'w') as f:
-            try:
-                json.dump(status_json, f)
-            except IOError:
-                log.error('Could not update state file {}'.format(status_file))
+    def _publish(self, name, event, data):
+        json_state_store.publish(os.path.join(self.state_dir, '{}.json'.format(name)), event, data)
 
     def on_update(self, future, callback_called):
         self._update_json_file(*future.result(), future_update=True, callback_called=callback_called)
@@ -145,11 +252,23 @@ class JsonDelegate(AbstractSSHLibDelegate):
                         status_json['hosts'][host]['host_status'] == 'unstarted'):
                     status_json['hosts'][host]['host_status'] = 'running'
 
+                self._publish(name, 'command', {
+                    'host': host,
+                    'host_status': status_json['hosts'][host]['host_status'],
+                    'command': return_values})
+
         # Update chain status: success or fail
         if host_status:
             status_json['hosts'][host]['host_status'] = host_status
-
-        self._dump_json_state(name, status_json)
+            self._publish(name, 'host_status', {'host': host, 'host_status': host_status})
+
+        # Write the state out right away once the chain is done on all the hosts.
+        done = host_status is not None and all(
+            host_state.get('host_status') not in ('unstarted', 'running')
+            for host_state in status_json['hosts'].values())
+        self._dump_json_state(name, status_json, flush=done)
+        if done:
+            self._publish(name, 'done', {})
         if callback_called:
                 callback_called.set_result(True)
 
@@ -172,6 +291,7 @@ class JsonDelegate(AbstractSSHLibDelegate):
             json_status['hosts'][ip_port]['host_status'] = 'unstarted'
 
         self._dump_json_state(name, json_status)
+        self._publish(name, 'state', json_status)
 
 
 class SyncCmdDelegate(AbstractSSHLibDelegate):
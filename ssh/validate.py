@@ -39,7 +39,9 @@ source = Source({
         lambda agent_list, public_agent_list: compare_lists(agent_list, public_agent_list),
         validate_ssh_key_path,
         lambda ssh_port: gen.calc.validate_int_in_range(ssh_port, 1, 32000),
-        lambda ssh_parallelism: gen.calc.validate_int_in_range(ssh_parallelism, 1, 100)
+        lambda ssh_parallelism: gen.calc.validate_int_in_range(ssh_parallelism, 1, 100),
+        lambda ssh_max_parallelism: gen.calc.validate_int_in_range(ssh_max_parallelism, 1, 1000),
+        lambda ssh_peer_distribution: gen.calc.validate_true_false(ssh_peer_distribution)
     ],
     'default': {
         'ssh_key_path': 'genconf/ssh_key',
@@ -47,7 +49,9 @@ source = Source({
         'public_agent_list': '[]',
         'ssh_port': '22',
         'process_timeout': '120',
-        'ssh_parallelism': '20'
+        'ssh_parallelism': '20',
+        'ssh_max_parallelism': '100',
+        'ssh_peer_distribution': 'false'
     }
 })
 
@@ -61,6 +65,8 @@ def get_target():
         'agent_list',
         'public_agent_list',
         'ssh_parallelism',
+        'ssh_max_parallelism',
+        'ssh_peer_distribution',
         'process_timeout'})
 
 